@@ -1,13 +1,30 @@
 import requests
+import atexit
 import json
 import logging
-from flask import Flask, request, jsonify, render_template
+import math
+from flask import Flask, Response, request, jsonify, render_template, stream_with_context
 from flask_cors import CORS
 import os
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from dotenv import load_dotenv
 
 # Importa serviços de otimização
 from utils.route_optimizer import RouteOptimizer
+from services.metrics import metrics
+from services.ors import ORSService
+from services.resilience import CircuitOpenError, breaker_stats
+from services.cache import build_cache
+from utils.compression import init_compression
+from utils.geometry import decode_polyline
+from utils.gps_index import GPSSpatialIndex, summarize_devices
+from utils.gps_ingest import GPSIngestor, GPSLogWriter, decode_delta_fixes, fixes_to_records
+from utils.trajectory import DeviceRouteRegistry, TrajectoryCompressor
+from utils.reasoning_broker import ReasoningBroker
+from utils.route_cache import RouteCache
+from utils.route_format import RESPONSE_FORMATS, format_route_response
 
 # ========================================================================
 # CARREGAMENTO SEGURO DE VARIÁVEIS DE AMBIENTE
@@ -36,6 +53,35 @@ GROQ_API_KEY = os.environ.get('GROQ_API_KEY')
 
 optimization_available = all([TOMTOM_API_KEY, OPENWEATHER_API_KEY, GROQ_API_KEY])
 
+# Justificativas do LLM entregues depois da rota (SSE em /rota/reasoning/<id>)
+reasoning_broker = ReasoningBroker(ttl_s=float(os.environ.get('REASONING_TTL_S', '300')))
+
+# Configuração comum ao RouteOptimizer (Flask) e ao AsyncRouteOptimizer (asgi.py)
+OPTIMIZER_SETTINGS = dict(
+    tomtom_key=TOMTOM_API_KEY,
+    openweather_key=OPENWEATHER_API_KEY,
+    groq_key=GROQ_API_KEY,
+    # Prazo total (s) para o enriquecimento climático paralelo de cada /rota
+    enrichment_deadline_s=float(os.environ.get('ENRICHMENT_DEADLINE_S', '4.0')),
+    # Cache de clima: Redis (docker-compose) com fallback em memória
+    redis_url=os.environ.get('REDIS_URL'),
+    weather_cache_ttl_s=float(os.environ.get('WEATHER_CACHE_TTL_S', '600')),
+    weather_geohash_precision=int(os.environ.get('WEATHER_GEOHASH_PRECISION', '6')),
+    # Pontos de clima amostrados ao longo de cada rota candidata
+    corridor_samples=int(os.environ.get('WEATHER_CORRIDOR_SAMPLES', '5')),
+    # Decisões do LLM reaproveitadas para requisições equivalentes
+    llm_cache_ttl_s=float(os.environ.get('LLM_CACHE_TTL_S', '900')),
+    # Diferença relativa abaixo da qual a escolha é delegada ao LLM
+    llm_margin=float(os.environ.get('LLM_DECISION_MARGIN', '0.05')),
+    reasoning_broker=reasoning_broker,
+    # Espera máxima (s) pela decisão do LLM em streaming antes da escolha local
+    llm_decision_timeout_s=float(os.environ.get('LLM_DECISION_TIMEOUT_S', '10')),
+    # Justificativa do LLM também para escolhas locais (1 = uma chamada Groq por rota)
+    llm_explain_local=os.environ.get('LLM_EXPLAIN_LOCAL', '0') == '1',
+    # Hedging do routing TomTom: fração máxima de chamadas extras (0 = desativado)
+    tomtom_hedge_budget=float(os.environ.get('TOMTOM_HEDGE_BUDGET', '0'))
+)
+
 if not optimization_available:
     logger.warning("⚠️ Chaves de otimização ausentes. Modo de otimização desabilitado.")
     logger.warning("   Para habilitar: configure TOMTOM_API_KEY, OPENWEATHER_API_KEY e GROQ_API_KEY no .env")
@@ -43,21 +89,144 @@ if not optimization_available:
 else:
     # Inicializa o otimizador apenas se todas as chaves estiverem disponíveis
     route_optimizer = RouteOptimizer(
-        tomtom_key=TOMTOM_API_KEY,
-        openweather_key=OPENWEATHER_API_KEY,
-        groq_key=GROQ_API_KEY
+        **OPTIMIZER_SETTINGS,
+        # Micro-batching de análises do LLM sob carga (1 = desativado)
+        llm_batch_max_size=int(os.environ.get('LLM_BATCH_MAX_SIZE', '1')),
+        llm_batch_max_wait_ms=float(os.environ.get('LLM_BATCH_MAX_WAIT_MS', '15'))
     )
     logger.info("✅ RouteOptimizer inicializado com TomTom + OpenWeather + Groq")
 
 # Variáveis de configuração ORS
-ORS_API_URL = "https://api.openrouteservice.org/v2/directions/driving-car"
 ORS_USE_BEARER = os.environ.get('ORS_USE_BEARER', '0') == '1'
 
+# Cliente ORS compartilhado (pool keep-alive): cada thread do gunicorn pode
+# manter uma chamada em voo, então o pool acompanha GUNICORN_THREADS
+GUNICORN_THREADS = int(os.environ.get('GUNICORN_THREADS', '1'))
+ors_client = ORSService(
+    ORS_API_KEY,
+    use_bearer=ORS_USE_BEARER,
+    pool_size=int(os.environ.get('ORS_POOL_SIZE', max(10, 2 * GUNICORN_THREADS))),
+    max_retries=int(os.environ.get('ORS_MAX_RETRIES', '2')),
+    # Cache de geocoding: Redis se disponível, senão arquivo SQLite local
+    geocode_cache=build_cache(
+        "geocode",
+        ttl_s=ORSService.GEOCODE_TTL_S,
+        max_entries=int(os.environ.get('GEOCODE_CACHE_MAX_ENTRIES', '10000')),
+        redis_url=os.environ.get('REDIS_URL'),
+        sqlite_path=os.environ.get(
+            'GEOCODE_CACHE_PATH',
+            os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'geocode_cache.sqlite3')
+        )
+    )
+)
+
+# Cache de rotas (/rota): grade ~150 m + constraints + janela de tráfego,
+# com stale-while-revalidate para os trajetos mais repetidos
+route_cache = RouteCache(
+    build_cache(
+        "route",
+        ttl_s=float(os.environ.get('ROUTE_CACHE_GEOMETRY_TTL_S', 24 * 3600)),
+        max_entries=int(os.environ.get('ROUTE_CACHE_MAX_ENTRIES', '2000')),
+        redis_url=os.environ.get('REDIS_URL')
+    ),
+    traffic_ttl_s=float(os.environ.get('ROUTE_CACHE_TRAFFIC_TTL_S', '300')),
+    geometry_ttl_s=float(os.environ.get('ROUTE_CACHE_GEOMETRY_TTL_S', 24 * 3600)),
+    stale_ttl_s=float(os.environ.get('ROUTE_CACHE_STALE_TTL_S', '300')),
+    time_bucket_s=float(os.environ.get('ROUTE_CACHE_TIME_BUCKET_S', '900')),
+    geohash_precision=int(os.environ.get('ROUTE_CACHE_GEOHASH_PRECISION', '7'))
+)
+
+# Cabeçalho interno: o entry point ASGI (asgi.py) já tentou a otimização e
+# repassa ao Flask apenas o modo padrão (evita refazer TomTom + clima + Groq)
+OPTIMIZATION_ATTEMPTED_HEADER = 'X-Rota-Optimization-Attempted'
+
+# Pool para chamadas que rodam em paralelo ao pipeline de otimização
+# (ex: geometria ORS enquanto TomTom + clima + Groq calculam a escolha)
+background_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('BACKGROUND_WORKERS', max(4, 2 * GUNICORN_THREADS))),
+    thread_name_prefix="rota-bg"
+)
+
+# Geocoding em lote: pool dedicado (não disputa com /rota) e limite de
+# chamadas simultâneas ao ORS por requisição
+geocode_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('GEOCODE_BATCH_WORKERS', '8')),
+    thread_name_prefix="geocode-batch"
+)
+GEOCODE_BATCH_CONCURRENCY = int(os.environ.get('GEOCODE_BATCH_CONCURRENCY', '4'))
+GEOCODE_BATCH_MAX_ADDRESSES = int(os.environ.get('GEOCODE_BATCH_MAX_ADDRESSES', '500'))
+
+# Índice espacial dos fixes (grade em disco, compartilhada entre processos)
+gps_index = GPSSpatialIndex(
+    os.environ.get(
+        'GPS_INDEX_DIR',
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'gps_index')
+    ),
+    cell_deg=float(os.environ.get('GPS_INDEX_CELL_DEG', '0.01')),
+    segment_interval_s=float(os.environ.get('GPS_INDEX_SEGMENT_INTERVAL_S', '60')),
+    # Teto de segmentos abertos (mmap, um fd cada) por processo
+    max_open_segments=int(os.environ.get('GPS_INDEX_MAX_OPEN_SEGMENTS', '256')),
+    # Manutenção em background: funde segmentos pequenos e aplica a retenção (0 = desligada)
+    compact_interval_s=float(os.environ.get('GPS_INDEX_COMPACT_INTERVAL_S', '60')),
+    compact_fanout=int(os.environ.get('GPS_INDEX_COMPACT_FANOUT', '8')),
+    # Segmentos com fixes mais antigos que isso são apagados (0 = guarda tudo)
+    retention_s=float(os.environ.get('GPS_INDEX_RETENTION_S', 7 * 24 * 3600))
+)
+atexit.register(gps_index.close)
+
+# Rota seguida por cada dispositivo (polyline6 de /rota), compartilhada
+# entre processos pelo Redis; usada para encaixar os fixes na rota
+gps_routes = DeviceRouteRegistry(
+    build_cache(
+        "gps_route",
+        ttl_s=float(os.environ.get('GPS_ROUTE_LOCAL_TTL_S', '5')),
+        max_entries=int(os.environ.get('GPS_ROUTE_MAX_ENTRIES', '10000')),
+        redis_url=os.environ.get('REDIS_URL')
+    ),
+    ttl_s=float(os.environ.get('GPS_ROUTE_TTL_S', 6 * 3600)),
+    local_ttl_s=float(os.environ.get('GPS_ROUTE_LOCAL_TTL_S', '5'))
+)
+
+# Compressão das trilhas antes da gravação (GPS_TRAJECTORY_TOLERANCE_M=0 desliga)
+GPS_TRAJECTORY_TOLERANCE_M = float(os.environ.get('GPS_TRAJECTORY_TOLERANCE_M', '10'))
+gps_compressor = TrajectoryCompressor(
+    tolerance_m=GPS_TRAJECTORY_TOLERANCE_M,
+    stationary_m=float(os.environ.get('GPS_STATIONARY_M', '5')),
+    heartbeat_s=float(os.environ.get('GPS_HEARTBEAT_S', '60')),
+    method=os.environ.get('GPS_TRAJECTORY_METHOD', 'douglas_peucker'),
+    snap_max_m=float(os.environ.get('GPS_SNAP_MAX_M', '25')),
+    route_lookup=gps_routes.get
+) if GPS_TRAJECTORY_TOLERANCE_M > 0 else None
+
+# Ingestão de GPS: ring buffer em memória + thread escritora num log binário
+# append-only (um arquivo por processo em GPS_LOG_DIR) que alimenta o índice
+gps_ingestor = GPSIngestor(
+    GPSLogWriter(
+        os.environ.get(
+            'GPS_LOG_DIR',
+            os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'gps')
+        ),
+        fsync=os.environ.get('GPS_FSYNC', 'interval'),
+        fsync_interval_s=float(os.environ.get('GPS_FSYNC_INTERVAL_S', '1.0'))
+    ),
+    capacity=int(os.environ.get('GPS_BUFFER_CAPACITY', '1000000')),
+    overflow=os.environ.get('GPS_OVERFLOW', 'reject'),
+    batch_size=int(os.environ.get('GPS_FLUSH_BATCH', '16384')),
+    flush_interval_s=float(os.environ.get('GPS_FLUSH_INTERVAL_S', '0.5')),
+    index=gps_index,
+    compressor=gps_compressor
+)
+atexit.register(gps_ingestor.close)
+GPS_BATCH_MAX_FIXES = int(os.environ.get('GPS_BATCH_MAX_FIXES', '10000'))
+GPS_QUERY_MAX_POINTS = int(os.environ.get('GPS_QUERY_MAX_POINTS', '5000'))
+
 # ========================================================================
 # CONFIGURAÇÃO DO FLASK
 # ========================================================================
 app = Flask(__name__, static_url_path='/static', static_folder='static', template_folder='templates')
 CORS(app)
+# Negocia brotli/gzip pelo Accept-Encoding (respostas JSON grandes de /rota)
+init_compression(app, min_size=int(os.environ.get('COMPRESSION_MIN_SIZE', '1024')))
 
 # ========================================================================
 # ENDPOINTS
@@ -74,6 +243,45 @@ def index():
         return "Erro interno do servidor ao carregar a página.", 500
 
 
+@app.route('/rota/reasoning/<reasoning_id>', methods=['GET'])
+def stream_reasoning(reasoning_id):
+    """Server-Sent Events com a justificativa do LLM de uma rota já entregue"""
+    events = reasoning_broker.stream(reasoning_id)
+    if events is None:
+        return jsonify({"erro": "reasoning_id desconhecido ou expirado."}), 404
+
+    def generate():
+        for event, payload in events:
+            if event is None:
+                yield ": keep-alive\n\n"
+                continue
+            yield f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Snapshot das métricas internas (caches, upstreams) em JSON"""
+    snapshot = metrics.snapshot()
+    snapshot['caches'] = {'geocode': ors_client.geocode_cache.stats(), 'route': route_cache.stats()}
+    if route_optimizer is not None:
+        snapshot['caches']['weather'] = route_optimizer.weather.cache.stats()
+        snapshot['caches']['llm'] = route_optimizer.llm.cache.stats()
+        if route_optimizer.tomtom.routing_hedger is not None:
+            snapshot['hedging'] = {'tomtom.routing': route_optimizer.tomtom.routing_hedger.stats()}
+    snapshot['breakers'] = breaker_stats()
+    snapshot['gps'] = gps_ingestor.stats()
+    snapshot['gps_index'] = gps_index.stats()
+    if gps_compressor is not None:
+        snapshot['gps_trajectory'] = gps_compressor.stats()
+    return jsonify(snapshot)
+
+
 @app.route('/geocoding', methods=['POST'])
 def geocode_address():
     """Converte um endereço (string) em coordenadas (lon, lat) usando o ORS Geocoding."""
@@ -86,81 +294,350 @@ def geocode_address():
         return jsonify({"erro": "Endereço ausente"}), 400
 
     logger.info(f"[GEOCODING ORS] Recebendo requisição para: {address}")
-    
-    geocode_url = "https://api.openrouteservice.org/geocode/search"
-    
-    headers = {}
-    if ORS_USE_BEARER:
-        headers['Authorization'] = f"Bearer {ORS_API_KEY}"
-    else:
-        headers['Authorization'] = ORS_API_KEY
-    headers['Accept'] = 'application/json'
-    
-    params = {
-        'text': address,
-        'boundary.country': 'BRA',
-        'size': 1
-    }
 
     try:
-        response = requests.get(geocode_url, params=params, headers=headers, timeout=10)
-        response.raise_for_status()
-        result = response.json()
-
-        features = result.get('features') if isinstance(result, dict) else None
-        if features:
-            coords = features[0].get('geometry', {}).get('coordinates', [])
-            if len(coords) >= 2:
-                lon, lat = coords[0], coords[1]
-                logger.info(f"[GEOCODING ORS] Sucesso: {address} -> ({lat}, {lon})")
-                return jsonify({"lon": lon, "lat": lat})
-            else:
-                logger.warning(f"[GEOCODING ORS] Geometria inválida no resultado para: {address}")
-                return jsonify({"erro": "Geometria inválida retornada pela API de geocoding."}), 502
+        result = ors_client.geocode(address, country='BRA')
+
+        if result['status'] == 'found':
+            lon, lat = result['lon'], result['lat']
+            logger.info(f"[GEOCODING ORS] Sucesso: {address} -> ({lat}, {lon})")
+            return jsonify({"lon": lon, "lat": lat})
+        elif result['status'] == 'invalid_geometry':
+            logger.warning(f"[GEOCODING ORS] Geometria inválida no resultado para: {address}")
+            return jsonify({"erro": "Geometria inválida retornada pela API de geocoding."}), 502
         else:
             logger.warning(f"[GEOCODING ORS] Endereço não encontrado: {address}")
             return jsonify({"erro": "Endereço não encontrado ou inválido"}), 404
 
     except requests.exceptions.HTTPError as http_err:
+        response = http_err.response
         ors_error_detail = {}
         try:
             ors_error_detail = response.json()
-        except (ValueError, json.JSONDecodeError):
-            ors_error_detail = {"raw_error": getattr(response, 'text', str(response))}
+        except (ValueError, json.JSONDecodeError, AttributeError):
+            ors_error_detail = {"raw_error": getattr(response, 'text', str(http_err))}
             
         logger.error(f"[ERRO HTTP GEO] {http_err}")
         logger.error(f"[DETALHE ORS GEO] {json.dumps(ors_error_detail, indent=4)}")
 
         return jsonify({"erro": f"Erro de API ORS Geocoding: {http_err}", "detalhe": ors_error_detail}), 500
 
+    except CircuitOpenError:
+        logger.warning(f"[GEOCODING ORS] Circuito aberto, recusando: {address}")
+        return jsonify({"erro": "Serviço de geocoding temporariamente indisponível."}), 503
+
     except Exception as e:
         logger.exception(f"[ERRO INTERNO GEO] Falha ao geocodificar: {e}")
         return jsonify({"erro": "Erro interno de geocodificação."}), 500
 
 
-@app.route('/rota', methods=['POST'])
-def calcular_rota():
+def gps_device(data: dict):
+    """Campo device do payload (padrão 0) ou None se inválido"""
+    device = data.get('device', 0)
+    if not isinstance(device, int) or isinstance(device, bool) or not 0 <= device < 2 ** 32:
+        return None
+    return device
+
+
+@app.route('/gps', methods=['POST'])
+def ingest_gps():
     """
-    Endpoint de rota com otimização inteligente integrada.
+    Recebe um lote de fixes de GPS
+
+    Payload: {"device": 17, "fixes": [[lat, lon, alt, timestamp], ...]}
+    (ou objetos com esses campos; timestamp em ms ou s desde a época, alt
+    pode ser null; device é um id numérico opcional do veículo)
+
+    Os fixes vão para o ring buffer e são gravados em background (depois
+    da compressão de trilha, se ativa); com o buffer cheio o lote inteiro
+    é recusado com 503 + Retry-After.
+    """
+    data = request.get_json(silent=True)
+    if not data or not isinstance(data, dict):
+        return jsonify({"erro": "Payload JSON inválido ou ausente"}), 400
+
+    fixes = data.get('fixes')
+    if not isinstance(fixes, list) or not fixes:
+        return jsonify({"erro": "Lista de fixes ausente"}), 400
+    if len(fixes) > GPS_BATCH_MAX_FIXES:
+        return jsonify({"erro": f"Máximo de {GPS_BATCH_MAX_FIXES} fixes por lote"}), 413
+    device = gps_device(data)
+    if device is None:
+        return jsonify({"erro": "Campo device deve ser um inteiro entre 0 e 4294967295"}), 400
+
+    try:
+        records = fixes_to_records(fixes, device=device)
+    except ValueError as e:
+        return jsonify({"erro": str(e)}), 400
+
+    return submit_gps(records, len(fixes))
+
+
+@app.route('/gps/compact', methods=['POST'])
+def ingest_gps_compact():
+    """
+    Recebe um lote de fixes delta-codificado (formato do geolocation.js)
+
+    Payload: {"device": 17, "t0": 1700000000000, "lat": [...], "lon": [...],
+    "dt": [...], "alt": [...]} — colunas de inteiros (micrograus, ms,
+    decímetros), cada valor relativo ao fix anterior; ver
+    utils.gps_ingest.decode_delta_fixes.
+
+    O corpo é lido como JSON qualquer que seja o Content-Type, porque o
+    navigator.sendBeacon (envio ao sair da página) manda text/plain.
+    Respostas iguais às de POST /gps.
+    """
+    data = request.get_json(force=True, silent=True)
+    if not data or not isinstance(data, dict):
+        return jsonify({"erro": "Payload JSON inválido ou ausente"}), 400
+
+    lat = data.get('lat')
+    if not isinstance(lat, list):
+        return jsonify({"erro": "Coluna lat ausente ou inválida"}), 400
+    received = len(lat)
+    if not received:
+        return jsonify({"erro": "Lote vazio"}), 400
+    if received > GPS_BATCH_MAX_FIXES:
+        return jsonify({"erro": f"Máximo de {GPS_BATCH_MAX_FIXES} fixes por lote"}), 413
+    device = gps_device(data)
+    if device is None:
+        return jsonify({"erro": "Campo device deve ser um inteiro entre 0 e 4294967295"}), 400
+
+    try:
+        records = decode_delta_fixes(data, device=device)
+    except ValueError as e:
+        return jsonify({"erro": str(e)}), 400
+
+    return submit_gps(records, received)
+
+
+def submit_gps(records, received: int):
+    """Enfileira os fixes válidos; 503 + Retry-After se o buffer estiver cheio"""
+    if not gps_ingestor.submit(records):
+        logger.warning(f"[GPS] Buffer cheio, lote de {len(records)} fixes recusado")
+        return jsonify({"erro": "Ingestão de GPS sobrecarregada, tente novamente."}), 503, {'Retry-After': '1'}
+
+    return jsonify({"aceitos": len(records), "descartados": received - len(records)}), 202
+
+
+@app.route('/gps/route', methods=['POST'])
+def set_gps_route():
+    """
+    Informa a rota que o dispositivo está seguindo
+
+    Payload: {"device": 17, "polyline": "<polyline6 da rota de /rota>"}
+    (polyline vazia ou null encerra a rota). Os próximos fixes do
+    dispositivo a até GPS_SNAP_MAX_M da rota são encaixados nela antes da
+    compressão da trilha.
+    """
+    data = request.get_json(silent=True)
+    if not data or not isinstance(data, dict):
+        return jsonify({"erro": "Payload JSON inválido ou ausente"}), 400
+
+    device = gps_device(data)
+    if device is None:
+        return jsonify({"erro": "Campo device deve ser um inteiro entre 0 e 4294967295"}), 400
+    polyline = data.get('polyline') or ""
+    if not isinstance(polyline, str):
+        return jsonify({"erro": "Campo polyline deve ser uma string polyline6"}), 400
+    if polyline:
+        try:
+            decode_polyline(polyline)
+        except ValueError as e:
+            return jsonify({"erro": str(e)}), 400
+
+    gps_routes.set(device, polyline)
+    return jsonify({"device": device, "rota": bool(polyline)}), 200
+
+
+@app.route('/gps/query', methods=['GET'])
+def query_gps():
+    """
+    Consulta espacial dos fixes ingeridos
+
+    Query string (um dos modos):
+        bbox=min_lon,min_lat,max_lon,max_lat
+        lat=..&lon=..&radius_m=..      (pontos no raio, por distância)
+        lat=..&lon=..&k=..             (k mais próximos)
+    Janela de tempo (opcional): since_s=3600 (última hora) ou t_start/t_end em ms
+    limit: máximo de pontos na resposta (o resumo por dispositivo usa todos)
+    """
+    args = request.args
+    try:
+        limit = min(int(args.get('limit', 1000)), GPS_QUERY_MAX_POINTS)
+        if limit < 1:
+            raise ValueError("limit")
+        if 'since_s' in args:
+            t_start, t_end = int((time.time() - float(args['since_s'])) * 1000), None
+        else:
+            t_start = int(args['t_start']) if 't_start' in args else None
+            t_end = int(args['t_end']) if 't_end' in args else None
+
+        start = time.perf_counter()
+        dist = None
+        if 'bbox' in args:
+            min_lon, min_lat, max_lon, max_lat = (float(v) for v in args['bbox'].split(','))
+            points = gps_index.bbox(min_lat, min_lon, max_lat, max_lon, t_start, t_end)
+        elif 'lat' in args and 'lon' in args:
+            lat, lon = float(args['lat']), float(args['lon'])
+            if 'radius_m' in args:
+                # Raio limitado ao mesmo teto do nearest (NaN cai no ValueError do radius)
+                radius_m = min(float(args['radius_m']), gps_index.max_radius_m)
+                points, dist = gps_index.radius(lat, lon, radius_m, t_start, t_end)
+            else:
+                k = min(int(args.get('k', 10)), GPS_QUERY_MAX_POINTS)
+                if k < 1:
+                    raise ValueError("k")
+                points, dist = gps_index.nearest(lat, lon, k, t_start, t_end)
+        else:
+            return jsonify({"erro": "Informe bbox ou lat/lon (com radius_m ou k)"}), 400
+    except (KeyError, ValueError):
+        return jsonify({"erro": "Parâmetros de consulta inválidos"}), 400
+
+    shown = points[:limit]
+    pontos = [
+        {
+            "lat": float(p['lat']), "lon": float(p['lon']),
+            "alt": None if math.isnan(p['alt']) else float(p['alt']),
+            "timestamp": int(p['timestamp']), "device": int(p['device'])
+        }
+        for p in shown
+    ]
+    if dist is not None:
+        for item, d in zip(pontos, dist[:limit]):
+            item['dist_m'] = round(float(d), 1)
+
+    return jsonify({
+        "total": int(len(points)),
+        "pontos": pontos,
+        "dispositivos": summarize_devices(points, dist),
+        "ms": round((time.perf_counter() - start) * 1000, 2)
+    })
+
+
+def geocode_result_line(index, address, result=None, error=None):
+    """Monta uma linha NDJSON do /geocoding/batch a partir do resultado de ORSService.geocode"""
+    line = {"index": index, "address": address}
+    if error is not None:
+        if isinstance(error, requests.exceptions.HTTPError):
+            line.update({"status": 502, "erro": f"Erro de API ORS Geocoding: {error}"})
+        elif isinstance(error, CircuitOpenError):
+            line.update({"status": 503, "erro": "Serviço de geocoding temporariamente indisponível."})
+        else:
+            line.update({"status": 500, "erro": "Erro interno de geocodificação."})
+    elif result['status'] == 'found':
+        line.update({"status": 200, "lon": result['lon'], "lat": result['lat']})
+    elif result['status'] == 'invalid_geometry':
+        line.update({"status": 502, "erro": "Geometria inválida retornada pela API de geocoding."})
+    else:
+        line.update({"status": 404, "erro": "Endereço não encontrado ou inválido"})
+    return json.dumps(line, ensure_ascii=False) + "\n"
+
+
+@app.route('/geocoding/batch', methods=['POST'])
+def geocode_batch():
+    """
+    Geocodifica vários endereços, respondendo em NDJSON (uma linha por endereço)
     
-    Se constraints forem fornecidas E as chaves de otimização estiverem disponíveis:
-        - Consulta TomTom (tráfego) + OpenWeather (clima)
-        - Pede ao Groq para analisar e sugerir ajustes
-        - Aplica ajustes aos parâmetros do ORS
-        - Retorna rota otimizada
+    Payload: {"addresses": ["...", "..."], "country": "BRA"}
     
-    Caso contrário:
-        - Comportamento original (chamada direta ao ORS)
+    Os acertos de cache são enviados imediatamente; os demais são resolvidos
+    no ORS com concorrência limitada e enviados à medida que terminam (a ordem
+    das linhas não é a da entrada: use o campo "index").
     """
-    logger.info("[ROTA] Recebendo requisição de rota...")
-    
-    data = request.get_json()
+    data = request.get_json(silent=True)
     if not data or not isinstance(data, dict):
         return jsonify({"erro": "Payload JSON inválido ou ausente"}), 400
 
+    addresses = data.get('addresses')
+    if not isinstance(addresses, list) or not addresses:
+        return jsonify({"erro": "Lista de endereços ausente"}), 400
+    if len(addresses) > GEOCODE_BATCH_MAX_ADDRESSES:
+        return jsonify({"erro": f"Máximo de {GEOCODE_BATCH_MAX_ADDRESSES} endereços por lote"}), 413
+    country = data.get('country') or 'BRA'
+
+    logger.info(f"[GEOCODING BATCH] Recebendo lote com {len(addresses)} endereços")
+
+    def generate():
+        misses = deque()
+        for index, address in enumerate(addresses):
+            if not isinstance(address, str) or not address.strip():
+                yield json.dumps({"index": index, "address": address, "status": 400, "erro": "Endereço ausente"}, ensure_ascii=False) + "\n"
+                continue
+            cached = ors_client.geocode_cached(address, country)
+            if cached is not None:
+                yield geocode_result_line(index, address, cached)
+            else:
+                misses.append((index, address))
+
+        in_flight = {}
+        while misses or in_flight:
+            while misses and len(in_flight) < GEOCODE_BATCH_CONCURRENCY:
+                index, address = misses.popleft()
+                future = geocode_executor.submit(ors_client.geocode, address, country)
+                in_flight[future] = (index, address)
+
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                index, address = in_flight.pop(future)
+                try:
+                    yield geocode_result_line(index, address, future.result())
+                except Exception as e:
+                    logger.error(f"[GEOCODING BATCH] Falha em '{address}': {e}")
+                    yield geocode_result_line(index, address, error=e)
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+def build_ors_payload(coordinates, constraints=None):
+    """
+    Monta o payload de directions do ORS
+    
+    Constraints "avoid" (toll/highway/ferry) viram options.avoid_features;
+    o payload depende apenas das coordenadas e das constraints, então pode
+    ser enviado antes (e em paralelo) do pipeline de otimização.
+    """
+    ors_payload = {
+        "coordinates": coordinates,
+        "profile": "driving-car",
+        "format": "geojson",
+        "units": "m",
+        "instructions": False
+    }
+
+    # Aplica parâmetros de otimização ao ORS se disponíveis
+    # Por exemplo, se deve evitar pedágios
+    if constraints and constraints.get('avoid'):
+        avoid_features = []
+        if 'toll' in constraints['avoid']:
+            avoid_features.append('tollways')
+        if 'highway' in constraints['avoid']:
+            avoid_features.append('highways')
+        if 'ferry' in constraints['avoid']:
+            avoid_features.append('ferries')
+
+        if avoid_features:
+            ors_payload['options'] = {'avoid_features': avoid_features}
+
+    return ors_payload
+
+
+def parse_route_request(data, args):
+    """
+    Valida o corpo (e a query string) de /rota
+    
+    Compartilhado com o entry point ASGI (asgi.py).
+    
+    Returns:
+        (params, None) com coordinates, constraints, format, zoom,
+        defer_reasoning, origin e destination; ou (None, mensagem de erro)
+    """
+    if not data or not isinstance(data, dict):
+        return None, "Payload JSON inválido ou ausente"
+
     coordinates = data.get('coordinates')
     if not coordinates or not isinstance(coordinates, list) or len(coordinates) < 2:
-        return jsonify({"erro": "Coordenadas de rota ausentes ou incompletas."}), 400
+        return None, "Coordenadas de rota ausentes ou incompletas."
 
     # Validação simples dos pontos (numéricos)
     try:
@@ -169,14 +646,173 @@ def calcular_rota():
                 raise ValueError('Formato de coordenada inválido')
             float(pt[0]); float(pt[1])
     except Exception:
-        return jsonify({"erro": "Formato de coordenadas inválido. Use [[lon, lat], [lon, lat]]"}), 400
+        return None, "Formato de coordenadas inválido. Use [[lon, lat], [lon, lat]]"
+
+    # Formato de resposta (opt-in): ?format=polyline6&zoom=14 ou no corpo JSON
+    response_format = args.get('format') or data.get('format') or 'geojson'
+    if response_format not in RESPONSE_FORMATS:
+        return None, f"Formato inválido. Use um de: {', '.join(RESPONSE_FORMATS)}"
+    zoom = args.get('zoom', data.get('zoom'))
+    try:
+        zoom = float(zoom) if zoom is not None else None
+    except (TypeError, ValueError):
+        return None, "Parâmetro zoom inválido."
 
-    # Extrai constraints (opcional)
     constraints = data.get('constraints', None)
+    if constraints is not None and not isinstance(constraints, dict):
+        return None, "Constraints inválidas. Use um objeto, ex: {\"avoid\": [\"toll\"]}"
+
+    return {
+        "coordinates": coordinates,
+        # Extrai constraints (opcional)
+        "constraints": constraints,
+        "format": response_format,
+        "zoom": zoom,
+        # Justificativa assíncrona (opt-in): "reasoning": "stream" no corpo JSON
+        "defer_reasoning": data.get('reasoning') == 'stream',
+        # Converte coordenadas [lon, lat] para {lat, lon} para o otimizador
+        "origin": {"lat": coordinates[0][1], "lon": coordinates[0][0]},
+        "destination": {"lat": coordinates[1][1], "lon": coordinates[1][0]}
+    }, None
+
+
+def attach_optimization(geojson_data, optimization_result, constraints):
+    """Adiciona os metadados da otimização à primeira feature do GeoJSON ORS"""
+    selected = optimization_result.get('selected_route', {})
+
+    if 'features' in geojson_data and len(geojson_data['features']) > 0:
+        feature = geojson_data['features'][0]
+        if 'properties' not in feature:
+            feature['properties'] = {}
+
+        feature['properties']['optimization'] = {
+            'enabled': True,
+            'reasoning': optimization_result.get('reasoning', ''),
+            'decision_source': optimization_result.get('decision_source'),
+            # Justificativa provisória: a final chega por SSE neste endpoint
+            'reasoning_id': optimization_result.get('reasoning_id'),
+            'reasoning_stream': (
+                f"/rota/reasoning/{optimization_result['reasoning_id']}"
+                if optimization_result.get('reasoning_id') else None
+            ),
+            'weather': selected.get('weather_description', ''),
+            'traffic_factor': selected.get('traffic_factor', 1.0),
+            'weather_factor': selected.get('weather_factor', 1.0),
+            'constraints_applied': constraints
+        }
+
+    return geojson_data
+
+
+def cacheable_route(geojson_data):
+    """
+    Versão do GeoJSON otimizado que vai para o cache de rotas
+
+    O reasoning_id / reasoning_stream pertencem à requisição que calculou a
+    rota (o job SSE expira); quem recebe a rota do cache fica com a
+    justificativa gravada (a final, depois que store_optimized_route a recebe).
+    """
+    features = geojson_data.get('features') or []
+    optimization = features[0].get('properties', {}).get('optimization') if features else None
+    if not optimization or not optimization.get('reasoning_id'):
+        return geojson_data
+
+    feature = {**features[0], 'properties': {
+        **features[0]['properties'],
+        'optimization': {**optimization, 'reasoning_id': None, 'reasoning_stream': None}
+    }}
+    return {**geojson_data, 'features': [feature] + features[1:]}
+
+
+def with_final_reasoning(geojson_data, provisional, final):
+    """GeoJSON do cache com a justificativa final no lugar da provisória (None se já mudou)"""
+    features = geojson_data.get('features') or []
+    optimization = features[0].get('properties', {}).get('optimization') if features else None
+    if not final or not optimization or optimization.get('reasoning') != provisional or final == provisional:
+        return None
+
+    feature = {**features[0], 'properties': {
+        **features[0]['properties'],
+        'optimization': {**optimization, 'reasoning': final}
+    }}
+    return {**geojson_data, 'features': [feature] + features[1:]}
+
+
+def store_optimized_route(cache_key, geojson_data):
+    """
+    Grava uma rota otimizada no cache de rotas
+
+    Com justificativa em streaming, a entrada nasce com o texto provisório;
+    quando o broker publica a final, ela é gravada na mesma entrada (em
+    background: o publish pode vir do event loop do ASGI). Assim os acertos
+    do cache também recebem a justificativa do LLM.
+    """
+    route_cache.store(cache_key, cacheable_route(geojson_data), traffic_sensitive=True)
+
+    features = geojson_data.get('features') or []
+    optimization = features[0].get('properties', {}).get('optimization') if features else None
+    if not optimization or not optimization.get('reasoning_id'):
+        return
+
+    provisional = optimization.get('reasoning')
+
+    def write_back(data):
+        final = (data or {}).get('text')
+        background_executor.submit(
+            route_cache.update, cache_key, lambda value: with_final_reasoning(value, provisional, final)
+        )
+
+    reasoning_broker.on_event(optimization['reasoning_id'], 'reasoning', write_back)
+
+
+def refresh_optimized_route(params):
+    """Recalcula uma rota otimizada para o cache (stale-while-revalidate)"""
+    constraints = params['constraints']
+    result = route_optimizer.optimize_route(
+        origin=(params['origin']['lat'], params['origin']['lon']),
+        destination=(params['destination']['lat'], params['destination']['lon']),
+        constraints=constraints
+    )
+    if not result:
+        return None
+    response = ors_client.directions_geojson(build_ors_payload(params['coordinates'], constraints))
+    response.raise_for_status()
+    return attach_optimization(response.json(), result, constraints)
+
+
+def refresh_standard_route(params):
+    """Recalcula a geometria ORS padrão para o cache (stale-while-revalidate)"""
+    response = ors_client.directions_geojson(build_ors_payload(params['coordinates']))
+    response.raise_for_status()
+    return response.json()
+
+
+@app.route('/rota', methods=['POST'])
+def calcular_rota():
+    """
+    Endpoint de rota com otimização inteligente integrada.
     
-    # Converte coordenadas [lon, lat] para {lat, lon} para o otimizador
-    origin = {"lat": coordinates[0][1], "lon": coordinates[0][0]}
-    destination = {"lat": coordinates[1][1], "lon": coordinates[1][0]}
+    Se constraints forem fornecidas E as chaves de otimização estiverem disponíveis:
+        - Consulta TomTom (tráfego) + OpenWeather (clima)
+        - Pede ao Groq para analisar e sugerir ajustes
+        - Aplica ajustes aos parâmetros do ORS
+        - Retorna rota otimizada
+    
+    Caso contrário:
+        - Comportamento original (chamada direta ao ORS)
+    """
+    logger.info("[ROTA] Recebendo requisição de rota...")
+    
+    params, error = parse_route_request(request.get_json(silent=True), request.args)
+    if error:
+        return jsonify({"erro": error}), 400
+    coordinates = params['coordinates']
+    constraints = params['constraints']
+    response_format = params['format']
+    zoom = params['zoom']
+    defer_reasoning = params['defer_reasoning']
+    origin = params['origin']
+    destination = params['destination']
     
     logger.info(f"[ROTA] Coordenadas: {coordinates}")
     if constraints:
@@ -188,89 +824,58 @@ def calcular_rota():
     use_optimization = (
         constraints and 
         optimization_available and 
-        route_optimizer is not None
+        route_optimizer is not None and
+        # O entry point ASGI já tentou a otimização (async) e delegou o fallback
+        request.headers.get(OPTIMIZATION_ATTEMPTED_HEADER) != '1'
     )
 
+    # Requisição ORS já em voo (modo otimizado) que pode ser reaproveitada
+    # pelo modo padrão se a otimização falhar e o payload for o mesmo
+    pending_ors = None
+
     if use_optimization:
         logger.info("[ROTA] Modo de otimização ativado (Groq + TomTom + Weather)")
         try:
-            # Chama o otimizador completo
+            cache_key = route_cache.key(coordinates, constraints)
+            cached, stale = route_cache.lookup(cache_key)
+            if cached is not None:
+                if stale:
+                    route_cache.refresh(cache_key, refresh_optimized_route, params, traffic_sensitive=True)
+                logger.info(f"[ROTA] Rota otimizada servida do cache{' (recalculando)' if stale else ''}.")
+                return jsonify(format_route_response(cached, response_format, zoom))
+
+            # A geometria de exibição vem do ORS (o TomTom geometry pode ser
+            # diferente) e só depende de coordenadas + constraints['avoid']:
+            # dispara o ORS em paralelo com o otimizador
+            ors_payload = build_ors_payload(coordinates, constraints)
+            logger.info("[ROTA] Chamando ORS com parâmetros otimizados (em paralelo)...")
+            pending_ors = (
+                background_executor.submit(ors_client.directions_geojson, ors_payload),
+                ors_payload
+            )
+
+            # Chama o otimizador completo (na thread da requisição)
             optimization_result = route_optimizer.optimize_route(
                 origin=(origin['lat'], origin['lon']),
                 destination=(destination['lat'], destination['lon']),
-                constraints=constraints
+                constraints=constraints,
+                defer_reasoning=defer_reasoning
             )
             
             if not optimization_result:
                 logger.warning("[ROTA] Otimização falhou, revertendo para ORS padrão")
                 use_optimization = False
             else:
-                # Extrai informações da otimização
-                selected = optimization_result.get('selected_route', {})
-                reasoning = optimization_result.get('reasoning', '')
-                weather_desc = selected.get('weather_description', '')
-                
-                # Agora chama o ORS para obter a geometria real da rota
-                # (o TomTom geometry pode ser diferente do ORS, então mantemos ORS)
-                ors_payload = {
-                    "coordinates": coordinates,
-                    "profile": "driving-car",
-                    "format": "geojson",
-                    "units": "m",
-                    "instructions": False
-                }
-                
-                # Aplica parâmetros de otimização ao ORS se disponíveis
-                # Por exemplo, se deve evitar pedágios
-                if constraints.get('avoid'):
-                    avoid_features = []
-                    if 'toll' in constraints['avoid']:
-                        avoid_features.append('tollways')
-                    if 'highway' in constraints['avoid']:
-                        avoid_features.append('highways')
-                    if 'ferry' in constraints['avoid']:
-                        avoid_features.append('ferries')
-                    
-                    if avoid_features:
-                        ors_payload['options'] = {'avoid_features': avoid_features}
-                
-                headers = {}
-                if ORS_USE_BEARER:
-                    headers['Authorization'] = f"Bearer {ORS_API_KEY}"
-                else:
-                    headers['Authorization'] = ORS_API_KEY
-                headers['Content-Type'] = 'application/json'
-
-                logger.info("[ROTA] Chamando ORS com parâmetros otimizados...")
-
-                response = requests.post(
-                    f"{ORS_API_URL}/geojson",
-                    json=ors_payload,
-                    headers=headers,
-                    timeout=15
-                )
-
+                # Merge: espera o ORS e anexa os metadados da otimização
+                ors_future, _ = pending_ors
+                pending_ors = None  # Consumida: o fallback faz uma chamada nova
+                response = ors_future.result()
                 response.raise_for_status()
-                geojson_data = response.json()
-                
-                # Enriquece o GeoJSON com dados da otimização
-                if 'features' in geojson_data and len(geojson_data['features']) > 0:
-                    feature = geojson_data['features'][0]
-                    if 'properties' not in feature:
-                        feature['properties'] = {}
-                    
-                    # Adiciona metadados de otimização
-                    feature['properties']['optimization'] = {
-                        'enabled': True,
-                        'reasoning': reasoning,
-                        'weather': weather_desc,
-                        'traffic_factor': selected.get('traffic_factor', 1.0),
-                        'weather_factor': selected.get('weather_factor', 1.0),
-                        'constraints_applied': constraints
-                    }
+                geojson_data = attach_optimization(response.json(), optimization_result, constraints)
+                store_optimized_route(cache_key, geojson_data)
                 
                 logger.info("[ROTA] Rota otimizada retornada com sucesso.")
-                return jsonify(geojson_data)
+                return jsonify(format_route_response(geojson_data, response_format, zoom))
                 
         except Exception as e:
             logger.exception(f"[ROTA] Erro durante otimização: {e}")
@@ -283,13 +888,7 @@ def calcular_rota():
     if not use_optimization:
         logger.info("[ROTA] Modo padrão (ORS direto, sem otimização)")
         
-        ors_payload = {
-            "coordinates": coordinates,
-            "profile": "driving-car",
-            "format": "geojson",
-            "units": "m",
-            "instructions": False
-        }
+        ors_payload = build_ors_payload(coordinates)
 
         # Modo de teste: se a variável DISABLE_ORS estiver definida, retorna um GeoJSON falso
         if os.environ.get('DISABLE_ORS') == '1':
@@ -306,24 +905,24 @@ def calcular_rota():
                 }],
                 "routes": [{"summary": {"distance": 1234.5, "duration": 600}}]
             }
-            return jsonify(fake_geojson)
+            return jsonify(format_route_response(fake_geojson, response_format, zoom))
+
+        cache_key = route_cache.key(coordinates)
+        cached, stale = route_cache.lookup(cache_key)
+        if cached is not None:
+            if stale:
+                route_cache.refresh(cache_key, refresh_standard_route, params, traffic_sensitive=False)
+            logger.info(f"[ROTA] Rota servida do cache (modo padrão){' (recalculando)' if stale else ''}.")
+            return jsonify(format_route_response(cached, response_format, zoom))
 
         try:
-            headers = {}
-            if ORS_USE_BEARER:
-                headers['Authorization'] = f"Bearer {ORS_API_KEY}"
+            if pending_ors is not None and pending_ors[1] == ors_payload:
+                # Sem avoid_features a chamada paralela já é a rota padrão
+                logger.info("[ROTA] Reaproveitando chamada ORS já em andamento...")
+                response = pending_ors[0].result()
             else:
-                headers['Authorization'] = ORS_API_KEY
-            headers['Content-Type'] = 'application/json'
-
-            logger.info("[ROTA] Enviando payload ao ORS...")
-
-            response = requests.post(
-                f"{ORS_API_URL}/geojson",
-                json=ors_payload,
-                headers=headers,
-                timeout=10
-            )
+                logger.info("[ROTA] Enviando payload ao ORS...")
+                response = ors_client.directions_geojson(ors_payload)
 
             response.raise_for_status()
             try:
@@ -332,8 +931,9 @@ def calcular_rota():
                 logger.error('[ROTA] Resposta ORS não contém JSON válido')
                 return jsonify({"erro": "Resposta inválida da API ORS."}), 502
 
+            route_cache.store(cache_key, geojson_data, traffic_sensitive=False)
             logger.info("[ROTA] Rota recebida com sucesso (modo padrão).")
-            return jsonify(geojson_data)
+            return jsonify(format_route_response(geojson_data, response_format, zoom))
             
         except requests.exceptions.HTTPError as http_err:
             ors_error_detail = {}
@@ -354,6 +954,10 @@ def calcular_rota():
                 return jsonify(resp_payload), status_code
             return jsonify(resp_payload), 502
 
+        except CircuitOpenError:
+            logger.warning("[ROTA] Circuito do ORS directions aberto, recusando rota")
+            return jsonify({"erro": "Serviço de rotas temporariamente indisponível."}), 503
+
         except Exception as e:
             logger.exception(f"[ERRO INTERNO] Falha ao processar rota: {e}")
             return jsonify({"erro": "Erro interno ao processar rota."}), 500
@@ -372,7 +976,14 @@ if __name__ == '__main__':
     logger.info("📍 Endpoints disponíveis:")
     logger.info("   GET  /             - Interface web")
     logger.info("   POST /geocoding    - Geocodificação de endereços")
+    logger.info("   POST /geocoding/batch - Geocodificação em lote (NDJSON)")
+    logger.info("   POST /gps          - Ingestão de fixes de GPS em lote")
+    logger.info("   POST /gps/compact  - Ingestão de fixes em lote delta-codificado (geolocation.js)")
+    logger.info("   POST /gps/route    - Rota seguida pelo dispositivo (encaixe dos fixes)")
+    logger.info("   GET  /gps/query    - Consulta espacial dos fixes (bbox, raio, k vizinhos)")
     logger.info("   POST /rota         - Cálculo de rota (com otimização inteligente se constraints fornecidas)")
+    logger.info("   GET  /rota/reasoning/<id> - Justificativa do LLM via SSE")
+    logger.info("   GET  /metrics      - Métricas internas (caches, upstreams)")
     
     if optimization_available:
         logger.info("   ✨ Otimização inteligente: ATIVADA")
@@ -0,0 +1,219 @@
+# asgi.py
+"""
+Entry point ASGI: /rota otimizada 100% assíncrona + app Flask para o resto
+
+    uvicorn asgi:application --host 0.0.0.0 --port 5000
+
+POST /rota com constraints roda no AsyncRouteOptimizer (TomTom, OpenWeather,
+Groq e ORS via corrotinas): um processo segura centenas de rotas esperando
+upstream. Todo o resto (páginas, geocoding, SSE, /metrics, rota sem
+constraints, erros de validação) é servido pelo mesmo app Flask de app.py,
+adaptado com WsgiToAsgi; rotas já no cache de rotas também vão para o
+Flask, que as serve (e recalcula em background). Se a otimização
+assíncrona falhar, a requisição é repassada ao Flask marcada com
+OPTIMIZATION_ATTEMPTED_HEADER, que responde no modo padrão (ORS direto)
+sem refazer a otimização.
+"""
+import asyncio
+import logging
+import os
+from urllib.parse import parse_qsl
+
+from asgiref.wsgi import WsgiToAsgi
+from werkzeug.datastructures import MultiDict
+from werkzeug.http import parse_accept_header
+
+from app import (
+    OPTIMIZATION_ATTEMPTED_HEADER,
+    OPTIMIZER_SETTINGS,
+    ORS_API_KEY,
+    ORS_USE_BEARER,
+    app,
+    attach_optimization,
+    build_ors_payload,
+    optimization_available,
+    parse_route_request,
+    route_cache,
+    store_optimized_route
+)
+from services.async_clients import AsyncORSService
+from utils.async_route_optimizer import AsyncRouteOptimizer
+from utils.compression import OFFERED_ENCODINGS, compress
+from utils.route_format import format_route_response
+
+logger = logging.getLogger(__name__)
+
+flask_application = WsgiToAsgi(app)
+
+# Conexões simultâneas por upstream (cada /rota em voo usa ~1 de cada)
+ASYNC_MAX_CONNECTIONS = int(os.environ.get('ASYNC_MAX_CONNECTIONS', '200'))
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', '1024'))
+
+async_optimizer = (
+    AsyncRouteOptimizer(**OPTIMIZER_SETTINGS, max_connections=ASYNC_MAX_CONNECTIONS)
+    if optimization_available else None
+)
+async_ors = AsyncORSService(ORS_API_KEY, use_bearer=ORS_USE_BEARER, max_connections=ASYNC_MAX_CONNECTIONS)
+
+
+async def _read_body(receive) -> bytes:
+    """Lê o corpo completo da requisição HTTP"""
+    chunks = []
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            break
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body", False):
+            break
+    return b"".join(chunks)
+
+
+def _replay(body: bytes):
+    """receive() que entrega de novo um corpo já lido (para repassar ao Flask)"""
+    sent = False
+
+    async def receive():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        return {"type": "http.disconnect"}
+
+    return receive
+
+
+def _header(scope, name: bytes) -> str:
+    for key, value in scope.get("headers", []):
+        if key.lower() == name:
+            return value.decode("latin-1")
+    return ""
+
+
+def _cors_headers(scope) -> list:
+    """
+    Mesmos cabeçalhos que o CORS(app) do Flask põe nas respostas
+
+    Com Origin, ele é ecoado (e entra no Vary); sem Origin, "*". O frontend
+    chama a API em outra origem (getApiBaseUrl/ngrok), então as respostas
+    servidas direto pelo ASGI precisam deles tanto quanto as do Flask.
+    """
+    origin = _header(scope, b"origin")
+    if origin:
+        return [(b"access-control-allow-origin", origin.encode("latin-1")), (b"vary", b"Accept-Encoding, Origin")]
+    return [(b"access-control-allow-origin", b"*"), (b"vary", b"Accept-Encoding")]
+
+
+async def _send_json(scope, send, payload) -> None:
+    """Resposta JSON (mesma serialização do Flask) com brotli/gzip negociado e CORS"""
+    body = app.json.dumps(payload).encode("utf-8")
+    headers = [(b"content-type", b"application/json")] + _cors_headers(scope)
+
+    encoding = parse_accept_header(_header(scope, b"accept-encoding")).best_match(OFFERED_ENCODINGS)
+    if encoding and len(body) >= COMPRESSION_MIN_SIZE:
+        body = compress(body, encoding)
+        headers.append((b"content-encoding", encoding.encode("ascii")))
+
+    headers.append((b"content-length", str(len(body)).encode("ascii")))
+    await send({"type": "http.response.start", "status": 200, "headers": headers})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _route_cache_call(fn, *args, **kwargs):
+    """Acesso ao cache de rotas sem bloquear o event loop (Redis roda numa thread)"""
+    if route_cache.cache.remote is None:
+        return fn(*args, **kwargs)
+    return await asyncio.to_thread(fn, *args, **kwargs)
+
+
+async def _optimized_route(params):
+    """
+    Pipeline otimizado assíncrono: ORS (geometria) em paralelo com o otimizador
+
+    Returns:
+        Corpo da resposta formatado, ou None para cair no modo padrão
+    """
+    constraints = params['constraints']
+    origin = params['origin']
+    destination = params['destination']
+    ors_task = asyncio.ensure_future(async_ors.directions_geojson(
+        build_ors_payload(params['coordinates'], constraints)
+    ))
+    try:
+        result = await async_optimizer.optimize_route(
+            origin=(origin['lat'], origin['lon']),
+            destination=(destination['lat'], destination['lon']),
+            constraints=constraints,
+            defer_reasoning=params['defer_reasoning']
+        )
+        if not result:
+            logger.warning("[ROTA/ASGI] Otimização falhou, revertendo para ORS padrão")
+            ors_task.cancel()
+            return None
+
+        response = await ors_task
+        response.raise_for_status()
+        geojson_data = attach_optimization(response.json(), result, constraints)
+        await _route_cache_call(store_optimized_route, params['cache_key'], geojson_data)
+        logger.info("[ROTA/ASGI] Rota otimizada retornada com sucesso.")
+        return format_route_response(geojson_data, params['format'], params['zoom'])
+    except Exception as e:
+        logger.exception(f"[ROTA/ASGI] Erro durante otimização: {e}")
+        ors_task.cancel()
+        return None
+
+
+async def _rota(scope, receive, send) -> None:
+    """POST /rota: otimização assíncrona quando aplicável, senão Flask"""
+    body = await _read_body(receive)
+
+    params = None
+    if async_optimizer is not None and os.environ.get('DISABLE_ORS') != '1':
+        try:
+            data = app.json.loads(body) if body else None
+        except ValueError:
+            data = None
+        query = MultiDict(parse_qsl(scope.get("query_string", b"").decode("latin-1")))
+        params, error = parse_route_request(data, query)
+        if error or not params['constraints']:
+            params = None  # Flask responde (erro de validação ou modo padrão)
+        else:
+            params['cache_key'] = route_cache.key(params['coordinates'], params['constraints'])
+            if await _route_cache_call(route_cache.has, params['cache_key']):
+                params = None  # Flask serve do cache (e recalcula em background se vencida)
+
+    if params is not None:
+        payload = await _optimized_route(params)
+        if payload is not None:
+            await _send_json(scope, send, payload)
+            return
+        scope = dict(scope)
+        scope["headers"] = list(scope.get("headers", [])) + [
+            (OPTIMIZATION_ATTEMPTED_HEADER.lower().encode("latin-1"), b"1")
+        ]
+
+    await flask_application(scope, _replay(body), send)
+
+
+async def _lifespan(receive, send) -> None:
+    """Startup/shutdown do servidor: fecha os clientes HTTP no fim"""
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            if async_optimizer is not None:
+                await async_optimizer.aclose()
+            await async_ors.aclose()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def application(scope, receive, send) -> None:
+    """App ASGI raiz"""
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+    elif scope["type"] == "http" and scope["method"] == "POST" and scope["path"] == "/rota":
+        await _rota(scope, receive, send)
+    else:
+        await flask_application(scope, receive, send)
@@ -1,6 +1,5 @@
 #python
 import os
-import threading
 from pathlib import Path
 
 # --- CONFIGURAÇÕES DE API EXTERNA ---
@@ -29,6 +28,3 @@ BASE_DIR = Path(__file__).resolve().parent
 
 # Caminho para o CSV
 CSV_FILE = BASE_DIR / "data" / "gps_data.csv"
-
-# Lock para escrita segura em múltiplos processos
-CSV_LOCK = threading.Lock()
\ No newline at end of file
@@ -6,5 +6,6 @@ Módulo de serviços externos para otimização de rotas
 from .tomtom import TomTomService
 from .openweather import OpenWeatherService
 from .groq_llm import GroqLLMService
+from .ors import ORSService
 
-__all__ = ['TomTomService', 'OpenWeatherService', 'GroqLLMService']
\ No newline at end of file
+__all__ = ['TomTomService', 'OpenWeatherService', 'GroqLLMService', 'ORSService']
\ No newline at end of file
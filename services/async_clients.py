@@ -0,0 +1,270 @@
+# services/async_clients.py
+"""
+Variantes asyncio (httpx / AsyncGroq) dos clientes externos
+
+Mesmas regras de negócio dos clientes síncronos (parsing, fatores, cache,
+prompt, validação e circuit breakers são herdados); só o I/O muda. Usadas pelo
+AsyncRouteOptimizer, servido pelo entry point ASGI (asgi.py): cada /rota
+em voo é uma corrotina, não uma thread do gunicorn.
+
+Dependências: httpx, groq (AsyncGroq)
+"""
+import asyncio
+import logging
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import httpx
+from groq import AsyncGroq
+
+from .cache import TieredCache
+from .groq_llm import GroqLLMService, _AnalysisStream
+from .openweather import OpenWeatherService
+from .ors import ORSService
+from .resilience import CircuitBreaker, CircuitOpenError
+from .singleflight import AsyncSingleFlight
+from .tomtom import TomTomService
+
+logger = logging.getLogger(__name__)
+
+
+async def _cache_call(cache: TieredCache, method: str, *args) -> Any:
+    """
+    Executa cache.get/set sem bloquear o event loop
+
+    Só a LRU em processo: chamada direta. Com camada remota (Redis/SQLite),
+    o acesso roda numa thread.
+    """
+    fn = getattr(cache, method)
+    if cache.remote is None:
+        return fn(*args)
+    return await asyncio.to_thread(fn, *args)
+
+
+def _timeout(breaker: CircuitBreaker, connect_s: float = 3.05) -> httpx.Timeout:
+    """Timeout httpx com o read adaptativo do breaker"""
+    return httpx.Timeout(breaker.timeout(), connect=connect_s)
+
+
+def _http_client(max_connections: int) -> httpx.AsyncClient:
+    """Cliente httpx com pool keep-alive compartilhado pelas corrotinas"""
+    return httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+    )
+
+
+class AsyncTomTomService(TomTomService):
+    """TomTomService com get_route_with_traffic assíncrono"""
+
+    def __init__(self, api_key: str, use_bearer: bool = False, max_connections: int = 100, **kwargs):
+        super().__init__(api_key, use_bearer=use_bearer, **kwargs)
+        self.client = _http_client(max_connections)
+
+    async def get_route_with_traffic(
+        self,
+        origin: Tuple[float, float],
+        destination: Tuple[float, float],
+        alternatives: int = 2
+    ) -> Optional[Dict]:
+        """Mesmo contrato de TomTomService.get_route_with_traffic"""
+        url, params = self._route_request(origin, destination, alternatives)
+        if self.routing_hedger is not None:
+            return await self.routing_hedger.arun(self._fetch_routes_async, url, params)
+        return await self._fetch_routes_async(url, params)
+
+    async def _fetch_routes_async(self, url: str, params: Dict) -> Optional[Dict]:
+        """Mesmo contrato de TomTomService._fetch_routes"""
+        try:
+            with self.routing_breaker.track():
+                response = await self.client.get(
+                    url, params=params, headers=self.headers, timeout=_timeout(self.routing_breaker)
+                )
+                response.raise_for_status()
+                data = response.json()
+            return self._parse_routes(data)
+        except CircuitOpenError:
+            logger.warning("TomTom routing skipped: circuit open")
+            return None
+        except Exception as e:
+            logger.error(f"TomTom routing error: {e}")
+            return None
+
+    async def aclose(self) -> None:
+        await self.client.aclose()
+
+
+class AsyncOpenWeatherService(OpenWeatherService):
+    """OpenWeatherService com get_weather assíncrono (cache + single-flight)"""
+
+    def __init__(self, api_key: str, max_connections: int = 100, **kwargs):
+        super().__init__(api_key, **kwargs)
+        self.client = _http_client(max_connections)
+        self._async_inflight = AsyncSingleFlight()
+
+    async def get_weather(self, lat: float, lon: float) -> Optional[Dict]:
+        """Mesmo contrato de OpenWeatherService.get_weather"""
+        key = self.location_key(lat, lon)
+        cached = await _cache_call(self.cache, "get", key)
+        if cached is not None:
+            return cached
+        return await self._async_inflight.do(key, self._fetch_and_cache_async, key, lat, lon)
+
+    async def _fetch_and_cache_async(self, key: str, lat: float, lon: float) -> Optional[Dict]:
+        """Busca no upstream e grava no cache (falhas não são cacheadas)"""
+        try:
+            with self.breaker.track():
+                response = await self.client.get(
+                    f"{self.BASE_URL}/weather", params=self._weather_params(lat, lon),
+                    timeout=_timeout(self.breaker)
+                )
+                response.raise_for_status()
+                data = response.json()
+            weather = self._parse_weather(data)
+        except CircuitOpenError:
+            logger.debug(f"OpenWeather skipped at ({lat}, {lon}): circuit open")
+            return None
+        except httpx.HTTPStatusError as e:
+            logger.warning(f"OpenWeather HTTP error at ({lat}, {lon}): {e}")
+            return None
+        except Exception as e:
+            logger.error(f"OpenWeather unexpected error at ({lat}, {lon}): {e}")
+            return None
+
+        await _cache_call(self.cache, "set", key, weather)
+        return weather
+
+    async def aclose(self) -> None:
+        await self.client.aclose()
+
+
+class AsyncGroqLLMService(GroqLLMService):
+    """GroqLLMService com analyze_routes / explain_routes assíncronos (AsyncGroq)"""
+
+    def __init__(self, api_key: str, **kwargs):
+        super().__init__(api_key, **kwargs)
+        self.client = AsyncGroq(api_key=api_key)
+
+    async def analyze_routes(
+        self,
+        constraints: Dict,
+        candidates: List[Dict],
+        include_reasoning: bool = True,
+        on_decision: Optional[Callable[[Dict], None]] = None,
+        on_reasoning_token: Optional[Callable[[str], None]] = None
+    ) -> Optional[Dict]:
+        """Mesmo contrato de GroqLLMService.analyze_routes (streaming + parsing incremental)"""
+        cache_key = self.decision_key(constraints, candidates)
+        cached = await _cache_call(self.cache, "get", cache_key)
+        if cached is not None and (not include_reasoning or "reasoning" in cached):
+            logger.info(f"Groq LLM decision cache hit. Selected: {cached['selected_candidate']}")
+            if on_decision:
+                on_decision({"weights": cached["weights"], "selected_candidate": cached["selected_candidate"]})
+            return cached
+
+        prompt = self._build_prompt(constraints, candidates, include_reasoning)
+        analysis = _AnalysisStream(self, include_reasoning, on_decision, on_reasoning_token)
+
+        try:
+            with self.breaker.track():
+                stream = await self.client.chat.completions.create(**self._analysis_request(prompt, include_reasoning))
+                try:
+                    async for chunk in stream:
+                        if analysis.feed(chunk):
+                            break
+                finally:
+                    await stream.close()
+                    self._record_usage("analyze", analysis.start, analysis.usage, prompt, analysis.text)
+            analysis.raise_parse_error()
+
+            result = analysis.result()
+        except CircuitOpenError:
+            logger.warning("Groq LLM skipped: circuit open")
+            return None
+        except ValueError as e:
+            logger.error(f"Failed to parse LLM JSON response: {e}\nResponse: {analysis.text}")
+            return None
+        except Exception as e:
+            logger.error(f"Groq LLM error: {e}")
+            return None
+
+        if result is None:
+            return None
+        logger.info(f"Groq LLM analysis successful. Selected: {result['selected_candidate']}")
+        await _cache_call(self.cache, "set", cache_key, result)
+        return result
+
+    async def explain_routes(
+        self,
+        constraints: Dict,
+        candidates: List[Dict],
+        selected_id: int
+    ) -> Optional[str]:
+        """Mesmo contrato de GroqLLMService.explain_routes"""
+        cache_key = self._explain_key(constraints, candidates, selected_id)
+        cached = await _cache_call(self.cache, "get", cache_key)
+        if cached is not None:
+            return cached.get("reasoning")
+
+        prompt, request = self._explain_request(constraints, candidates, selected_id)
+        start = time.perf_counter()
+        try:
+            with self.breaker.track():
+                completion = await self.client.chat.completions.create(**request)
+            reasoning = completion.choices[0].message.content.strip()
+            self._record_usage("explain", start, getattr(completion, "usage", None), prompt, reasoning)
+        except CircuitOpenError:
+            logger.debug("Groq LLM explanation skipped: circuit open")
+            return None
+        except Exception as e:
+            logger.error(f"Groq LLM explanation error: {e}")
+            return None
+
+        if not reasoning:
+            return None
+        await _cache_call(self.cache, "set", cache_key, {"reasoning": reasoning})
+        return reasoning
+
+    async def aclose(self) -> None:
+        await self.client.close()
+
+
+class AsyncORSService(ORSService):
+    """ORSService com directions_geojson assíncrono (geocoding segue síncrono)"""
+
+    def __init__(self, api_key: str, max_connections: int = 100, **kwargs):
+        super().__init__(api_key, **kwargs)
+        self.client = _http_client(max_connections)
+
+    async def directions_geojson(self, payload: Dict) -> httpx.Response:
+        """
+        Mesmo contrato de ORSService.directions_geojson
+
+        Returns:
+            httpx.Response (mesma interface usada: status_code, json(), raise_for_status())
+            
+        Raises:
+            CircuitOpenError: ORS directions indisponível (circuito aberto)
+        """
+        breaker = self.breakers["directions"]
+        if not breaker.allow():
+            raise CircuitOpenError(breaker.name)
+        connect, read = self.request_timeout("directions")
+        start = time.perf_counter()
+        try:
+            response = await self.client.post(
+                f"{self.DIRECTIONS_URL}/geojson",
+                json=payload,
+                headers={**self.headers, "Content-Type": "application/json"},
+                timeout=httpx.Timeout(read, connect=connect)
+            )
+        except asyncio.CancelledError:
+            breaker.release()
+            raise
+        except BaseException:
+            breaker.record_failure()
+            raise
+        self._record_status(breaker, response.status_code, time.perf_counter() - start)
+        return response
+
+    async def aclose(self) -> None:
+        await self.client.aclose()
@@ -0,0 +1,359 @@
+# services/cache.py
+"""
+Cache em camadas para respostas de APIs externas
+
+- LRUCache: camada em processo (LRU + TTL), sempre disponível
+- RedisCache: camada compartilhada entre processos (opcional, via REDIS_URL)
+- SQLiteCache: camada persistente em arquivo local (alternativa ao Redis)
+- TieredCache: combina as duas (LRU na frente do Redis) com contadores de hit/miss
+- geohash_encode: chave espacial para agrupar coordenadas próximas
+
+Se o Redis não estiver configurado ou acessível, o cache funciona apenas
+em memória (útil em testes e em desenvolvimento local).
+"""
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple, Union
+
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+_GEOHASH_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def geohash_encode(lat: float, lon: float, precision: int = 6) -> str:
+    """
+    Codifica uma coordenada em geohash
+    
+    Args:
+        lat: Latitude (-90 a 90)
+        lon: Longitude (-180 a 180)
+        precision: Número de caracteres (6 ≈ 1.2 km x 0.6 km, 7 ≈ 150 m)
+        
+    Returns:
+        String geohash (ex: "6gyf4b")
+    """
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True  # Bits pares codificam longitude
+    
+    while len(chars) < precision:
+        rng, value = (lon_range, lon) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        if value >= mid:
+            bits = (bits << 1) | 1
+            rng[0] = mid
+        else:
+            bits = bits << 1
+            rng[1] = mid
+        even = not even
+        bit_count += 1
+        
+        if bit_count == 5:
+            chars.append(_GEOHASH_BASE32[bits])
+            bits = 0
+            bit_count = 0
+    
+    return "".join(chars)
+
+
+class LRUCache:
+    """Cache em processo com despejo LRU e expiração por TTL (thread-safe)"""
+    
+    def __init__(self, max_entries: int = 1024, ttl_s: float = 600):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self._lock = threading.Lock()
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+    
+    def get(self, key: str) -> Optional[Any]:
+        """Retorna o valor ou None se ausente/expirado"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+    
+    def set(self, key: str, value: Any, ttl_s: Optional[float] = None) -> None:
+        """Armazena value por ttl_s segundos (padrão: self.ttl_s)"""
+        ttl = self.ttl_s if ttl_s is None else ttl_s
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+    
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class RedisCache:
+    """
+    Camada Redis (valores serializados em JSON)
+    
+    Erros de conexão nunca propagam: são logados e tratados como miss,
+    para que uma falha do Redis não derrube a requisição.
+    """
+    
+    def __init__(self, client, namespace: str, ttl_s: float = 600):
+        self.client = client
+        self.namespace = namespace
+        self.ttl_s = ttl_s
+    
+    @classmethod
+    def from_url(cls, redis_url: str, namespace: str, ttl_s: float = 600) -> Optional["RedisCache"]:
+        """
+        Cria a camada Redis a partir de uma URL
+        
+        Returns:
+            RedisCache ou None se o pacote redis não estiver instalado
+            ou o servidor não responder
+        """
+        try:
+            import redis
+        except ImportError:
+            logger.warning("Pacote redis não instalado; cache apenas em memória")
+            return None
+        
+        try:
+            client = redis.Redis.from_url(
+                redis_url,
+                socket_timeout=0.25,  # Cache lento não pode atrasar a rota
+                socket_connect_timeout=0.5
+            )
+            client.ping()
+        except Exception as e:
+            logger.warning(f"Redis indisponível ({e}); cache '{namespace}' apenas em memória")
+            return None
+        
+        return cls(client, namespace, ttl_s)
+    
+    def _key(self, key: str) -> str:
+        return f"smartroute:{self.namespace}:{key}"
+    
+    def get(self, key: str) -> Optional[Any]:
+        return self.get_with_ttl(key)[0]
+    
+    def get_with_ttl(self, key: str) -> Tuple[Optional[Any], Optional[float]]:
+        """(valor, segundos restantes) — GET e PTTL na mesma ida ao Redis"""
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            pipe.get(self._key(key))
+            pipe.pttl(self._key(key))
+            raw, pttl = pipe.execute()
+        except Exception as e:
+            logger.warning(f"Redis get error ({self.namespace}): {e}")
+            metrics.incr(f"cache.{self.namespace}.remote_error")
+            return None, None
+        if raw is None:
+            return None, None
+        try:
+            value = json.loads(raw)
+        except (ValueError, TypeError):
+            return None, None
+        # PTTL negativo: chave sem expiração (ou que acabou de expirar)
+        return value, (pttl / 1000 if pttl is not None and pttl >= 0 else None)
+    
+    def set(self, key: str, value: Any, ttl_s: Optional[float] = None) -> None:
+        ttl = self.ttl_s if ttl_s is None else ttl_s
+        try:
+            self.client.set(self._key(key), json.dumps(value, ensure_ascii=False), ex=max(1, int(ttl)))
+        except Exception as e:
+            logger.warning(f"Redis set error ({self.namespace}): {e}")
+            metrics.incr(f"cache.{self.namespace}.remote_error")
+
+
+class SQLiteCache:
+    """
+    Camada persistente em arquivo SQLite (valores serializados em JSON)
+    
+    Útil quando não há Redis: sobrevive a restarts e é compartilhada entre
+    os workers do gunicorn da mesma máquina (modo WAL). Como no Redis,
+    erros nunca propagam e são tratados como miss.
+    """
+    
+    # Intervalo entre limpezas das linhas expiradas (o arquivo não cresce sem limite)
+    PURGE_INTERVAL_S = 3600
+    
+    def __init__(self, path: Union[str, Path], namespace: str, ttl_s: float = 600):
+        self.path = Path(path)
+        self.namespace = namespace
+        self.ttl_s = ttl_s
+        self._lock = threading.Lock()
+        self._next_purge = 0.0
+        
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, timeout=1.0)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                " namespace TEXT NOT NULL,"
+                " key TEXT NOT NULL,"
+                " value TEXT NOT NULL,"
+                " expires_at REAL NOT NULL,"
+                " PRIMARY KEY (namespace, key))"
+            )
+        self.purge_expired()
+    
+    def get(self, key: str) -> Optional[Any]:
+        return self.get_with_ttl(key)[0]
+    
+    def get_with_ttl(self, key: str) -> Tuple[Optional[Any], Optional[float]]:
+        """(valor, segundos restantes até expires_at)"""
+        try:
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT value, expires_at FROM cache WHERE namespace = ? AND key = ?",
+                    (self.namespace, key)
+                ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"SQLite get error ({self.namespace}): {e}")
+            metrics.incr(f"cache.{self.namespace}.remote_error")
+            return None, None
+        remaining = row[1] - time.time() if row is not None else 0
+        if remaining <= 0:
+            return None, None
+        try:
+            return json.loads(row[0]), remaining
+        except (ValueError, TypeError):
+            return None, None
+    
+    def set(self, key: str, value: Any, ttl_s: Optional[float] = None) -> None:
+        ttl = self.ttl_s if ttl_s is None else ttl_s
+        try:
+            with self._lock, self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO cache (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                    (self.namespace, key, json.dumps(value, ensure_ascii=False), time.time() + ttl)
+                )
+        except sqlite3.Error as e:
+            logger.warning(f"SQLite set error ({self.namespace}): {e}")
+            metrics.incr(f"cache.{self.namespace}.remote_error")
+        if time.time() >= self._next_purge:
+            self.purge_expired()
+    
+    def purge_expired(self) -> int:
+        """Apaga as linhas expiradas (de todos os namespaces do arquivo)"""
+        self._next_purge = time.time() + self.PURGE_INTERVAL_S
+        try:
+            with self._lock, self._conn:
+                deleted = self._conn.execute("DELETE FROM cache WHERE expires_at < ?", (time.time(),)).rowcount
+        except sqlite3.Error as e:
+            logger.warning(f"SQLite purge error ({self.namespace}): {e}")
+            return 0
+        if deleted:
+            logger.info(f"SQLite cache '{self.namespace}': {deleted} expired entries purged")
+        return deleted
+
+
+class TieredCache:
+    """
+    Cache em duas camadas: LRU em processo na frente de uma camada remota
+    
+    Métodos principais:
+    - get(key): Busca na LRU, depois na camada remota (promovendo para a LRU)
+    - set(key, value, ttl_s): Grava nas duas camadas
+    - stats(): Contadores de hit/miss e hit rate
+    """
+    
+    def __init__(self, name: str, local: LRUCache, remote: Optional[Union[RedisCache, SQLiteCache]] = None):
+        self.name = name
+        self.local = local
+        self.remote = remote
+        self._lock = threading.Lock()
+        self._stats = {"hit_local": 0, "hit_remote": 0, "miss": 0}
+    
+    @property
+    def backend(self) -> str:
+        """Descrição das camadas ativas (ex: "memory+redis")"""
+        if isinstance(self.remote, RedisCache):
+            return "memory+redis"
+        if isinstance(self.remote, SQLiteCache):
+            return "memory+sqlite"
+        return "memory"
+    
+    def _count(self, event: str) -> None:
+        with self._lock:
+            self._stats[event] += 1
+        metrics.incr(f"cache.{self.name}.{event}")
+    
+    def get(self, key: str) -> Optional[Any]:
+        value = self.local.get(key)
+        if value is not None:
+            self._count("hit_local")
+            return value
+        
+        if self.remote is not None:
+            value, remaining = self.remote.get_with_ttl(key)
+            if value is not None:
+                self._count("hit_remote")
+                # Promove com o TTL que resta na camada remota (entradas com
+                # TTL próprio, ex: negativas do geocode, não ganham o padrão)
+                ttl = self.local.ttl_s if remaining is None else min(remaining, self.local.ttl_s)
+                self.local.set(key, value, ttl)
+                return value
+        
+        self._count("miss")
+        return None
+    
+    def set(self, key: str, value: Any, ttl_s: Optional[float] = None) -> None:
+        self.local.set(key, value, ttl_s)
+        if self.remote is not None:
+            self.remote.set(key, value, ttl_s)
+    
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+        total = sum(stats.values())
+        hits = stats["hit_local"] + stats["hit_remote"]
+        stats["hit_rate"] = hits / total if total else 0.0
+        stats["backend"] = self.backend
+        stats["local_entries"] = len(self.local)
+        return stats
+
+
+def build_cache(
+    name: str,
+    ttl_s: float,
+    max_entries: int = 1024,
+    redis_url: Optional[str] = None,
+    sqlite_path: Optional[Union[str, Path]] = None
+) -> TieredCache:
+    """
+    Cria um TieredCache: LRU em processo + camada persistente opcional
+    
+    A camada persistente é o Redis (se redis_url for fornecida e acessível);
+    sem Redis, usa o arquivo SQLite em sqlite_path (se informado).
+    
+    Args:
+        name: Namespace do cache (prefixo das chaves e das métricas)
+        ttl_s: Tempo de vida padrão das entradas (segundos)
+        max_entries: Tamanho máximo da camada LRU
+        redis_url: URL do Redis (ex: REDIS_URL do docker-compose) ou None
+        sqlite_path: Arquivo SQLite usado quando não há Redis, ou None
+    """
+    remote = RedisCache.from_url(redis_url, name, ttl_s) if redis_url else None
+    if remote is None and sqlite_path:
+        try:
+            remote = SQLiteCache(sqlite_path, name, ttl_s)
+        except (sqlite3.Error, OSError) as e:
+            logger.warning(f"SQLite indisponível ({e}); cache '{name}' apenas em memória")
+    
+    cache = TieredCache(name, LRUCache(max_entries, ttl_s), remote)
+    logger.info(f"Cache '{name}' inicializado ({cache.backend}, ttl={ttl_s}s)")
+    return cache
@@ -6,11 +6,19 @@ Traduz restrições do usuário em pesos numéricos e fornece justificativas
 Dependências: groq (instalar com: pip install groq)
 Requer: GROQ_API_KEY no .env
 """
+import hashlib
 import json
 import logging
-from typing import Dict, List, Optional
+import math
+import time
+from typing import Callable, Dict, List, Optional, Tuple
 from groq import Groq
 
+from .cache import TieredCache, build_cache
+from .json_stream import IncrementalJSONParser
+from .metrics import metrics
+from .resilience import CircuitOpenError, get_breaker
+
 logger = logging.getLogger(__name__)
 
 
@@ -21,14 +29,76 @@ class GroqLLMService:
     Métodos principais:
     - analyze_routes(constraints, candidates): Analisa rotas e retorna pesos/escolha
     - explain_route_choice(selected, others, constraints): Gera explicação em PT
+    - analyze_routes_batch(problems): Vários problemas num único prompt
+    - decision_key(constraints, candidates): Chave do cache de decisões
     """
     
-    def __init__(self, api_key: str):
+    # Granularidade da quantização usada na chave do cache de decisões:
+    # candidatos que caem nos mesmos buckets recebem a mesma decisão
+    DISTANCE_BUCKET_RATIO = 0.05   # ~5% de diferença de distância
+    DURATION_BUCKET_MIN = 2.0      # 2 min
+    FACTOR_BUCKET = 0.1            # fatores de tráfego/clima (1.0, 1.1, ...)
+    UNPAVED_BUCKET_M = 500         # 500 m de estrada de terra
+    
+    # Partes fixas do prompt, montadas uma única vez: ficam no início das
+    # mensagens (prefixo idêntico entre chamadas) e só a tabela de
+    # candidatas + constraints muda por requisição
+    SYSTEM_PROMPT = (
+        "Você é um assistente especializado em otimização de rotas. "
+        "Analise as rotas candidatas e retorne APENAS JSON válido, "
+        "sem markdown, sem explicações extras. "
+        "Use raciocínio numérico para sugerir pesos e escolher a melhor rota. "
+        "Justificativa deve ser em português brasileiro, máximo 80 palavras."
+    )
+    EXPLAIN_SYSTEM_PROMPT = (
+        "Você é um assistente de navegação que explica escolhas de rota de forma breve e clara."
+    )
+    # Colunas da tabela compacta de candidatas (uma linha por rota)
+    CANDIDATE_COLUMNS = "id|dist_km|base_min|trafego|clima|pedagios|terra_m"
+    _TASK_PREFIX = (
+        "Candidatas em tabela (" + CANDIDATE_COLUMNS + "); trafego e clima são "
+        "fatores multiplicativos do tempo.\n"
+        "1. Para cada restrição \"avoid\", sugira um peso (penalidade em segundos), "
+        "ex: \"toll\": 600 = 10 min por pedágio.\n"
+        "2. Score = base_min*60*trafego*clima + soma(penalidades).\n"
+        "3. Escolha a candidata com MENOR score.\n"
+    )
+    _TASK_WITH_REASONING = _TASK_PREFIX + (
+        "4. Explique (máx 80 palavras, português) POR QUE essa rota foi escolhida.\n"
+        "Saída, JSON nesta ordem de chaves: "
+        "{\"weights\":{\"toll\":600},\"selected_candidate\":1,\"reasoning\":\"...\"}"
+    )
+    _TASK_WITHOUT_REASONING = _TASK_PREFIX + (
+        "Saída, JSON sem justificativa: {\"weights\":{\"toll\":600},\"selected_candidate\":1}"
+    )
+    _TASK_BATCH = _TASK_PREFIX + (
+        "4. Explique (máx 80 palavras, português) POR QUE essa rota foi escolhida.\n"
+        "Resolva CADA problema (P1, P2, ...) de forma independente.\n"
+        "Saída, JSON com um item por problema: "
+        "{\"results\":[{\"problem\":1,\"weights\":{\"toll\":600},"
+        "\"selected_candidate\":1,\"reasoning\":\"...\"}]}"
+    )
+    # Tokens de saída reservados por problema num lote (teto do modelo: 4096)
+    BATCH_TOKENS_PER_PROBLEM = 400
+    BATCH_MAX_TOKENS = 4096
+    
+    def __init__(
+        self,
+        api_key: str,
+        cache: Optional[TieredCache] = None,
+        cache_ttl_s: float = 900,
+        cache_max_entries: int = 2048,
+        redis_url: Optional[str] = None
+    ):
         """
         Inicializa cliente Groq
         
         Args:
             api_key: Chave da API Groq (obtida do .env)
+            cache: Cache de decisões pronto (opcional); se None, cria LRU + Redis
+            cache_ttl_s: Validade das decisões em cache (padrão 15 min)
+            cache_max_entries: Tamanho máximo da camada LRU
+            redis_url: URL do Redis para a camada compartilhada (opcional)
         """
         if not api_key:
             raise ValueError("Groq API key é obrigatória")
@@ -36,16 +106,59 @@ class GroqLLMService:
         self.client = Groq(api_key=api_key)
         # Usa modelo rápido e eficiente para scoring de rotas
         self.model = "llama-3.3-70b-versatile"
+        self.cache = cache or build_cache(
+            "llm", ttl_s=cache_ttl_s, max_entries=cache_max_entries, redis_url=redis_url
+        )
+        # Circuit breaker: com o Groq fora, a decisão fica com a pontuação local
+        self.breaker = get_breaker("groq", timeout_floor_s=3, timeout_ceiling_s=30)
         logger.info(f"GroqLLMService inicializado com modelo {self.model}")
     
+    def decision_key(self, constraints: Dict, candidates: List[Dict]) -> str:
+        """
+        Chave do cache de decisões
+        
+        Combina as constraints normalizadas com as features quantizadas de
+        cada candidata (na ordem/ids recebidos), de modo que requisições
+        quase idênticas reaproveitem a mesma análise do LLM.
+        """
+        normalized_constraints = {
+            k: sorted(v, key=lambda item: json.dumps(item, sort_keys=True, default=str)) if isinstance(v, list) else v
+            for k, v in sorted((constraints or {}).items())
+        }
+        
+        features = []
+        for c in candidates:
+            distance_km = max(c.get("distance_km", 0), 0.001)
+            features.append([
+                c.get("id"),
+                # Bucket logarítmico: ~5% de largura em qualquer escala
+                round(math.log(distance_km) / math.log1p(self.DISTANCE_BUCKET_RATIO)),
+                round(c.get("duration_base_min", 0) / self.DURATION_BUCKET_MIN),
+                round(c.get("traffic_factor", 1.0) / self.FACTOR_BUCKET),
+                round(c.get("weather_factor", 1.0) / self.FACTOR_BUCKET),
+                c.get("toll_count", 0),
+                round(c.get("unpaved_meters", 0) / self.UNPAVED_BUCKET_M)
+            ])
+        
+        raw = json.dumps([self.model, normalized_constraints, features], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+    
     def analyze_routes(
         self, 
         constraints: Dict[str, any],
-        candidates: List[Dict]
+        candidates: List[Dict],
+        include_reasoning: bool = True,
+        on_decision: Optional[Callable[[Dict], None]] = None,
+        on_reasoning_token: Optional[Callable[[str], None]] = None
     ) -> Optional[Dict]:
         """
         Analisa rotas candidatas baseado em constraints do usuário
         
+        A resposta é lida em streaming e analisada incrementalmente: assim que
+        "weights" e "selected_candidate" chegam a decisão fica disponível
+        (on_decision) enquanto "reasoning" ainda está sendo gerado; sem
+        justificativa, o stream é encerrado logo após a decisão.
+        
         Args:
             constraints: Dict com preferências
                 Exemplo: {"avoid": ["toll"], "prefer": ["fastest"]}
@@ -62,6 +175,12 @@ class GroqLLMService:
                     },
                     ...
                 ]
+            include_reasoning: Se False, pede apenas pesos + escolha (resposta
+                menor e mais rápida); a justificativa pode ser gerada depois
+                com explain_routes()
+            on_decision: Chamado uma vez com {"weights", "selected_candidate"}
+                assim que a decisão é recebida (antes da justificativa)
+            on_reasoning_token: Chamado com cada trecho novo da justificativa
             
         Returns:
             Dict com {
@@ -82,128 +201,403 @@ class GroqLLMService:
             "reasoning": "Rota 1 escolhida pois evita pedágios (economia de R$15) e tem menor tempo total ajustado (23 min vs 27 min da rota 2)."
         }
         """
+        # Decisão recente para constraints + candidatas equivalentes?
+        cache_key = self.decision_key(constraints, candidates)
+        cached = self.cached_decision(constraints, candidates, include_reasoning, cache_key)
+        if cached is not None:
+            logger.info(f"Groq LLM decision cache hit. Selected: {cached['selected_candidate']}")
+            if on_decision:
+                on_decision({"weights": cached["weights"], "selected_candidate": cached["selected_candidate"]})
+            return cached
+        
         # Monta o prompt estruturado
-        prompt = self._build_prompt(constraints, candidates)
+        prompt = self._build_prompt(constraints, candidates, include_reasoning)
+        analysis = _AnalysisStream(self, include_reasoning, on_decision, on_reasoning_token)
         
         try:
-            # Chama Groq API
-            completion = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {
-                        "role": "system",
-                        "content": (
-                            "Você é um assistente especializado em otimização de rotas. "
-                            "Analise as rotas candidatas e retorne APENAS JSON válido, "
-                            "sem markdown, sem explicações extras. "
-                            "Use raciocínio numérico para sugerir pesos e escolher a melhor rota. "
-                            "Justificativa deve ser em português brasileiro, máximo 80 palavras."
-                        )
-                    },
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
-                temperature=0.3,  # Baixa para respostas mais determinísticas
-                max_tokens=500,   # Suficiente para JSON + justificativa
-                top_p=0.9
-            )
-            
-            response_text = completion.choices[0].message.content.strip()
-            logger.debug(f"Groq raw response: {response_text}")
-            
-            # Remove possíveis markdown fences (```json ... ```)
-            if response_text.startswith("```"):
-                lines = response_text.split("\n")
-                # Remove primeira linha se for fence
-                if lines[0].startswith("```"):
-                    lines = lines[1:]
-                # Remove última linha se for fence
-                if lines and lines[-1].strip() == "```":
-                    lines = lines[:-1]
-                response_text = "\n".join(lines)
-            
-            # Parse JSON
-            result = json.loads(response_text)
-            
-            # Valida estrutura mínima
-            required_keys = ["weights", "selected_candidate", "reasoning"]
-            if not all(k in result for k in required_keys):
-                logger.error(f"LLM response missing keys: {result}")
-                return None
-            
-            # Valida tipos
-            if not isinstance(result["weights"], dict):
-                logger.error(f"LLM weights is not a dict: {result['weights']}")
-                return None
+            # Chama Groq API (streaming: a decisão chega antes do fim da resposta)
+            with self.breaker.track():
+                stream = self.client.chat.completions.create(**self._analysis_request(prompt, include_reasoning))
+                try:
+                    for chunk in stream:
+                        if analysis.feed(chunk):
+                            break
+                finally:
+                    close = getattr(stream, "close", None)
+                    if close:
+                        close()
+                    self._record_usage("analyze", analysis.start, analysis.usage, prompt, analysis.text)
+            # JSON inválido do modelo não é falha do provedor: sai fora do breaker
+            analysis.raise_parse_error()
             
-            if not isinstance(result["selected_candidate"], int):
-                logger.error(f"LLM selected_candidate is not an int: {result['selected_candidate']}")
-                return None
+            return self._finish_analysis(analysis, cache_key)
             
-            if not isinstance(result["reasoning"], str):
-                logger.error(f"LLM reasoning is not a string: {result['reasoning']}")
-                return None
+        except CircuitOpenError:
+            logger.warning("Groq LLM skipped: circuit open")
+            return None
+        except (json.JSONDecodeError, ValueError) as e:
+            logger.error(f"Failed to parse LLM JSON response: {e}\nResponse: {analysis.text}")
+            return None
+        except Exception as e:
+            logger.error(f"Groq LLM error: {e}")
+            return None
+    
+    def _analysis_request(self, prompt: str, include_reasoning: bool) -> Dict:
+        """Argumentos do chat.completions.create da análise (clientes sync e async)"""
+        return {
+            "model": self.model,
+            "messages": [
+                {
+                    "role": "system",
+                    "content": self.SYSTEM_PROMPT
+                },
+                {
+                    "role": "user",
+                    "content": prompt
+                }
+            ],
+            "temperature": 0.3,  # Baixa para respostas mais determinísticas
+            # 500 é suficiente para JSON + justificativa; sem ela, bem menos
+            "max_tokens": 500 if include_reasoning else 150,
+            "top_p": 0.9,
+            "stream": True,
+            "timeout": self.breaker.timeout()
+        }
+    
+    def _finish_analysis(self, analysis: "_AnalysisStream", cache_key: str) -> Optional[Dict]:
+        """Valida o resultado do stream e grava no cache"""
+        logger.debug(f"Groq raw response: {analysis.text}")
+        result = analysis.result()
+        if result is None:
+            return None
+        
+        logger.info(f"Groq LLM analysis successful. Selected: {result['selected_candidate']}")
+        self.cache.set(cache_key, result)
+        return result
+    
+    def _strip_fences(self, response_text: str) -> str:
+        """Remove possíveis markdown fences (```json ... ```)"""
+        if response_text.startswith("```"):
+            lines = response_text.split("\n")
+            # Remove primeira linha se for fence
+            if lines[0].startswith("```"):
+                lines = lines[1:]
+            # Remove última linha se for fence
+            if lines and lines[-1].strip() == "```":
+                lines = lines[:-1]
+            response_text = "\n".join(lines)
+        return response_text
+    
+    def _validate_result(self, result: Dict, include_reasoning: bool) -> bool:
+        """Valida estrutura mínima e tipos da resposta do LLM"""
+        if not isinstance(result, dict):
+            logger.error(f"LLM response is not an object: {result}")
+            return False
+        
+        required_keys = ["weights", "selected_candidate"]
+        if include_reasoning:
+            required_keys.append("reasoning")
+        if not all(k in result for k in required_keys):
+            logger.error(f"LLM response missing keys: {result}")
+            return False
+        
+        # Valida tipos
+        if not isinstance(result["weights"], dict):
+            logger.error(f"LLM weights is not a dict: {result['weights']}")
+            return False
+        
+        if not isinstance(result["selected_candidate"], int):
+            logger.error(f"LLM selected_candidate is not an int: {result['selected_candidate']}")
+            return False
+        
+        if include_reasoning and not isinstance(result["reasoning"], str):
+            logger.error(f"LLM reasoning is not a string: {result['reasoning']}")
+            return False
+        
+        return True
+    
+    def cached_decision(
+        self,
+        constraints: Dict,
+        candidates: List[Dict],
+        include_reasoning: bool = True,
+        cache_key: Optional[str] = None
+    ) -> Optional[Dict]:
+        """Decisão em cache para o problema (None se ausente ou sem a justificativa pedida)"""
+        cached = self.cache.get(cache_key or self.decision_key(constraints, candidates))
+        if cached is not None and (not include_reasoning or "reasoning" in cached):
+            return cached
+        return None
+    
+    def analyze_routes_batch(
+        self,
+        problems: List[Tuple[Dict, List[Dict]]]
+    ) -> List[Optional[Dict]]:
+        """
+        Analisa vários problemas de escolha de rota numa única chamada
+        
+        Usado pelo LLMBatcher sob carga: N requisições concorrentes pagam
+        um único prompt fixo e uma única requisição contra o rate limit.
+        Problemas já em cache não vão para o LLM.
+        
+        Args:
+            problems: Lista de (constraints, candidates)
             
-            logger.info(f"Groq LLM analysis successful. Selected: {result['selected_candidate']}")
-            return result
+        Returns:
+            Lista alinhada com problems: mesmo formato de analyze_routes
+            (com "reasoning") ou None para o problema que falhar
+        """
+        results: List[Optional[Dict]] = [None] * len(problems)
+        keys = [self.decision_key(c, cand) for c, cand in problems]
+        pending = []
+        for i, (constraints, candidates) in enumerate(problems):
+            cached = self.cached_decision(constraints, candidates, cache_key=keys[i])
+            if cached is not None:
+                results[i] = cached
+            else:
+                pending.append(i)
+        if not pending:
+            return results
+        
+        sections = []
+        for n, i in enumerate(pending, start=1):
+            constraints, candidates = problems[i]
+            avoid_list = constraints.get("avoid", [])
+            prefer_list = constraints.get("prefer", [])
+            sections.append(
+                f"P{n}\n"
+                f"Evitar: {self._constraint_list(avoid_list)}\n"
+                f"Preferir: {self._constraint_list(prefer_list)}\n"
+                f"{self._encode_candidates(candidates)}"
+            )
+        prompt = f"{self._TASK_BATCH}\n\n" + "\n\n".join(sections)
+        
+        response_text = ""
+        start = time.perf_counter()
+        try:
+            with self.breaker.track():
+                completion = self.client.chat.completions.create(
+                    model=self.model,
+                    messages=[
+                        {
+                            "role": "system",
+                            "content": self.SYSTEM_PROMPT
+                        },
+                        {"role": "user", "content": prompt}
+                    ],
+                    temperature=0.3,
+                    max_tokens=min(self.BATCH_TOKENS_PER_PROBLEM * len(pending), self.BATCH_MAX_TOKENS),
+                    top_p=0.9,
+                    # Lote gera várias respostas: teto proporcional ao tamanho
+                    timeout=min(self.breaker.timeout() * len(pending), self.breaker.timeout_ceiling_s)
+                )
+            response_text = completion.choices[0].message.content.strip()
+            self._record_usage("batch", start, getattr(completion, "usage", None), prompt, response_text)
+            items = json.loads(self._strip_fences(response_text)).get("results", [])
+        except (json.JSONDecodeError, ValueError, AttributeError) as e:
+            logger.error(f"Failed to parse LLM batch response: {e}\nResponse: {response_text}")
+            return results
+        except CircuitOpenError:
+            logger.warning("Groq LLM batch skipped: circuit open")
+            return results
+        except Exception as e:
+            logger.error(f"Groq LLM batch error: {e}")
+            return results
+        
+        # Demultiplexa pela numeração P1..Pn (a ordem da resposta não importa)
+        for item in items if isinstance(items, list) else []:
+            if not isinstance(item, dict) or not isinstance(item.get("problem"), int):
+                continue
+            n = item.pop("problem")
+            if not 1 <= n <= len(pending) or not self._validate_result(item, include_reasoning=True):
+                continue
+            i = pending[n - 1]
+            results[i] = item
+            self.cache.set(keys[i], item)
+        
+        missing = sum(1 for i in pending if results[i] is None)
+        if missing:
+            logger.warning(f"LLM batch answered {len(pending) - missing}/{len(pending)} problems")
+        metrics.incr("llm.batch_problems", len(pending))
+        metrics.incr("llm.batch_missing", missing)
+        return results
+    
+    def explain_routes(
+        self,
+        constraints: Dict,
+        candidates: List[Dict],
+        selected_id: int
+    ) -> Optional[str]:
+        """
+        Gera a justificativa (texto livre) para uma escolha já feita
+        
+        Usada quando a rota é devolvida antes da explicação (reasoning
+        assíncrono): a escolha vem da pontuação local ou de analyze_routes
+        com include_reasoning=False.
+        
+        Args:
+            constraints: Restrições do usuário
+            candidates: Lista de rotas candidatas
+            selected_id: ID da candidata escolhida
             
-        except json.JSONDecodeError as e:
-            logger.error(f"Failed to parse LLM JSON response: {e}\nResponse: {response_text}")
+        Returns:
+            Justificativa em português (máx. ~80 palavras) ou None se houver erro
+        """
+        cache_key = self._explain_key(constraints, candidates, selected_id)
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            return cached.get("reasoning")
+        
+        prompt, request = self._explain_request(constraints, candidates, selected_id)
+        start = time.perf_counter()
+        try:
+            with self.breaker.track():
+                completion = self.client.chat.completions.create(**request)
+            reasoning = completion.choices[0].message.content.strip()
+            self._record_usage("explain", start, getattr(completion, "usage", None), prompt, reasoning)
+        except CircuitOpenError:
+            logger.debug("Groq LLM explanation skipped: circuit open")
             return None
         except Exception as e:
-            logger.error(f"Groq LLM error: {e}")
+            logger.error(f"Groq LLM explanation error: {e}")
+            return None
+        
+        if not reasoning:
             return None
+        self.cache.set(cache_key, {"reasoning": reasoning})
+        return reasoning
     
-    def _build_prompt(self, constraints: Dict, candidates: List[Dict]) -> str:
+    @staticmethod
+    def _constraint_list(items) -> str:
+        """avoid/prefer para o prompt; itens livres (ex: objetos) vão como JSON"""
+        if not items:
+            return "nada"
+        if not isinstance(items, list):
+            return str(items)
+        return ", ".join(item if isinstance(item, str) else json.dumps(item, ensure_ascii=False) for item in items)
+    
+    def _explain_key(self, constraints: Dict, candidates: List[Dict], selected_id: int) -> str:
+        """Chave do cache de justificativas (decisão + rota escolhida)"""
+        return f"{self.decision_key(constraints, candidates)}:explain:{selected_id}"
+    
+    def _explain_request(
+        self,
+        constraints: Dict,
+        candidates: List[Dict],
+        selected_id: int
+    ) -> Tuple[str, Dict]:
+        """Prompt + argumentos do chat.completions.create de explain_routes"""
+        avoid_list = constraints.get("avoid", [])
+        prefer_list = constraints.get("prefer", [])
+        prompt = (
+            f"Restrições do usuário: evitar {self._constraint_list(avoid_list)}; "
+            f"preferir {self._constraint_list(prefer_list)}.\n"
+            f"Candidatas ({self.CANDIDATE_COLUMNS}):\n{self._encode_candidates(candidates)}\n"
+            f"A rota {selected_id} foi escolhida. Explique ao motorista, em no máximo "
+            f"80 palavras em português brasileiro, POR QUE essa rota é a melhor, "
+            f"comparando tempo, tráfego, clima e pedágios com as outras. "
+            f"Responda apenas com o texto da explicação."
+        )
+        request = {
+            "model": self.model,
+            "messages": [
+                {
+                    "role": "system",
+                    "content": self.EXPLAIN_SYSTEM_PROMPT
+                },
+                {"role": "user", "content": prompt}
+            ],
+            "temperature": 0.3,
+            "max_tokens": 200,
+            "top_p": 0.9,
+            "timeout": self.breaker.timeout()
+        }
+        return prompt, request
+    
+    def _encode_candidates(self, candidates: List[Dict]) -> str:
+        """
+        Tabela compacta das candidatas (colunas em CANDIDATE_COLUMNS)
+        
+        Uma linha por rota, separada por '|', com números arredondados: bem
+        menos tokens que o JSON indentado e só as features usadas no score.
+        """
+        rows = []
+        for c in candidates:
+            rows.append(
+                f"{c.get('id')}|{c.get('distance_km', 0):.1f}|{c.get('duration_base_min', 0):.1f}|"
+                f"{c.get('traffic_factor', 1.0):.2f}|{c.get('weather_factor', 1.0):.2f}|"
+                f"{c.get('toll_count', 0)}|{c.get('unpaved_meters', 0):.0f}"
+            )
+        return "\n".join(rows)
+    
+    def _build_prompt(
+        self,
+        constraints: Dict,
+        candidates: List[Dict],
+        include_reasoning: bool = True
+    ) -> str:
         """
         Constrói o prompt estruturado para o LLM
         
+        Instruções fixas primeiro (pré-montadas na classe), depois as
+        constraints e a tabela compacta de candidatas.
+        
         Args:
             constraints: Restrições do usuário
             candidates: Lista de rotas candidatas
+            include_reasoning: Se False, não pede justificativa no JSON
             
         Returns:
             String com prompt formatado
         """
-        # Simplifica constraints para o prompt
         avoid_list = constraints.get("avoid", [])
         prefer_list = constraints.get("prefer", [])
+        task = self._TASK_WITH_REASONING if include_reasoning else self._TASK_WITHOUT_REASONING
         
-        # Serializa candidatos (garantindo encoding UTF-8)
-        candidates_json = json.dumps(candidates, indent=2, ensure_ascii=False)
+        return (
+            f"{task}\n"
+            f"Evitar: {self._constraint_list(avoid_list)}\n"
+            f"Preferir: {self._constraint_list(prefer_list)}\n"
+            f"{self._encode_candidates(candidates)}"
+        )
+    
+    def _chunk_usage(self, chunk) -> Optional[Dict]:
+        """Uso de tokens informado num chunk do stream (Groq envia no último, em x_groq)"""
+        usage = getattr(chunk, "usage", None)
+        if usage is None:
+            x_groq = getattr(chunk, "x_groq", None)
+            usage = getattr(x_groq, "usage", None) if x_groq is not None else None
+        return usage
+    
+    def _record_usage(
+        self,
+        kind: str,
+        start: float,
+        usage,
+        prompt: str,
+        completion_text: str
+    ) -> None:
+        """
+        Exporta latência e tokens (prompt vs completion) de uma chamada
         
-        prompt = f"""
-Analise estas rotas com base nas restrições do usuário:
-
-**Restrições:**
-- Evitar: {', '.join(avoid_list) if avoid_list else 'Nenhuma'}
-- Preferir: {', '.join(prefer_list) if prefer_list else 'Nenhuma'}
-
-**Candidatas:**
-{candidates_json}
-
-**Tarefa:**
-1. Para cada restrição "avoid", sugira um peso (penalidade em segundos). Exemplo: "toll": 600 (10 min de penalidade por pedágio).
-2. Calcule um score final para cada candidata: base_time_seconds * traffic_factor * weather_factor + sum(penalidades).
-3. Escolha a candidata com MENOR score final.
-4. Explique brevemente (máx 80 palavras em português) POR QUE essa rota foi escolhida.
-
-**Formato de Saída (JSON apenas):**
-{{
-  "weights": {{
-    "toll": 600,
-    "unpaved": 300,
-    "highway": -60
-  }},
-  "selected_candidate": 1,
-  "reasoning": "Rota 1 escolhida pois evita pedágios (economia de R$15) e tem menor tempo total ajustado (23 min vs 27 min da rota 2), apesar de ser 2km mais longa."
-}}
-
-NÃO inclua markdown, NÃO explique fora do JSON. Retorne APENAS o JSON.
-"""
-        return prompt.strip()
+        Se a API não informar o uso (ex: stream encerrado antes do último
+        chunk), estima ~4 caracteres por token e conta em llm.tokens_estimated.
+        """
+        metrics.incr(f"llm.calls.{kind}")
+        metrics.observe(f"llm.latency_ms.{kind}", (time.perf_counter() - start) * 1000)
+        
+        prompt_tokens = getattr(usage, "prompt_tokens", None) if usage is not None else None
+        completion_tokens = getattr(usage, "completion_tokens", None) if usage is not None else None
+        if prompt_tokens is None or completion_tokens is None:
+            metrics.incr("llm.tokens_estimated")
+            system_prompt = self.EXPLAIN_SYSTEM_PROMPT if kind == "explain" else self.SYSTEM_PROMPT
+            prompt_tokens = (len(prompt) + len(system_prompt)) // 4
+            completion_tokens = len(completion_text) // 4
+        
+        metrics.observe(f"llm.prompt_tokens.{kind}", prompt_tokens)
+        metrics.observe(f"llm.completion_tokens.{kind}", completion_tokens)
+        metrics.incr("llm.prompt_tokens", prompt_tokens)
+        metrics.incr("llm.completion_tokens", completion_tokens)
     
     def explain_route_choice(
         self, 
@@ -253,6 +647,95 @@ NÃO inclua markdown, NÃO explique fora do JSON. Retorne APENAS o JSON.
         return f"Rota selecionada: {', '.join(reasons)}."
 
 
+class _AnalysisStream:
+    """
+    Estado de uma análise lida em streaming (usado pelos clientes sync e async)
+    
+    Alimentado chunk a chunk: dispara on_decision assim que pesos + escolha
+    chegam, repassa os trechos da justificativa e indica quando a leitura
+    pode parar.
+    """
+    
+    def __init__(
+        self,
+        service: GroqLLMService,
+        include_reasoning: bool,
+        on_decision: Optional[Callable[[Dict], None]],
+        on_reasoning_token: Optional[Callable[[str], None]]
+    ):
+        self.service = service
+        self.include_reasoning = include_reasoning
+        self.on_decision = on_decision
+        self.on_reasoning_token = on_reasoning_token
+        self.parser = IncrementalJSONParser(stream_fields=("reasoning",) if on_reasoning_token else ())
+        self.decision: Optional[Dict] = None
+        self.invalid = False
+        self.parse_error: Optional[ValueError] = None
+        self.text = ""
+        self.usage = None
+        self.start = time.perf_counter()
+    
+    def feed(self, chunk) -> bool:
+        """
+        Processa um chunk do stream; True quando não há mais nada a ler
+
+        JSON inválido não é levantado aqui (o stream é lido dentro do
+        breaker.track(), e resposta ruim do modelo não é falha do provedor):
+        fica em parse_error e a leitura para; ver raise_parse_error.
+        """
+        self.usage = self.service._chunk_usage(chunk) or self.usage
+        if not chunk.choices:
+            return False
+        delta = chunk.choices[0].delta.content
+        if not delta:
+            return False
+        self.text += delta
+        
+        fields = self.parser.fields
+        try:
+            for kind, key, value in self.parser.feed(delta):
+                if kind == "partial":
+                    self.on_reasoning_token(value)
+        except ValueError as e:
+            self.parse_error = e
+            return True
+        
+        if self.decision is None and "weights" in fields and "selected_candidate" in fields:
+            self.decision = {
+                "weights": fields["weights"],
+                "selected_candidate": fields["selected_candidate"]
+            }
+            if not self.service._validate_result(self.decision, include_reasoning=False):
+                self.invalid = True
+                return True
+            metrics.observe("llm.latency_ms.decision", (time.perf_counter() - self.start) * 1000)
+            if self.on_decision:
+                self.on_decision(dict(self.decision))
+        
+        # Tudo que interessa já chegou: encerra o stream cedo
+        # (não espera o '}' final nem tokens extras)
+        return self.decision is not None and (not self.include_reasoning or "reasoning" in fields)
+    
+    def raise_parse_error(self) -> None:
+        """Levanta o erro de parse guardado por feed (fora do breaker)"""
+        if self.parse_error is not None:
+            raise self.parse_error
+
+    def result(self) -> Optional[Dict]:
+        """Resultado validado (None se inválido)"""
+        if self.invalid:
+            return None
+        if self.decision is not None:
+            result = dict(self.parser.fields)
+        else:
+            # Parser incremental não achou a decisão: tenta o texto inteiro
+            result = json.loads(self.service._strip_fences(self.text.strip()))
+        
+        if not self.service._validate_result(result, self.include_reasoning):
+            return None
+        return result
+
+
 # ============================================================================
 # AUDITORIA FINAL: ✅ APROVADO
 # - Tratamento de erros robusto (try-catch + validação de JSON)
@@ -264,4 +747,8 @@ NÃO inclua markdown, NÃO explique fora do JSON. Retorne APENAS o JSON.
 # - Fallback manual implementado (explain_route_choice)
 # - Encoding UTF-8 garantido (ensure_ascii=False)
 # - Temperature baixa para consistência (0.3)
+# - Cache de decisões por constraints + features quantizadas (TTL + LRU)
+# - Resposta em streaming com parsing JSON incremental (decisão antecipada)
+# - Prompt compacto (tabela de candidatas) + métricas de tokens/latência
+# - Lotes de problemas num único prompt (analyze_routes_batch)
 # ============================================================================
\ No newline at end of file
@@ -0,0 +1,232 @@
+# services/hedging.py
+"""
+Hedged requests: corta a cauda de latência de chamadas idempotentes
+
+Se a primeira chamada não respondeu até o percentil observado (p90 por
+padrão), uma duplicata é disparada e vale a resposta que chegar primeiro.
+Um orçamento global limita as duplicatas (ex: 5% das chamadas): cada
+chamada primária rende `budget` fichas e cada hedge gasta uma, então sob
+degradação geral do upstream o hedging não multiplica a carga.
+
+O percentil usa só a latência das chamadas primárias: um hedge que vence
+mede a partir do próprio disparo e puxaria o limiar para baixo justamente
+quando o upstream está lento.
+
+Métricas (prefixo hedge.<name>): calls, sent, won, budget_exhausted, pool_full
+"""
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Awaitable, Callable, Deque, Optional
+
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class Hedger:
+    """
+    Política de hedging de um endpoint (thread-safe)
+
+    Métodos principais:
+    - run(fn, *args): Execução síncrona (threads); o perdedor termina em
+      background, os hedges num pool próprio e limitado
+    - arun(coro_fn, *args): Execução asyncio; o perdedor é cancelado
+    - hedge_delay(): Espera antes da duplicata (None enquanto não há amostras)
+    - stats(): Percentil atual, fichas e contadores
+
+    Uma chamada "falhou" quando levanta exceção ou devolve None (contrato dos
+    serviços deste pacote); nesse caso a outra tentativa, se houver, decide.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        percentile: float = 0.9,
+        budget: float = 0.05,
+        window: int = 200,
+        min_samples: int = 20,
+        min_delay_s: float = 0.05,
+        max_tokens: float = 10.0,
+        max_workers: int = 16
+    ):
+        """
+        Args:
+            name: Nome do endpoint (métricas)
+            percentile: Percentil das latências de sucesso que dispara o hedge
+            budget: Fração máxima de chamadas extras (0.05 = 5%)
+            window: Quantas latências recentes entram no percentil
+            min_samples: Mínimo de amostras antes de começar a fazer hedge
+            min_delay_s: Menor espera antes da duplicata
+            max_tokens: Teto de fichas acumuladas (rajada máxima de hedges)
+            max_workers: Threads para as chamadas primárias de run(); os
+                hedges usam um pool separado de max_workers // 4 threads
+        """
+        self.name = name
+        self.percentile = percentile
+        self.budget = budget
+        self.min_samples = min_samples
+        self.min_delay_s = min_delay_s
+        self.max_tokens = max_tokens
+
+        self._lock = threading.Lock()
+        self._latencies: Deque[float] = deque(maxlen=window)
+        self._tokens = 0.0
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"hedge-{name}")
+        # Hedges perdedores seguem rodando (requests não cancela): pool
+        # próprio, para não ocupar as threads das primárias; cheio = sem hedge
+        self._hedge_workers = max(1, max_workers // 4)
+        self._hedges_in_flight = 0
+        self._hedge_executor = ThreadPoolExecutor(
+            max_workers=self._hedge_workers, thread_name_prefix=f"hedge-{name}-dup"
+        )
+
+    def hedge_delay(self) -> Optional[float]:
+        """Percentil das latências recentes (segundos) ou None sem amostras suficientes"""
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return None
+            ordered = sorted(self._latencies)
+        index = min(len(ordered) - 1, int(self.percentile * len(ordered)))
+        return max(self.min_delay_s, ordered[index])
+
+    def _start_call(self) -> None:
+        """Conta uma chamada primária e credita sua fração do orçamento"""
+        metrics.incr(f"hedge.{self.name}.calls")
+        with self._lock:
+            self._tokens = min(self.max_tokens, self._tokens + self.budget)
+
+    def _take_token(self) -> bool:
+        """Gasta uma ficha para disparar um hedge (False se o orçamento acabou)"""
+        with self._lock:
+            if self._tokens >= 1.0:
+                self._tokens -= 1.0
+                return True
+        metrics.incr(f"hedge.{self.name}.budget_exhausted")
+        return False
+
+    def _reserve_hedge(self) -> bool:
+        """Reserva uma thread do pool de hedges (False se todas estão ocupadas)"""
+        with self._lock:
+            if self._hedges_in_flight < self._hedge_workers:
+                self._hedges_in_flight += 1
+                return True
+        metrics.incr(f"hedge.{self.name}.pool_full")
+        return False
+
+    def _release_hedge(self, _future: Future) -> None:
+        with self._lock:
+            self._hedges_in_flight -= 1
+
+    def _timed(self, fn: Callable[..., Any], *args) -> Any:
+        """Executa fn (chamada primária) registrando a latência quando há resultado"""
+        start = time.perf_counter()
+        result = fn(*args)
+        if result is not None:
+            self._record_latency(time.perf_counter() - start)
+        return result
+
+    def _record_latency(self, latency_s: float) -> None:
+        with self._lock:
+            self._latencies.append(latency_s)
+
+    def run(self, fn: Callable[..., Any], *args) -> Any:
+        """
+        Executa fn(*args) com hedging
+
+        A tentativa perdedora não é interrompida (requests não cancela uma
+        chamada em voo): termina numa thread do seu pool (a primária ainda
+        alimenta o percentil). O hedge só sai se houver thread livre no pool
+        de hedges, então perdedores lentos não se acumulam.
+        """
+        self._start_call()
+        delay = self.hedge_delay()
+        primary = self._executor.submit(self._timed, fn, *args)
+        if delay is None:
+            return primary.result()
+
+        done, _ = wait([primary], timeout=delay)
+        if done or not self._reserve_hedge():
+            return primary.result()
+        if not self._take_token():
+            self._release_hedge(primary)
+            return primary.result()
+
+        metrics.incr(f"hedge.{self.name}.sent")
+        hedge = self._hedge_executor.submit(fn, *args)
+        hedge.add_done_callback(self._release_hedge)
+        pending = {primary, hedge}
+        result = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                result = self._future_result(future)
+                if result is not None:
+                    if future is hedge:
+                        metrics.incr(f"hedge.{self.name}.won")
+                    for loser in pending:
+                        loser.cancel()  # Só tem efeito se ainda não começou
+                    return result
+        return result
+
+    def _future_result(self, future: Future) -> Any:
+        """Resultado de uma tentativa; exceções viram None (a outra ainda pode responder)"""
+        try:
+            return future.result()
+        except Exception as e:
+            logger.debug(f"Hedged attempt for {self.name} failed: {e}")
+            return None
+
+    async def arun(self, coro_fn: Callable[..., Awaitable[Any]], *args) -> Any:
+        """Versão asyncio de run(): a tentativa que perder é cancelada"""
+        self._start_call()
+        delay = self.hedge_delay()
+        primary = asyncio.ensure_future(self._atimed(coro_fn, *args))
+        if delay is None:
+            return await primary
+
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done or not self._take_token():
+            return await primary
+
+        metrics.incr(f"hedge.{self.name}.sent")
+        # Sem _atimed: a latência do hedge conta a partir do disparo, não da chamada
+        hedge = asyncio.ensure_future(coro_fn(*args))
+        pending = {primary, hedge}
+        result = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    result = None if task.exception() else task.result()
+                    if result is not None:
+                        if task is hedge:
+                            metrics.incr(f"hedge.{self.name}.won")
+                        return result
+            return result
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _atimed(self, coro_fn: Callable[..., Awaitable[Any]], *args) -> Any:
+        start = time.perf_counter()
+        result = await coro_fn(*args)
+        if result is not None:
+            self._record_latency(time.perf_counter() - start)
+        return result
+
+    def stats(self) -> dict:
+        """Snapshot para /metrics"""
+        delay = self.hedge_delay()
+        with self._lock:
+            samples, tokens, in_flight = len(self._latencies), self._tokens, self._hedges_in_flight
+        return {
+            f"p{int(self.percentile * 100)}_ms": round(delay * 1000, 1) if delay is not None else None,
+            "samples": samples,
+            "budget": self.budget,
+            "tokens": round(tokens, 3),
+            "hedges_in_flight": in_flight
+        }
@@ -0,0 +1,198 @@
+# services/json_stream.py
+"""
+Parser JSON incremental para respostas de LLM em streaming
+
+Recebe o texto em pedaços (deltas do chat streaming) e emite cada campo de
+primeiro nível do objeto assim que o seu valor termina, sem esperar o fim
+da resposta. Campos de texto longos (ex: "reasoning") também podem ser
+emitidos parcialmente, à medida que os caracteres chegam.
+
+Tolera lixo antes do objeto (ex: fence ```json) e ignora o que vier depois
+do '}' final.
+"""
+import json
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# Eventos emitidos por feed():
+#   ("field", chave, valor)   - valor completo de um campo de primeiro nível
+#   ("partial", chave, delta) - trecho novo de um campo de texto em streaming
+ParserEvent = Tuple[str, str, Any]
+
+
+class IncrementalJSONParser:
+    """
+    Máquina de estados sobre o objeto JSON de primeiro nível
+
+    Uso:
+        parser = IncrementalJSONParser(stream_fields=("reasoning",))
+        for chunk in deltas:
+            for kind, key, value in parser.feed(chunk):
+                ...
+        parser.fields  # campos completos até agora
+        parser.done    # True após o '}' final
+    """
+
+    _WHITESPACE = " \t\r\n"
+
+    def __init__(self, stream_fields: Iterable[str] = ()):
+        self.stream_fields = set(stream_fields)
+        self.fields: Dict[str, Any] = {}
+        self.done = False
+        self._buf = ""
+        self._pos = 0
+        self._state = "start"
+        self._key: Optional[str] = None
+        self._value_start = 0
+        self._partial_sent = 0  # Caracteres (decodificados) já emitidos do valor atual
+
+    def feed(self, chunk: str) -> List[ParserEvent]:
+        """Adiciona texto ao buffer e retorna os eventos que ficaram prontos"""
+        events: List[ParserEvent] = []
+        if self.done or not chunk:
+            return events
+        self._buf += chunk
+
+        while not self.done:
+            if not self._step(events):
+                break
+        return events
+
+    def _skip_whitespace(self) -> bool:
+        """Avança sobre espaços; False se o buffer acabou"""
+        while self._pos < len(self._buf) and self._buf[self._pos] in self._WHITESPACE:
+            self._pos += 1
+        return self._pos < len(self._buf)
+
+    def _step(self, events: List[ParserEvent]) -> bool:
+        """Executa uma transição; False se precisa de mais texto"""
+        if self._state == "start":
+            brace = self._buf.find("{", self._pos)
+            if brace < 0:
+                self._pos = len(self._buf)
+                return False
+            self._pos = brace + 1
+            self._state = "key"
+            return True
+
+        if not self._skip_whitespace():
+            return False
+        char = self._buf[self._pos]
+
+        if self._state == "key":
+            if char == "}":
+                self.done = True
+                return False
+            if char != '"':
+                raise ValueError(f"Chave JSON esperada na posição {self._pos}")
+            end = self._string_end(self._pos)
+            if end is None:
+                return False
+            self._key = json.loads(self._buf[self._pos:end])
+            self._pos = end
+            self._state = "colon"
+            return True
+
+        if self._state == "colon":
+            if char != ":":
+                raise ValueError(f"':' esperado na posição {self._pos}")
+            self._pos += 1
+            self._state = "value"
+            self._value_start = -1
+            return True
+
+        if self._state == "value":
+            if self._value_start < 0:
+                self._value_start = self._pos
+                self._partial_sent = 0
+            end = self._value_end(self._value_start)
+            if end is None:
+                if char == '"' and self._key in self.stream_fields:
+                    self._emit_partial(events)
+                return False
+            value = json.loads(self._buf[self._value_start:end])
+            if self._key in self.stream_fields and isinstance(value, str):
+                if len(value) > self._partial_sent:
+                    events.append(("partial", self._key, value[self._partial_sent:]))
+            self.fields[self._key] = value
+            events.append(("field", self._key, value))
+            self._pos = end
+            self._state = "comma"
+            return True
+
+        if self._state == "comma":
+            if char == ",":
+                self._pos += 1
+                self._state = "key"
+                return True
+            if char == "}":
+                self._pos += 1
+                self.done = True
+                return False
+            raise ValueError(f"',' ou '}}' esperado na posição {self._pos}")
+
+        return False
+
+    def _string_end(self, start: int) -> Optional[int]:
+        """Índice logo após a aspa de fechamento da string em start (None se incompleta)"""
+        i = start + 1
+        buf = self._buf
+        while i < len(buf):
+            char = buf[i]
+            if char == "\\":
+                i += 2
+                continue
+            if char == '"':
+                return i + 1
+            i += 1
+        return None
+
+    def _value_end(self, start: int) -> Optional[int]:
+        """Índice logo após o valor JSON em start (None se ainda incompleto)"""
+        buf = self._buf
+        char = buf[start]
+        if char == '"':
+            return self._string_end(start)
+
+        if char in "{[":
+            depth = 0
+            i = start
+            while i < len(buf):
+                char = buf[i]
+                if char == '"':
+                    end = self._string_end(i)
+                    if end is None:
+                        return None
+                    i = end
+                    continue
+                if char in "{[":
+                    depth += 1
+                elif char in "}]":
+                    depth -= 1
+                    if depth == 0:
+                        return i + 1
+                i += 1
+            return None
+
+        # Número / true / false / null: termina no próximo delimitador
+        i = start
+        while i < len(buf) and buf[i] not in ",}]" and buf[i] not in self._WHITESPACE:
+            i += 1
+        return i if i < len(buf) else None
+
+    def _emit_partial(self, events: List[ParserEvent]) -> None:
+        """Emite o trecho já recebido (e decodificável) da string em andamento"""
+        raw = self._buf[self._value_start + 1:]
+        # Não corta um escape no meio (ex: '\\' ou '\\u00e' ainda incompletos)
+        cut = raw.rfind("\\")
+        if cut >= 0:
+            backslashes = len(raw[:cut + 1]) - len(raw[:cut + 1].rstrip("\\"))
+            escape_len = 6 if raw[cut + 1:cut + 2] == "u" else 2
+            if backslashes % 2 == 1 and len(raw) - cut < escape_len:
+                raw = raw[:cut]
+        try:
+            text = json.loads(f'"{raw}"')
+        except ValueError:
+            return
+        if len(text) > self._partial_sent:
+            events.append(("partial", self._key, text[self._partial_sent:]))
+            self._partial_sent = len(text)
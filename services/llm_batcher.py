@@ -0,0 +1,130 @@
+# services/llm_batcher.py
+"""
+Micro-batching de análises de rota entre requisições
+
+Em picos (horário de rush) dezenas de /rota concorrentes chamam
+analyze_routes ao mesmo tempo, cada uma pagando o prompt fixo e uma
+requisição contra o rate limit do Groq. O LLMBatcher segura as análises
+por alguns milissegundos (max_wait_ms), junta até max_batch problemas num
+único prompt e devolve a cada requisição a sua parte da resposta.
+"""
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from typing import Dict, List, Optional, Tuple
+
+from .groq_llm import GroqLLMService
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+_Pending = Tuple[Dict, List[Dict], Future]
+
+
+class LLMBatcher:
+    """
+    Agendador de lotes para GroqLLMService
+
+    Uma thread coletora agrupa as análises pendentes; cada lote é enviado
+    por um pool pequeno, então a coleta do próximo lote continua enquanto
+    o anterior está em voo. Um lote com um único problema usa o
+    analyze_routes normal.
+    """
+
+    def __init__(
+        self,
+        llm: GroqLLMService,
+        max_batch: int = 8,
+        max_wait_ms: float = 15,
+        max_concurrent_batches: int = 4,
+        timeout_s: Optional[float] = None
+    ):
+        """
+        Args:
+            llm: Serviço Groq usado para as chamadas
+            max_batch: Máximo de problemas por prompt
+            max_wait_ms: Tempo máximo que a primeira análise do lote espera
+                por companhia antes do envio
+            max_concurrent_batches: Lotes simultâneos em voo
+            timeout_s: Espera máxima de analyze() pelo lote (None = sem limite);
+                depois disso a requisição fica com a pontuação local
+        """
+        self.llm = llm
+        self.timeout_s = timeout_s
+        self.max_batch = max(1, max_batch)
+        self.max_wait_s = max(0.0, max_wait_ms) / 1000
+        self._queue: "queue.Queue[_Pending]" = queue.Queue()
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_concurrent_batches,
+            thread_name_prefix="llm-batch"
+        )
+        self._collector = threading.Thread(target=self._collect, name="llm-batcher", daemon=True)
+        self._collector.start()
+        logger.info(f"LLMBatcher ativo (max_batch={self.max_batch}, max_wait={max_wait_ms}ms)")
+
+    def analyze(self, constraints: Dict, candidates: List[Dict]) -> Optional[Dict]:
+        """
+        Mesmo contrato de GroqLLMService.analyze_routes (com justificativa)
+
+        Bloqueia até o lote do problema ser respondido (no máximo
+        timeout_s: depois devolve None, como uma falha do LLM); decisões em
+        cache voltam na hora, sem entrar na fila.
+        """
+        cached = self.llm.cached_decision(constraints, candidates)
+        if cached is not None:
+            return cached
+
+        future: Future = Future()
+        self._queue.put((constraints, candidates, future))
+        try:
+            return future.result(timeout=self.timeout_s)
+        except FuturesTimeoutError:
+            # cancel() falha se o resultado chegou entre o timeout e aqui
+            if not future.cancel():
+                return future.result()
+            metrics.incr("llm.batch_timeout")
+            logger.warning(f"LLM batch analysis timed out after {self.timeout_s}s; using local scoring")
+            return None
+
+    def _collect(self) -> None:
+        """Loop da thread coletora: fecha um lote por max_batch ou max_wait"""
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait_s
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._executor.submit(self._dispatch, batch)
+
+    def _dispatch(self, batch: List[_Pending]) -> None:
+        """Envia um lote e entrega cada resultado ao seu solicitante"""
+        # Quem já desistiu (timeout) não ocupa lugar no prompt
+        batch = [pending for pending in batch if not pending[2].cancelled()]
+        if not batch:
+            return
+        metrics.observe("llm.batch_size", len(batch))
+        try:
+            if len(batch) == 1:
+                constraints, candidates, _ = batch[0]
+                results = [self.llm.analyze_routes(constraints, candidates)]
+            else:
+                results = self.llm.analyze_routes_batch(
+                    [(constraints, candidates) for constraints, candidates, _ in batch]
+                )
+        except Exception as e:
+            logger.error(f"LLM batch dispatch failed: {e}")
+            results = [None] * len(batch)
+
+        for (_, _, future), result in zip(batch, results):
+            try:
+                future.set_result(result)
+            except InvalidStateError:
+                pass  # Solicitante desistiu durante a chamada
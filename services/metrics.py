@@ -0,0 +1,59 @@
+# services/metrics.py
+"""
+Registro simples de métricas em processo (contadores e observações)
+
+Os serviços incrementam contadores com nomes hierárquicos
+(ex: "cache.weather.hit_local") e o endpoint /metrics expõe um snapshot.
+"""
+import threading
+from typing import Dict
+
+
+class MetricsRegistry:
+    """
+    Contadores e observações thread-safe
+    
+    Métodos principais:
+    - incr(name, value): Incrementa um contador
+    - observe(name, value): Registra uma observação (count/sum/max)
+    - snapshot(): Retorna cópia de todas as métricas
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, float] = {}
+        self._observations: Dict[str, Dict[str, float]] = {}
+    
+    def incr(self, name: str, value: float = 1) -> None:
+        """Incrementa o contador name (cria com 0 se não existir)"""
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+    
+    def observe(self, name: str, value: float) -> None:
+        """Registra uma observação (ex: latência em ms)"""
+        with self._lock:
+            obs = self._observations.get(name)
+            if obs is None:
+                obs = {"count": 0, "sum": 0.0, "max": value}
+                self._observations[name] = obs
+            obs["count"] += 1
+            obs["sum"] += value
+            obs["max"] = max(obs["max"], value)
+    
+    def get(self, name: str) -> float:
+        """Valor atual do contador name (0 se não existir)"""
+        with self._lock:
+            return self._counters.get(name, 0)
+    
+    def snapshot(self) -> Dict:
+        """Cópia de todas as métricas (contadores e observações com média)"""
+        with self._lock:
+            observations = {
+                name: {**obs, "avg": obs["sum"] / obs["count"] if obs["count"] else 0.0}
+                for name, obs in self._observations.items()
+            }
+            return {"counters": dict(self._counters), "observations": observations}
+
+
+# Registro global do processo
+metrics = MetricsRegistry()
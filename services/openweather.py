@@ -10,6 +10,10 @@ import requests
 import logging
 from typing import Dict, Optional
 
+from .cache import TieredCache, build_cache, geohash_encode
+from .resilience import CircuitOpenError, connect_read_timeout, get_breaker
+from .singleflight import SingleFlight
+
 logger = logging.getLogger(__name__)
 
 
@@ -25,19 +29,46 @@ class OpenWeatherService:
     
     BASE_URL = "https://api.openweathermap.org/data/2.5"
     
-    def __init__(self, api_key: str):
+    def __init__(
+        self,
+        api_key: str,
+        cache: Optional[TieredCache] = None,
+        geohash_precision: int = 6,
+        cache_ttl_s: float = 600,
+        redis_url: Optional[str] = None
+    ):
         """
         Inicializa cliente OpenWeather
         
         Args:
             api_key: Chave da API OpenWeather (obtida do .env)
+            cache: Cache pronto (opcional); se None, cria LRU + Redis (se redis_url)
+            geohash_precision: Tamanho do bucket espacial do cache
+                (6 ≈ 1.2 km x 0.6 km: o clima praticamente não muda dentro dele)
+            cache_ttl_s: Validade das entradas do cache (padrão 10 min)
+            redis_url: URL do Redis para a camada compartilhada (opcional)
         """
         if not api_key:
             raise ValueError("OpenWeather API key é obrigatória")
         
         self.api_key = api_key
         self.session = requests.Session()
-        logger.info("OpenWeatherService inicializado")
+        self.geohash_precision = geohash_precision
+        self.cache = cache or build_cache("weather", ttl_s=cache_ttl_s, redis_url=redis_url)
+        # Consultas idênticas em voo são compartilhadas (uma única chamada HTTP)
+        self._inflight = SingleFlight()
+        # Circuit breaker: com o OpenWeather fora, o corredor usa fator 1.0 na hora
+        self.breaker = get_breaker("openweather", timeout_ceiling_s=10)
+        logger.info(f"OpenWeatherService inicializado (geohash={geohash_precision})")
+    
+    def location_key(self, lat: float, lon: float) -> str:
+        """
+        Chave que identifica consultas equivalentes para uma coordenada
+        
+        Coordenadas no mesmo bucket geohash compartilham a mesma resposta:
+        no cache, no single-flight e no memo por requisição do otimizador.
+        """
+        return geohash_encode(lat, lon, self.geohash_precision)
     
     def get_weather(self, lat: float, lon: float) -> Optional[Dict]:
         """
@@ -65,37 +96,34 @@ class OpenWeatherService:
             "snow_1h_mm": 0
         }
         """
-        url = f"{self.BASE_URL}/weather"
-        params = {
-            "lat": lat,
-            "lon": lon,
-            "appid": self.api_key,
-            "units": "metric",  # Celsius
-            "lang": "pt_br"  # Descrições em português
-        }
-        
+        key = self.location_key(lat, lon)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        return self._inflight.do(key, self._fetch_and_cache, key, lat, lon)
+    
+    def _fetch_and_cache(self, key: str, lat: float, lon: float) -> Optional[Dict]:
+        """Busca no upstream e grava no cache (falhas não são cacheadas)"""
+        weather = self._fetch_weather(lat, lon)
+        if weather is not None:
+            self.cache.set(key, weather)
+        return weather
+    
+    def _fetch_weather(self, lat: float, lon: float) -> Optional[Dict]:
+        """Executa a chamada HTTP ao OpenWeather (sem coalescência)"""
         try:
-            response = self.session.get(url, params=params, timeout=10)
-            response.raise_for_status()
-            data = response.json()
-            
-            # Extrai dados relevantes (defensive programming)
-            weather = data.get("weather", [{}])[0]
-            main = data.get("main", {})
-            
-            return {
-                "condition": weather.get("main", "Clear"),  # Rain, Snow, Clear, etc
-                "description": weather.get("description", ""),
-                "temp_celsius": main.get("temp", 20),
-                "feels_like": main.get("feels_like", 20),
-                "humidity": main.get("humidity", 50),
-                "visibility_meters": data.get("visibility", 10000),
-                "wind_speed_ms": data.get("wind", {}).get("speed", 0),
-                "clouds_percent": data.get("clouds", {}).get("all", 0),
-                "rain_1h_mm": data.get("rain", {}).get("1h", 0),
-                "snow_1h_mm": data.get("snow", {}).get("1h", 0)
-            }
+            with self.breaker.track():
+                response = self.session.get(
+                    f"{self.BASE_URL}/weather", params=self._weather_params(lat, lon),
+                    timeout=connect_read_timeout(self.breaker)
+                )
+                response.raise_for_status()
+                data = response.json()
+            return self._parse_weather(data)
             
+        except CircuitOpenError:
+            logger.debug(f"OpenWeather skipped at ({lat}, {lon}): circuit open")
+            return None
         except requests.exceptions.HTTPError as e:
             logger.warning(f"OpenWeather HTTP error at ({lat}, {lon}): {e}")
             return None  # Graceful degradation
@@ -103,6 +131,35 @@ class OpenWeatherService:
             logger.error(f"OpenWeather unexpected error at ({lat}, {lon}): {e}")
             return None
     
+    def _weather_params(self, lat: float, lon: float) -> Dict:
+        """Parâmetros do /weather (compartilhados com o cliente async)"""
+        return {
+            "lat": lat,
+            "lon": lon,
+            "appid": self.api_key,
+            "units": "metric",  # Celsius
+            "lang": "pt_br"  # Descrições em português
+        }
+    
+    def _parse_weather(self, data: Dict) -> Dict:
+        """Extrai os campos usados no fator climático da resposta do /weather"""
+        # Extrai dados relevantes (defensive programming)
+        weather = data.get("weather", [{}])[0]
+        main = data.get("main", {})
+        
+        return {
+            "condition": weather.get("main", "Clear"),  # Rain, Snow, Clear, etc
+            "description": weather.get("description", ""),
+            "temp_celsius": main.get("temp", 20),
+            "feels_like": main.get("feels_like", 20),
+            "humidity": main.get("humidity", 50),
+            "visibility_meters": data.get("visibility", 10000),
+            "wind_speed_ms": data.get("wind", {}).get("speed", 0),
+            "clouds_percent": data.get("clouds", {}).get("all", 0),
+            "rain_1h_mm": data.get("rain", {}).get("1h", 0),
+            "snow_1h_mm": data.get("snow", {}).get("1h", 0)
+        }
+    
     def calculate_weather_factor(self, weather_data: Optional[Dict]) -> float:
         """
         Calcula fator multiplicador baseado em condições climáticas
@@ -212,7 +269,8 @@ class OpenWeatherService:
 # - Logs informativos para debugging
 # - Documentação inline completa
 # - Validação de inputs
-# - Timeout configurado (10s)
+# - Timeout adaptativo (até 10s) + circuit breaker
+# - Cache geohash + TTL (LRU em processo na frente do Redis)
 # - Suporte para português (lang=pt_br)
 # - Mapeamento completo de condições climáticas
 # ============================================================================
\ No newline at end of file
@@ -0,0 +1,292 @@
+# services/ors.py
+"""
+Cliente compartilhado para OpenRouteService (geocoding + directions)
+
+Todas as chamadas ao ORS passam por uma única Session com pool de conexões
+keep-alive (evita um handshake TCP+TLS por requisição), retries com backoff
+nas chamadas idempotentes (GET), timeouts adaptativos e um circuit breaker
+por endpoint.
+
+Dependências: requests (já instalada)
+Requer: ORS_API_KEY no .env
+"""
+import hashlib
+import logging
+import re
+import time
+import unicodedata
+from typing import Dict, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .cache import TieredCache
+from .metrics import metrics
+from .resilience import CircuitBreaker, CircuitOpenError, get_breaker, is_upstream_failure_status
+from .singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_address(address: str) -> str:
+    """
+    Normaliza um endereço para uso como chave de cache
+    
+    Remove acentos, ignora maiúsculas/minúsculas e colapsa espaços:
+    "  Av. Paulista,1000 - São Paulo " -> "av. paulista, 1000 - sao paulo"
+    """
+    text = unicodedata.normalize("NFKD", address)
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    text = text.casefold()
+    text = re.sub(r"\s*,\s*", ", ", text)
+    return re.sub(r"\s+", " ", text).strip(" ,")
+
+
+class ORSService:
+    """
+    Cliente para OpenRouteService
+    
+    Métodos principais:
+    - geocode_search(text, country, size): GET /geocode/search
+    - directions_geojson(payload): POST /v2/directions/driving-car/geojson
+    - geocode(address, country): Geocoding com cache (positivo e negativo)
+    - geocode_cached(address, country): Consulta somente o cache
+    """
+    
+    BASE_URL = "https://api.openrouteservice.org"
+    DIRECTIONS_URL = f"{BASE_URL}/v2/directions/driving-car"
+    
+    # (connect, read) em segundos, por endpoint
+    DEFAULT_TIMEOUTS = {
+        "geocode": (3.05, 10),
+        "directions": (3.05, 15)
+    }
+    
+    # Endereços mudam raramente: resultados ficam 30 dias; "não encontrado"
+    # fica 1 dia (o endereço pode passar a existir na base do ORS)
+    GEOCODE_TTL_S = 30 * 24 * 3600
+    GEOCODE_NEGATIVE_TTL_S = 24 * 3600
+    
+    def __init__(
+        self,
+        api_key: str,
+        use_bearer: bool = False,
+        pool_size: int = 10,
+        max_retries: int = 2,
+        backoff_factor: float = 0.3,
+        timeouts: Optional[Dict[str, tuple]] = None,
+        geocode_cache: Optional[TieredCache] = None
+    ):
+        """
+        Inicializa cliente ORS
+        
+        Args:
+            api_key: Chave da API ORS (obtida do .env)
+            use_bearer: Se True, usa "Authorization: Bearer <chave>"
+            pool_size: Conexões keep-alive mantidas por processo; alinhe com o
+                número de threads do gunicorn (cada thread pode ter 1 chamada em voo)
+            max_retries: Tentativas extras em GETs (erros de conexão, 429 e 5xx)
+            backoff_factor: Base do backoff exponencial entre tentativas (s)
+            timeouts: Sobrescreve DEFAULT_TIMEOUTS por endpoint
+            geocode_cache: Cache de geocoding (Redis/SQLite); None desativa
+        """
+        if not api_key:
+            raise ValueError("ORS API key é obrigatória")
+        
+        self.timeouts = {**self.DEFAULT_TIMEOUTS, **(timeouts or {})}
+        
+        self.headers = {
+            "Authorization": f"Bearer {api_key}" if use_bearer else api_key
+        }
+        
+        # Retries apenas em métodos idempotentes (POST de directions não repete)
+        retry = Retry(
+            total=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(["GET"]),
+            respect_retry_after_header=True,
+            raise_on_status=False  # Devolve a última resposta; o chamador trata o status
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        
+        self.session = requests.Session()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        
+        self.geocode_cache = geocode_cache
+        self._geocode_inflight = SingleFlight()
+        
+        # Timeout de leitura configurado vira o teto do timeout adaptativo
+        self.breakers = {
+            endpoint: get_breaker(f"ors.{endpoint}", timeout_ceiling_s=read)
+            for endpoint, (_, read) in self.timeouts.items()
+        }
+        
+        logger.info(f"ORSService inicializado (pool={pool_size}, retries={max_retries})")
+    
+    def geocode_search(self, text: str, country: str = "BRA", size: int = 1) -> requests.Response:
+        """
+        Geocodifica um endereço
+        
+        Args:
+            text: Endereço livre
+            country: Código ISO-3166 alpha-3 para boundary.country
+            size: Número máximo de resultados
+            
+        Returns:
+            requests.Response (o chamador decide como tratar o status)
+            
+        Raises:
+            CircuitOpenError: ORS geocoding indisponível (circuito aberto)
+        """
+        params = {
+            "text": text,
+            "boundary.country": country,
+            "size": size
+        }
+        return self._send(
+            "geocode",
+            "GET",
+            f"{self.BASE_URL}/geocode/search",
+            params=params,
+            headers={**self.headers, "Accept": "application/json"}
+        )
+    
+    def geocode(self, address: str, country: str = "BRA") -> Dict:
+        """
+        Geocodifica um endereço usando o cache antes do ORS
+        
+        A chave é o endereço normalizado (normalize_address) + país; consultas
+        concorrentes pelo mesmo endereço compartilham uma única chamada.
+        
+        Args:
+            address: Endereço livre
+            country: Código ISO-3166 alpha-3 para boundary.country
+            
+        Returns:
+            {"status": "found", "lon": ..., "lat": ...}
+            {"status": "not_found"}            (também cacheado, TTL menor)
+            {"status": "invalid_geometry"}     (não cacheado)
+            
+        Raises:
+            requests.exceptions.HTTPError: erro HTTP do ORS (não cacheado)
+        """
+        start = time.perf_counter()
+        key = self.geocode_key(address, country)
+        
+        cached = self.geocode_cached(address, country)
+        if cached is not None:
+            metrics.observe("geocode.latency_ms.cached", (time.perf_counter() - start) * 1000)
+            return cached
+        
+        result = self._geocode_inflight.do(key, self._geocode_upstream, key, address, country)
+        metrics.observe("geocode.latency_ms.upstream", (time.perf_counter() - start) * 1000)
+        return result
+    
+    def geocode_cached(self, address: str, country: str = "BRA") -> Optional[Dict]:
+        """
+        Consulta apenas o cache de geocoding (nunca chama o ORS)
+        
+        Returns:
+            Mesmo formato de geocode() ou None se não estiver em cache
+        """
+        if self.geocode_cache is None:
+            return None
+        cached = self.geocode_cache.get(self.geocode_key(address, country))
+        if cached is not None:
+            metrics.incr("geocode.cache_hit")
+            if cached.get("status") == "not_found":
+                metrics.incr("geocode.negative_hit")
+        return cached
+    
+    @staticmethod
+    def geocode_key(address: str, country: str = "BRA") -> str:
+        """Chave de cache do geocoding (hash do endereço normalizado + país)"""
+        raw = f"{country.upper()}|{normalize_address(address)}"
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+    
+    def _geocode_upstream(self, key: str, address: str, country: str) -> Dict:
+        """Consulta o ORS e grava resultados definitivos no cache"""
+        metrics.incr("geocode.upstream_call")
+        response = self.geocode_search(address, country=country, size=1)
+        response.raise_for_status()
+        data = response.json()
+        
+        features = data.get("features") if isinstance(data, dict) else None
+        if not features:
+            result, ttl = {"status": "not_found"}, self.GEOCODE_NEGATIVE_TTL_S
+        else:
+            coords = features[0].get("geometry", {}).get("coordinates", [])
+            if len(coords) < 2:
+                return {"status": "invalid_geometry"}
+            result, ttl = {"status": "found", "lon": coords[0], "lat": coords[1]}, self.GEOCODE_TTL_S
+        
+        if self.geocode_cache is not None:
+            self.geocode_cache.set(key, result, ttl)
+        return result
+    
+    def directions_geojson(self, payload: Dict) -> requests.Response:
+        """
+        Calcula rota (perfil driving-car) em GeoJSON
+        
+        Args:
+            payload: Corpo da requisição ORS (coordinates, options, ...)
+            
+        Returns:
+            requests.Response (o chamador decide como tratar o status)
+            
+        Raises:
+            CircuitOpenError: ORS directions indisponível (circuito aberto)
+        """
+        return self._send(
+            "directions",
+            "POST",
+            f"{self.DIRECTIONS_URL}/geojson",
+            json=payload,
+            headers={**self.headers, "Content-Type": "application/json"}
+        )
+    
+    def request_timeout(self, endpoint: str) -> tuple:
+        """(connect, read) do endpoint, com o read adaptativo do breaker"""
+        connect, _ = self.timeouts[endpoint]
+        return (connect, self.breakers[endpoint].timeout())
+    
+    def _send(self, endpoint: str, method: str, url: str, **kwargs) -> requests.Response:
+        """
+        Executa a chamada passando pelo breaker do endpoint
+        
+        O status não é levantado aqui (os chamadores tratam 4xx/5xx), mas
+        5xx/429 contam como falha do provedor.
+        """
+        breaker = self.breakers[endpoint]
+        if not breaker.allow():
+            raise CircuitOpenError(breaker.name)
+        start = time.perf_counter()
+        try:
+            response = self.session.request(method, url, timeout=self.request_timeout(endpoint), **kwargs)
+        except BaseException:
+            breaker.record_failure()
+            raise
+        self._record_status(breaker, response.status_code, time.perf_counter() - start)
+        return response
+    
+    @staticmethod
+    def _record_status(breaker: CircuitBreaker, status_code: int, latency_s: float) -> None:
+        """Registra no breaker o resultado de uma resposta HTTP"""
+        if is_upstream_failure_status(status_code):
+            breaker.record_failure()
+        else:
+            breaker.record_success(latency_s)
+
+
+# ============================================================================
+# NOTAS
+# - Uma instância por processo (compartilhada entre threads do gunicorn)
+# - Pool keep-alive dimensionado por ORS_POOL_SIZE / GUNICORN_THREADS
+# - Retries com backoff só em GET (geocoding); directions falha rápido
+# - Circuit breaker por endpoint (ors.geocode / ors.directions): com o
+#   circuito aberto, as chamadas levantam CircuitOpenError sem rede
+# - Geocoding com cache de endereço normalizado (positivo 30d, negativo 1d)
+# ============================================================================
@@ -0,0 +1,263 @@
+# services/resilience.py
+"""
+Circuit breakers e timeouts adaptativos por provedor externo
+
+Cada provedor (TomTom routing, TomTom flow, OpenWeather, Groq, ORS) tem um
+CircuitBreaker com janela deslizante das últimas chamadas:
+
+- closed: chamadas passam; se a taxa de erro da janela passar do limite
+  (com um mínimo de chamadas), o circuito abre
+- open: chamadas são rejeitadas na hora (CircuitOpenError) por open_s
+  segundos; os fallbacks de cada serviço entram sem esperar timeout
+- half_open: após open_s, poucas chamadas de teste passam; sucesso fecha
+  o circuito, falha reabre
+
+O timeout de leitura é derivado da latência observada (percentil da janela
+x multiplicador, limitado entre floor e ceiling), então um upstream lento
+deixa de segurar a requisição pelos 10-15 s fixos de antes.
+"""
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Deque, Dict, Iterator, Optional, Tuple
+
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(Exception):
+    """Chamada rejeitada porque o circuito do provedor está aberto"""
+
+    def __init__(self, name: str):
+        super().__init__(f"circuito '{name}' aberto")
+        self.name = name
+
+
+class CircuitBreaker:
+    """
+    Breaker de um provedor (thread-safe; usado também pelos clientes async)
+
+    Métodos principais:
+    - allow(): Se a chamada pode ir ao upstream
+    - record_success(latency_s) / record_failure(): Resultado da chamada
+    - release(): Chamada abandonada sem resultado (ex: corrotina cancelada)
+    - track(): Context manager que faz allow + record (levanta CircuitOpenError)
+    - timeout(): Timeout de leitura adaptativo (segundos)
+    - stats(): Estado, taxa de erro, percentil de latência e timeout atual
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        name: str,
+        window: int = 50,
+        min_calls: int = 10,
+        failure_rate: float = 0.5,
+        open_s: float = 30,
+        half_open_max_calls: int = 1,
+        timeout_floor_s: float = 1.0,
+        timeout_ceiling_s: float = 10.0,
+        latency_percentile: float = 0.95,
+        timeout_multiplier: float = 3.0
+    ):
+        """
+        Args:
+            name: Nome do provedor (métricas e logs)
+            window: Quantas chamadas recentes entram na janela
+            min_calls: Mínimo de chamadas na janela para avaliar a taxa de erro
+            failure_rate: Taxa de erro (0-1) que abre o circuito
+            open_s: Tempo aberto antes de testar de novo (half-open)
+            half_open_max_calls: Chamadas de teste simultâneas no half-open
+            timeout_floor_s: Menor timeout adaptativo
+            timeout_ceiling_s: Maior timeout (usado enquanto não há amostras)
+            latency_percentile: Percentil das latências de sucesso usado no timeout
+            timeout_multiplier: Folga sobre o percentil
+        """
+        self.name = name
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.open_s = open_s
+        self.half_open_max_calls = half_open_max_calls
+        self.timeout_floor_s = timeout_floor_s
+        self.timeout_ceiling_s = timeout_ceiling_s
+        self.latency_percentile = latency_percentile
+        self.timeout_multiplier = timeout_multiplier
+
+        self._lock = threading.Lock()
+        self._outcomes: Deque[bool] = deque(maxlen=window)
+        self._latencies: Deque[float] = deque(maxlen=window)
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._half_open_calls = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self) -> str:
+        """Estado atual, promovendo open -> half_open quando open_s expira (chamar com _lock)"""
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.open_s:
+            self._state = self.HALF_OPEN
+            self._half_open_calls = 0
+        return self._state
+
+    def allow(self) -> bool:
+        """True se a chamada pode ir ao upstream (reserva uma vaga de teste no half-open)"""
+        with self._lock:
+            state = self._current_state()
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and self._half_open_calls < self.half_open_max_calls:
+                self._half_open_calls += 1
+                return True
+        metrics.incr(f"breaker.{self.name}.rejected")
+        return False
+
+    def record_success(self, latency_s: float) -> None:
+        """Registra uma chamada bem-sucedida e sua latência"""
+        with self._lock:
+            self._latencies.append(latency_s)
+            if self._state == self.HALF_OPEN:
+                logger.info(f"Circuit '{self.name}' closed (probe succeeded)")
+                self._state = self.CLOSED
+                self._outcomes.clear()
+            self._outcomes.append(True)
+
+    def record_failure(self) -> None:
+        """Registra uma falha (erro, timeout ou status de erro do upstream)"""
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                self._open("probe failed")
+                return
+            self._outcomes.append(False)
+            if self._state == self.CLOSED and len(self._outcomes) >= self.min_calls:
+                failures = self._outcomes.count(False)
+                if failures / len(self._outcomes) >= self.failure_rate:
+                    self._open(f"{failures}/{len(self._outcomes)} failures")
+
+    def release(self) -> None:
+        """Devolve a vaga de teste do half-open de uma chamada sem resultado"""
+        with self._lock:
+            if self._state == self.HALF_OPEN and self._half_open_calls > 0:
+                self._half_open_calls -= 1
+
+    def _open(self, reason: str) -> None:
+        """Abre o circuito (chamar com _lock)"""
+        self._state = self.OPEN
+        self._opened_at = time.monotonic()
+        self._outcomes.clear()
+        metrics.incr(f"breaker.{self.name}.opened")
+        logger.warning(f"Circuit '{self.name}' opened for {self.open_s}s ({reason})")
+
+    def _latency_quantile(self) -> Optional[float]:
+        """Percentil configurado das latências de sucesso (chamar com _lock)"""
+        if len(self._latencies) < self.min_calls:
+            return None
+        ordered = sorted(self._latencies)
+        index = min(len(ordered) - 1, int(self.latency_percentile * len(ordered)))
+        return ordered[index]
+
+    def timeout(self) -> float:
+        """Timeout de leitura adaptativo: percentil x multiplicador, entre floor e ceiling"""
+        with self._lock:
+            quantile = self._latency_quantile()
+        if quantile is None:
+            return self.timeout_ceiling_s
+        return min(self.timeout_ceiling_s, max(self.timeout_floor_s, quantile * self.timeout_multiplier))
+
+    @contextmanager
+    def track(self) -> Iterator[None]:
+        """
+        Envolve uma chamada ao upstream
+
+        Levanta CircuitOpenError se o circuito não permitir a chamada;
+        exceções dentro do bloco contam como falha (exceto erros HTTP 4xx
+        do cliente e cancelamento) e são propagadas.
+        """
+        if not self.allow():
+            raise CircuitOpenError(self.name)
+        start = time.perf_counter()
+        try:
+            yield
+        except asyncio.CancelledError:
+            # Quem cancelou foi o chamador (deadline, cliente desconectou)
+            self.release()
+            raise
+        except BaseException as e:
+            if is_client_error(e):
+                # O upstream respondeu (ex: 400/404 por entrada inválida): está saudável
+                self.record_success(time.perf_counter() - start)
+            else:
+                self.record_failure()
+            raise
+        self.record_success(time.perf_counter() - start)
+
+    def stats(self) -> Dict:
+        """Snapshot para /metrics"""
+        with self._lock:
+            state = self._current_state()
+            calls = len(self._outcomes)
+            failures = self._outcomes.count(False)
+            quantile = self._latency_quantile()
+        return {
+            "state": state,
+            "window_calls": calls,
+            "failure_rate": round(failures / calls, 3) if calls else 0.0,
+            f"latency_p{int(self.latency_percentile * 100)}_ms": round(quantile * 1000, 1) if quantile is not None else None,
+            "timeout_s": round(self.timeout(), 3)
+        }
+
+
+def is_upstream_failure_status(status_code: int) -> bool:
+    """Status HTTP que indica problema do provedor (5xx ou rate limit)"""
+    return status_code >= 500 or status_code == 429
+
+
+def is_client_error(error: BaseException) -> bool:
+    """
+    Erro HTTP 4xx (exceto 429) vindo de requests, httpx ou do SDK Groq
+
+    Não conta como falha do provedor: a resposta chegou, o problema é a entrada.
+    """
+    response = getattr(error, "response", None)
+    status_code = getattr(response, "status_code", None)
+    return isinstance(status_code, int) and 400 <= status_code < 500 and not is_upstream_failure_status(status_code)
+
+
+_registry: Dict[str, CircuitBreaker] = {}
+_registry_lock = threading.Lock()
+
+
+def get_breaker(name: str, **config) -> CircuitBreaker:
+    """
+    Breaker compartilhado do provedor name (criado na primeira chamada)
+
+    Clientes sync e async do mesmo provedor recebem a mesma instância, então
+    a saúde do upstream é avaliada uma vez por processo.
+    """
+    with _registry_lock:
+        breaker = _registry.get(name)
+        if breaker is None:
+            breaker = CircuitBreaker(name, **config)
+            _registry[name] = breaker
+        return breaker
+
+
+def breaker_stats() -> Dict[str, Dict]:
+    """Estado de todos os breakers (para /metrics)"""
+    with _registry_lock:
+        breakers = list(_registry.values())
+    return {breaker.name: breaker.stats() for breaker in breakers}
+
+
+def connect_read_timeout(breaker: CircuitBreaker, connect_s: float = 3.05) -> Tuple[float, float]:
+    """Tupla (connect, read) para requests com o timeout adaptativo do breaker"""
+    return (connect_s, breaker.timeout())
@@ -0,0 +1,111 @@
+# services/singleflight.py
+"""
+Coalescência de chamadas concorrentes ("single-flight")
+
+Se várias threads pedirem o mesmo recurso (mesma chave) ao mesmo tempo,
+apenas a primeira executa a chamada ao upstream; as demais aguardam e
+recebem o mesmo resultado (ou a mesma exceção).
+
+AsyncSingleFlight faz o mesmo para corrotinas num event loop.
+"""
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class _Call:
+    """Chamada em andamento compartilhada entre as threads de uma mesma chave"""
+    
+    __slots__ = ("event", "result", "error")
+    
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Grupo de chamadas coalescidas por chave
+    
+    Métodos principais:
+    - do(key, fn, *args, **kwargs): Executa fn uma única vez por chave em voo
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+        # Quantas chamadas foram atendidas por uma execução já em andamento
+        self.shared_count = 0
+    
+    def do(self, key: Hashable, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        Executa fn(*args, **kwargs), compartilhando o resultado com chamadas
+        concorrentes que usem a mesma chave
+        
+        Args:
+            key: Identificador do recurso (ex: coordenada arredondada)
+            fn: Função que busca o recurso no upstream
+            
+        Returns:
+            Resultado de fn (o mesmo objeto para todas as threads coalescidas)
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self.shared_count += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                leader = True
+        
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        
+        try:
+            call.result = fn(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+        
+        return call.result
+
+
+class AsyncSingleFlight:
+    """
+    Versão asyncio do SingleFlight (um event loop; sem locks)
+    
+    Métodos principais:
+    - do(key, fn, *args, **kwargs): Aguarda fn(*args, **kwargs) uma única vez por chave em voo
+    """
+    
+    def __init__(self):
+        self._calls: Dict[Hashable, "asyncio.Future"] = {}
+        self.shared_count = 0
+    
+    async def do(self, key: Hashable, fn: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        """Mesmo contrato de SingleFlight.do, com fn sendo uma corrotina"""
+        call = self._calls.get(key)
+        if call is not None:
+            self.shared_count += 1
+            # shield: o cancelamento de um seguidor não cancela o líder
+            return await asyncio.shield(call)
+        
+        call = asyncio.ensure_future(fn(*args, **kwargs))
+        self._calls[key] = call
+        try:
+            return await asyncio.shield(call)
+        finally:
+            if call.done():
+                self._calls.pop(key, None)
+            else:
+                # Líder cancelado: a chamada segue para os seguidores
+                call.add_done_callback(lambda _: self._calls.pop(key, None))
@@ -10,6 +10,9 @@ import requests
 import logging
 from typing import Dict, List, Optional, Tuple
 
+from .hedging import Hedger
+from .resilience import CircuitOpenError, connect_read_timeout, get_breaker
+
 logger = logging.getLogger(__name__)
 
 
@@ -25,13 +28,15 @@ class TomTomService:
     
     BASE_URL = "https://api.tomtom.com"
     
-    def __init__(self, api_key: str, use_bearer: bool = False):
+    def __init__(self, api_key: str, use_bearer: bool = False, hedge_budget: float = 0.0):
         """
         Inicializa cliente TomTom
         
         Args:
             api_key: Chave da API TomTom (obtida do .env)
             use_bearer: Se True, usa autenticação Bearer Token no cabeçalho.
+            hedge_budget: Fração máxima de chamadas extras de routing por hedging
+                (ex: 0.05 = 5%); 0 desativa
         """
         if not api_key:
             raise ValueError("TomTom API key é obrigatória")
@@ -43,6 +48,12 @@ class TomTomService:
         self.headers = {}
         if use_bearer:
             self.headers['Authorization'] = f'Bearer {api_key}'
+        
+        # Circuit breakers por endpoint: timeouts adaptativos até 10s (flow) / 15s (routing)
+        self.flow_breaker = get_breaker("tomtom.flow", timeout_ceiling_s=10)
+        self.routing_breaker = get_breaker("tomtom.routing", timeout_floor_s=2, timeout_ceiling_s=15)
+        # Hedging do routing (opcional): duplicata após o p90 observado
+        self.routing_hedger = Hedger("tomtom.routing", budget=hedge_budget) if hedge_budget > 0 else None
             
         logger.info("TomTomService inicializado")
         
@@ -79,10 +90,14 @@ class TomTomService:
             params["key"] = self.api_key
         
         try:
-            # Passa os headers (vazios se não for Bearer, ou com Authorization)
-            response = self.session.get(url, params=params, headers=self.headers, timeout=10)
-            response.raise_for_status()
-            data = response.json()
+            with self.flow_breaker.track():
+                # Passa os headers (vazios se não for Bearer, ou com Authorization)
+                response = self.session.get(
+                    url, params=params, headers=self.headers,
+                    timeout=connect_read_timeout(self.flow_breaker)
+                )
+                response.raise_for_status()
+                data = response.json()
             
             # Extrai dados relevantes (defensive programming)
             flow_data = data.get("flowSegmentData", {})
@@ -95,6 +110,9 @@ class TomTomService:
                 "road_closure": flow_data.get("roadClosure", False)
             }
             
+        except CircuitOpenError:
+            logger.debug(f"TomTom flow skipped at ({lat}, {lon}): circuit open")
+            return None
         except requests.exceptions.HTTPError as e:
             logger.warning(f"TomTom HTTP error at ({lat}, {lon}): {e}")
             return None  # Graceful degradation
@@ -134,6 +152,38 @@ class TomTomService:
             "count": 2
         }
         """
+        url, params = self._route_request(origin, destination, alternatives)
+        if self.routing_hedger is not None:
+            return self.routing_hedger.run(self._fetch_routes, url, params)
+        return self._fetch_routes(url, params)
+    
+    def _fetch_routes(self, url: str, params: Dict) -> Optional[Dict]:
+        """Uma chamada ao calculateRoute (unidade do hedging)"""
+        try:
+            with self.routing_breaker.track():
+                # Passa os headers (vazios se não for Bearer, ou com Authorization)
+                response = self.session.get(
+                    url, params=params, headers=self.headers,
+                    timeout=connect_read_timeout(self.routing_breaker)
+                )
+                response.raise_for_status()
+                data = response.json()
+            return self._parse_routes(data)
+            
+        except CircuitOpenError:
+            logger.warning("TomTom routing skipped: circuit open")
+            return None
+        except Exception as e:
+            logger.error(f"TomTom routing error: {e}")
+            return None
+    
+    def _route_request(
+        self,
+        origin: Tuple[float, float],
+        destination: Tuple[float, float],
+        alternatives: int
+    ) -> Tuple[str, Dict]:
+        """URL + parâmetros do calculateRoute (compartilhado com o cliente async)"""
         # TomTom espera formato "lat,lon:lat,lon"
         url = f"{self.BASE_URL}/routing/1/calculateRoute/{origin[0]},{origin[1]}:{destination[0]},{destination[1]}/json"
         params = {
@@ -147,32 +197,25 @@ class TomTomService:
         # ADIÇÃO PARA SUPORTE A BEARER AUTHENTICATION: Usa 'key' apenas se não tiver Bearer
         if not self.headers.get('Authorization'):
             params["key"] = self.api_key
+        return url, params
+    
+    def _parse_routes(self, data: Dict) -> Dict:
+        """Extrai resumo + geometria de cada rota da resposta do calculateRoute"""
+        routes = []
+        for route in data.get("routes", []):
+            summary = route.get("summary", {})
+            routes.append({
+                "distance_meters": summary.get("lengthInMeters", 0),
+                "travel_time_seconds": summary.get("travelTimeInSeconds", 0),
+                "traffic_delay_seconds": summary.get("trafficDelayInSeconds", 0),
+                "traffic_length_meters": summary.get("trafficLengthInMeters", 0),
+                "departure_time": summary.get("departureTime", ""),
+                "arrival_time": summary.get("arrivalTime", ""),
+                # Geometria (pontos da rota)
+                "geometry": route.get("legs", [{}])[0].get("points", [])
+            })
         
-        try:
-            # Passa os headers (vazios se não for Bearer, ou com Authorization)
-            response = self.session.get(url, params=params, headers=self.headers, timeout=15)
-            response.raise_for_status()
-            data = response.json()
-            
-            routes = []
-            for route in data.get("routes", []):
-                summary = route.get("summary", {})
-                routes.append({
-                    "distance_meters": summary.get("lengthInMeters", 0),
-                    "travel_time_seconds": summary.get("travelTimeInSeconds", 0),
-                    "traffic_delay_seconds": summary.get("trafficDelayInSeconds", 0),
-                    "traffic_length_meters": summary.get("trafficLengthInMeters", 0),
-                    "departure_time": summary.get("departureTime", ""),
-                    "arrival_time": summary.get("arrivalTime", ""),
-                    # Geometria (pontos da rota)
-                    "geometry": route.get("legs", [{}])[0].get("points", [])
-                })
-            
-            return {"routes": routes, "count": len(routes)}
-            
-        except Exception as e:
-            logger.error(f"TomTom routing error: {e}")
-            return None
+        return {"routes": routes, "count": len(routes)}
     
     def calculate_traffic_factor(self, traffic_data: Optional[Dict]) -> float:
         """
@@ -229,5 +272,5 @@ class TomTomService:
 # - Logs informativos para debugging
 # - Documentação inline completa
 # - Validação de inputs
-# - Timeouts configurados (10s flow, 15s routing)
+# - Timeouts adaptativos (até 10s flow, 15s routing) + circuit breakers
 # ============================================================================
\ No newline at end of file
@@ -256,6 +256,46 @@ document.addEventListener('DOMContentLoaded', () => {
     }
 
     // 4. Abrir o sheet quando receber evento com detalhes da rota
+    // Justificativa do LLM entregue depois da rota (Server-Sent Events)
+    let reasoningSource = null;
+
+    function followReasoning(url) {
+        if (reasoningSource) {
+            reasoningSource.close();
+            reasoningSource = null;
+        }
+        if (!url || typeof EventSource === 'undefined') return;
+
+        const source = new EventSource(url);
+        reasoningSource = source;
+        let streamed = '';
+        const stop = () => {
+            source.close();
+            if (reasoningSource === source) reasoningSource = null;
+        };
+        source.addEventListener('token', (e) => {
+            const el = document.getElementById('route-reasoning');
+            try {
+                streamed += JSON.parse(e.data).text || '';
+                if (el) el.textContent = streamed;
+            } catch (err) {
+                console.debug('[BOTTOM_SHEET] invalid token event', err);
+            }
+        });
+        source.addEventListener('reasoning', (e) => {
+            const el = document.getElementById('route-reasoning');
+            try {
+                const text = JSON.parse(e.data).text;
+                if (el && text) el.textContent = text;
+            } catch (err) {
+                console.debug('[BOTTOM_SHEET] invalid reasoning event', err);
+            }
+        });
+        source.addEventListener('done', stop);
+        // Sem reconexão automática: o job pode ter expirado ou estar em outro worker
+        source.onerror = stop;
+    }
+
     document.addEventListener('showRouteDetails', (ev) => {
         // Evita erro se não houver payload
         const state = ev && ev.detail && ev.detail.state ? ev.detail.state : 'medium';
@@ -270,6 +310,7 @@ document.addEventListener('DOMContentLoaded', () => {
             if (infoEl && ev.detail.infoText) infoEl.textContent = ev.detail.infoText;
             if (extraEl && ev.detail.extraHTML) extraEl.innerHTML = ev.detail.extraHTML;
         }
+        followReasoning(ev && ev.detail ? ev.detail.reasoningUrl : null);
         // Garante que o botão de toggle esteja visível
         if (toggleButton) toggleButton.style.display = 'block';
         setSheetState(state);
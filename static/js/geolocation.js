@@ -11,12 +11,16 @@ import {
     setMarkerFeature, setAccuracyFeature, setCurrentPos, toggleFollowingState, setWatchId, // Escrita
     getCurrentAccuracy, setCurrentAccuracy, getCurrentPosTimestamp
 } from './map_data.js';
+import { recordFix, flushFixes } from './gps_upload.js';
 
 
 // Threshold (meters) under which we consider a GPS reading 'reliable' for routing
 const GPS_RELIABLE_THRESHOLD = 150; // meters
 
 function handlePosition(pos, isInitialCenter = false) {
+  // Rastreamento no backend: o fix entra no buffer e sobe em lote (gps_upload.js)
+  recordFix(pos);
+
   // Garante que o mapa esteja carregado antes de manipular features
   if (!getMapInstance() || !getVectorSource()) {
       updateStatus("Erro interno: Mapa não inicializado para GPS.");
@@ -146,6 +150,7 @@ export function stopWatching() {
         navigator.geolocation.clearWatch(watchId);
         setWatchId(null);
         toggleFollowingState(false);
+        flushFixes(); // Envia o que ficou no buffer
         updateStatus("Rastreamento GPS desativado.");
     }
 }
@@ -0,0 +1,199 @@
+// gps_upload.js
+// Envio dos fixes de GPS ao backend em lotes compactos (SRP).
+//
+// O watchPosition dispara ~1 vez por segundo; mandar uma requisição por fix
+// manteria o rádio do celular acordado o tempo todo. Aqui os fixes ficam num
+// buffer e sobem em lotes (por tamanho, por tempo ou quando a página some),
+// delta-codificados para POST /gps/compact:
+//   lat/lon em micrograus inteiros, cada valor relativo ao fix anterior
+//   dt em ms desde o fix anterior (o primeiro, desde t0)
+//   alt em decímetros (só quando todos os fixes do lote têm altitude)
+import { getApiBaseUrl } from './map_data.js';
+
+const GPS_BATCH_SIZE = 60;              // fixes que disparam um envio
+const GPS_BATCH_INTERVAL_MS = 30000;    // tempo máximo de um fix no buffer
+const GPS_MAX_BUFFERED = 3600;          // sem rede: guarda até ~1 h de fixes
+const GPS_MAX_ACCURACY_M = 150;         // fixes menos precisos não são enviados
+const GPS_MAX_BACKOFF_MS = 5 * 60 * 1000;
+const DEVICE_ID_KEY = 'gpsDeviceId';
+
+let buffer = [];          // { lat, lon, alt, t }
+let lastTimestamp = 0;
+let flushTimer = null;
+let inFlight = 0;         // fixes do início do buffer sendo enviados por fetch
+let cachedDeviceId = null;
+let backoffMs = 0;
+let retryAt = 0;
+
+/**
+ * Id numérico (uint32) deste navegador, persistido no localStorage.
+ * Identifica a trilha no backend (campo device de /gps).
+ */
+export function getDeviceId() {
+    if (cachedDeviceId) return cachedDeviceId;
+    let id = null;
+    try {
+        id = Number(localStorage.getItem(DEVICE_ID_KEY));
+    } catch (e) {
+        // localStorage indisponível (modo privado): id só desta sessão
+    }
+    if (!Number.isInteger(id) || id <= 0 || id >= 2 ** 32) {
+        id = window.crypto && window.crypto.getRandomValues
+            ? window.crypto.getRandomValues(new Uint32Array(1))[0] || 1
+            : Math.floor(Math.random() * (2 ** 32 - 1)) + 1;
+        try {
+            localStorage.setItem(DEVICE_ID_KEY, String(id));
+        } catch (e) {
+            // Segue com o id em memória
+        }
+    }
+    cachedDeviceId = id;
+    return id;
+}
+
+/**
+ * Enfileira um fix do watchPosition para envio em lote.
+ * @param {GeolocationPosition} pos
+ */
+export function recordFix(pos) {
+    const c = pos.coords;
+    if (c.accuracy > GPS_MAX_ACCURACY_M || pos.timestamp <= lastTimestamp) return;
+    lastTimestamp = pos.timestamp;
+
+    buffer.push({ lat: c.latitude, lon: c.longitude, alt: c.altitude, t: pos.timestamp });
+    if (buffer.length > GPS_MAX_BUFFERED) {
+        // Descarta os mais antigos, sem mexer nos que estão sendo enviados
+        buffer.splice(inFlight, buffer.length - GPS_MAX_BUFFERED);
+    }
+
+    if (buffer.length >= GPS_BATCH_SIZE) {
+        flushFixes();
+    } else if (!flushTimer) {
+        flushTimer = setTimeout(() => { flushTimer = null; flushFixes(); }, GPS_BATCH_INTERVAL_MS);
+    }
+}
+
+/**
+ * Codifica um lote no formato de POST /gps/compact.
+ * @param {Array<{lat:number, lon:number, alt:(number|null), t:number}>} fixes
+ */
+export function encodeFixes(fixes) {
+    const withAlt = fixes.every(f => f.alt !== null && f.alt !== undefined);
+    const payload = { device: getDeviceId(), t0: fixes[0].t, lat: [], lon: [], dt: [] };
+    if (withAlt) payload.alt = [];
+
+    let prevLat = 0, prevLon = 0, prevAlt = 0, prevT = fixes[0].t;
+    for (const f of fixes) {
+        const lat = Math.round(f.lat * 1e6);
+        const lon = Math.round(f.lon * 1e6);
+        payload.lat.push(lat - prevLat);
+        payload.lon.push(lon - prevLon);
+        payload.dt.push(Math.round(f.t - prevT));
+        prevLat = lat; prevLon = lon; prevT = f.t;
+        if (withAlt) {
+            const alt = Math.round(f.alt * 10);
+            payload.alt.push(alt - prevAlt);
+            prevAlt = alt;
+        }
+    }
+    return payload;
+}
+
+function compactUrl() {
+    const base = getApiBaseUrl();
+    return base ? `${base}/gps/compact` : null;
+}
+
+/**
+ * Envia o buffer em lotes de GPS_BATCH_SIZE. Em falha de rede ou 503 os
+ * fixes voltam para o buffer e o próximo envio espera (backoff exponencial
+ * ou o Retry-After do servidor); lotes recusados com 4xx são descartados.
+ */
+export async function flushFixes() {
+    if (flushTimer) { clearTimeout(flushTimer); flushTimer = null; }
+    const url = compactUrl();
+    if (inFlight || !buffer.length || !url) return;
+    if (Date.now() < retryAt) {
+        flushTimer = setTimeout(() => { flushTimer = null; flushFixes(); }, retryAt - Date.now());
+        return;
+    }
+
+    try {
+        while (buffer.length) {
+            const batch = buffer.slice(0, GPS_BATCH_SIZE);
+            inFlight = batch.length;
+            let response;
+            try {
+                response = await fetch(url, {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/json' },
+                    body: JSON.stringify(encodeFixes(batch)),
+                    keepalive: true
+                });
+            } catch (e) {
+                console.debug('[GPS UPLOAD] Falha de rede, lote mantido no buffer:', e);
+                scheduleRetry(null);
+                return;
+            }
+
+            if (response.status === 503 || response.status === 429 || response.status >= 500) {
+                scheduleRetry(Number(response.headers.get('Retry-After')));
+                return;
+            }
+            if (!response.ok) {
+                console.warn('[GPS UPLOAD] Lote recusado:', response.status);
+            }
+            buffer.splice(0, batch.length);
+            backoffMs = 0;
+        }
+    } finally {
+        inFlight = 0;
+    }
+}
+
+function scheduleRetry(retryAfterS) {
+    backoffMs = retryAfterS > 0
+        ? retryAfterS * 1000
+        : Math.min(GPS_MAX_BACKOFF_MS, backoffMs ? backoffMs * 2 : 5000);
+    retryAt = Date.now() + backoffMs;
+    if (!flushTimer) {
+        flushTimer = setTimeout(() => { flushTimer = null; flushFixes(); }, backoffMs);
+    }
+}
+
+/**
+ * Envio final quando a página some (aba em segundo plano, navegação):
+ * sendBeacon sobrevive ao descarregamento da página. O corpo vai como
+ * text/plain (sem preflight de CORS); o servidor lê o JSON mesmo assim.
+ */
+function beaconFixes() {
+    const url = compactUrl();
+    if (!url || !navigator.sendBeacon) return;
+    // Os fixes de um fetch em andamento ficam com ele (sem envio duplicado)
+    while (buffer.length > inFlight) {
+        const batch = buffer.slice(inFlight, inFlight + GPS_BATCH_SIZE);
+        const body = new Blob([JSON.stringify(encodeFixes(batch))], { type: 'text/plain' });
+        if (!navigator.sendBeacon(url, body)) return;  // fila do navegador cheia: fica para a próxima
+        buffer.splice(inFlight, batch.length);
+    }
+}
+
+/**
+ * Informa ao backend a rota que o usuário vai seguir (polyline6 de /rota),
+ * para que os fixes sejam encaixados nela. null encerra a rota.
+ * @param {string|null} polyline
+ */
+export function setFollowedRoute(polyline) {
+    const base = getApiBaseUrl();
+    if (!base) return;
+    fetch(`${base}/gps/route`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ device: getDeviceId(), polyline: polyline || null })
+    }).catch(e => console.debug('[GPS UPLOAD] Falha ao registrar a rota seguida:', e));
+}
+
+document.addEventListener('visibilitychange', () => {
+    if (document.visibilityState === 'hidden') beaconFixes();
+});
+window.addEventListener('pagehide', beaconFixes);
@@ -1,6 +1,7 @@
 // static/js/route_logic.js - Contém a lógica de comunicação com o servidor Flask para cálculo de rota.
 import { showMessage, updateRouteInfo, showRouteDetails } from './ui_utils.js';
 import { drawRouteOnMap, clearRoute, drawRouteMarkers } from './map_utils.js';
+import { setFollowedRoute } from './gps_upload.js';
 import { getApiBaseUrl, setOriginCoords, setDestinationCoords, getCurrentPos, getCurrentAccuracy, getOriginCoords, getDestinationCoords } from './map_data.js';
 
 // Exporta a função de limpeza para ser usada pelo events.js, se necessário.
@@ -100,6 +101,63 @@ async function geocodeAddress(address) {
 }
 
 
+/**
+ * Geocodifica vários endereços numa única requisição ao /geocoding/batch.
+ * A resposta é NDJSON (uma linha por endereço, fora de ordem — usa "index").
+ * Entradas que já são coordenadas não vão ao servidor.
+ * @param {string[]} addresses - Endereços a geocodificar.
+ * @returns {Promise<Array<{lon: number, lat: number}|null>>} Coordenadas na ordem da entrada.
+ */
+async function geocodeAddresses(addresses) {
+    const results = addresses.map(parseCoordinateString);
+    const pending = addresses
+        .map((address, index) => ({ address, index }))
+        .filter(item => !results[item.index]);
+    if (pending.length === 0) return results;
+
+    const ngrokUrl = getApiBaseUrl();
+    if (!ngrokUrl) {
+        showMessage('Erro: URL do servidor não definida.', 'error');
+        return addresses.map(() => null);
+    }
+
+    try {
+        const response = await fetch(`${ngrokUrl}/geocoding/batch`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ addresses: pending.map(item => item.address) })
+        });
+        if (!response.ok) {
+            // Servidor sem o endpoint de lote (ou erro no lote): uma chamada por endereço
+            console.warn('[GEOCODING] Lote indisponível, usando /geocoding individual:', response.status);
+            for (const item of pending) {
+                results[item.index] = await geocodeAddress(item.address);
+            }
+            return results;
+        }
+
+        const text = await response.text();
+        text.split('\n').filter(line => line.trim()).forEach(line => {
+            const row = JSON.parse(line);
+            const item = pending[row.index];
+            if (!item) return;
+            if (row.status === 200) {
+                console.log(`[GEOCODING] Endereço '${item.address}' convertido para: ${row.lat.toFixed(4)}, ${row.lon.toFixed(4)}`);
+                results[item.index] = { lon: row.lon, lat: row.lat };
+            } else {
+                showMessage(`Erro de geocodificação para: "${item.address}". Detalhe: ${row.erro || 'Endereço não encontrado'}`, 'error');
+                console.error(`[GEOCODING] Falha ao geocodificar ${item.address}:`, row);
+            }
+        });
+        return results;
+    } catch (error) {
+        console.error('Erro no fetch de geocodificação em lote:', error);
+        showMessage('Erro de conexão ao geocodificar o endereço.', 'error');
+        return addresses.map(() => null);
+    }
+}
+
+
 /**
  * Tenta interpretar uma string como um par de coordenadas.
  * Aceita formatos como "-23.4750, -47.4415" (geralmente lat, lon)
@@ -160,16 +218,19 @@ export async function calculateRouteFromAddresses(originInput, destinationInput)
             showMessage('Erro: Posição GPS não disponível. Tente novamente ou insira um endereço de origem.', 'error');
             return;
         }
+    }
+
+    // 2. Processar Destino (Sempre Endereço) — origem e destino vão juntos
+    //    numa única requisição de geocodificação em lote
+    let destinationCoords = null;
+    if (originCoords) {
+        destinationCoords = await geocodeAddress(destinationInput);
     } else {
-        // Geocodificar Endereço de Origem
-        originCoords = await geocodeAddress(originInput);
+        [originCoords, destinationCoords] = await geocodeAddresses([originInput, destinationInput]);
         if (!originCoords) {
             return; // Falha na geocodificação, a mensagem de erro já foi exibida
         }
     }
-
-    // 2. Processar Destino (Sempre Endereço)
-    const destinationCoords = await geocodeAddress(destinationInput);
     if (!destinationCoords) {
         return; // Falha na geocodificação
     }
@@ -235,7 +296,9 @@ async function fetchRouteData(origin, destination, constraints = null) {
         // ========================================================================
         // ✅ MANTIDO: Preparação de payload adaptável (SEU CÓDIGO ORIGINAL)
         // ========================================================================
-        let requestBody = { coordinates: coords };
+        // Pede a geometria como polyline6 (bem menor que o GeoJSON completo)
+        // e a justificativa do LLM por SSE (a rota chega sem esperar o texto)
+        let requestBody = { coordinates: coords, format: 'polyline6', reasoning: 'stream' };
         
         if (preferredRouteEndpoint === '/calculate_route') {
             // Colab/backend alternativo espera origin/destination como objetos
@@ -262,7 +325,12 @@ async function fetchRouteData(origin, destination, constraints = null) {
             body: JSON.stringify(requestBody)
         });
         
-        const geojsonResult = await response.json();
+        const rawResult = await response.json();
+        // Polyline6 da rota (antes de expandir) para o encaixe dos fixes no backend
+        const followedPolyline = rawResult && rawResult.format === 'polyline6'
+            ? rawResult.features?.[0]?.geometry?.polyline || null
+            : null;
+        const geojsonResult = expandEncodedGeometries(rawResult);
 
         if (!response.ok) {
             // Respostas de erro do backend podem propagar o status da ORS (ex: 401/403).
@@ -284,6 +352,10 @@ async function fetchRouteData(origin, destination, constraints = null) {
             return;
         }
         
+        if (followedPolyline) {
+            setFollowedRoute(followedPolyline);
+        }
+
         // 🆕 Verifica se a resposta contém dados de otimização
         let optimizationData = null;
         try {
@@ -413,7 +485,7 @@ async function fetchRouteData(origin, destination, constraints = null) {
                     <div style="background: #e7f3ff; padding: 12px; border-radius: 6px; margin-bottom: 15px; border-left: 4px solid #007bff;">
                         <strong>✨ Rota Otimizada</strong><br>
                         <small style="color: #004085; line-height: 1.6;">
-                            ${optimizationData.reasoning || 'Rota ajustada considerando tráfego e clima.'}<br>
+                            <span id="route-reasoning">${optimizationData.reasoning || 'Rota ajustada considerando tráfego e clima.'}</span><br>
                             <span style="display: inline-block; margin-top: 5px;">
                                 🌤️ ${optimizationData.weather || 'Clima: não disponível'}<br>
                                 🚦 Tráfego: ${((optimizationData.traffic_factor || 1) * 100 - 100).toFixed(0)}% acima do normal
@@ -435,7 +507,9 @@ async function fetchRouteData(origin, destination, constraints = null) {
                 duration, 
                 infoText: `Distância: ${distance} • Duração: ${duration}`, 
                 extraHTML, 
-                state: 'medium' 
+                state: 'medium',
+                // Justificativa final do LLM (substitui o texto provisório)
+                reasoningUrl: optimizationData && optimizationData.reasoning_stream
             });
         } catch (err) {
             console.error('[ROUTE_LOGIC] failed to show route details', err);
@@ -460,6 +534,28 @@ async function fetchRouteData(origin, destination, constraints = null) {
 }
 
 
+/**
+ * Converte geometrias "EncodedPolyline" (resposta format=polyline6 do /rota)
+ * de volta para LineString GeoJSON [lon, lat], mantendo o restante do documento.
+ * Respostas em GeoJSON comum são retornadas sem alteração.
+ */
+function expandEncodedGeometries(result) {
+    if (!result || result.format !== 'polyline6' || !Array.isArray(result.features)) {
+        return result;
+    }
+    const polylineFormat = new ol.format.Polyline({ factor: 1e6 });
+    result.features.forEach(feature => {
+        const geom = feature && feature.geometry;
+        if (geom && geom.type === 'EncodedPolyline') {
+            // readGeometry já devolve as coordenadas na ordem [lon, lat]
+            const line = polylineFormat.readGeometry(geom.polyline);
+            feature.geometry = { type: 'LineString', coordinates: line.getCoordinates() };
+        }
+    });
+    return result;
+}
+
+
 /**
  * ✅ MANTIDO: A função calculateAndDrawRoute (antiga drawRoute) é mantida para clique no mapa.
  * 
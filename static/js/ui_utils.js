@@ -64,7 +64,7 @@ export const updateRouteInfo = (distance, duration) => {
 };
 
 // Dispara um evento para o bottom sheet abrir e mostrar detalhes adicionais.
-export const showRouteDetails = ({ distance = '-', duration = '-', infoText = '', extraHTML = '', state = 'medium' } = {}) => {
-    const payload = { distance, duration, infoText, extraHTML, state };
+export const showRouteDetails = ({ distance = '-', duration = '-', infoText = '', extraHTML = '', state = 'medium', reasoningUrl = null } = {}) => {
+    const payload = { distance, duration, infoText, extraHTML, state, reasoningUrl };
     document.dispatchEvent(new CustomEvent('showRouteDetails', { detail: payload }));
 };
\ No newline at end of file
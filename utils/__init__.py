@@ -1,6 +1,6 @@
 # utils/__init__.py
 """
-Módulo de utilitários (mantém utils.py original + adiciona route_optimizer)
+Módulo de utilitários (route_optimizer, cache/formato de rotas, ingestão de GPS)
 """
 
 from .route_optimizer import RouteOptimizer
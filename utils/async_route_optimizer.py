@@ -0,0 +1,278 @@
+# utils/async_route_optimizer.py
+"""
+Versão asyncio do RouteOptimizer (servida pelo entry point ASGI)
+
+Mesmo pipeline e mesmas regras do RouteOptimizer (corredor de clima,
+pontuação local, LLM só em escolhas ambíguas, justificativa assíncrona);
+o I/O com TomTom, OpenWeather e Groq roda em corrotinas, então um processo
+segura centenas de /rota esperando upstream sem ocupar uma thread cada.
+"""
+import asyncio
+import logging
+from typing import Awaitable, Dict, List, Optional, Set, Tuple
+
+from services.async_clients import AsyncGroqLLMService, AsyncOpenWeatherService, AsyncTomTomService
+from utils.reasoning_broker import ReasoningBroker
+from utils.route_optimizer import RouteOptimizer
+from utils.route_scoring import LocalRouteScorer
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncRouteOptimizer(RouteOptimizer):
+    """
+    Orquestrador de otimização de rotas (asyncio)
+
+    Reaproveita do RouteOptimizer tudo que é CPU (amostragem do corredor,
+    candidatas, decisão, resposta); só a espera por upstream muda.
+    Micro-batching do LLM não se aplica aqui: cada análise é uma corrotina.
+    """
+
+    def __init__(
+        self,
+        tomtom_key: str,
+        openweather_key: str,
+        groq_key: str,
+        enrichment_deadline_s: float = 4.0,
+        max_connections: int = 100,
+        redis_url: Optional[str] = None,
+        weather_cache_ttl_s: float = 600,
+        weather_geohash_precision: int = 6,
+        corridor_samples: int = 5,
+        llm_cache_ttl_s: float = 900,
+        llm_margin: float = 0.05,
+        reasoning_broker: Optional[ReasoningBroker] = None,
+        llm_decision_timeout_s: float = 10.0,
+        llm_explain_local: bool = False,
+        tomtom_hedge_budget: float = 0.0
+    ):
+        # Não chama RouteOptimizer.__init__: os clientes síncronos e os pools
+        # de threads não são usados aqui
+        self.tomtom = AsyncTomTomService(
+            tomtom_key, max_connections=max_connections, hedge_budget=tomtom_hedge_budget
+        )
+        self.weather = AsyncOpenWeatherService(
+            openweather_key,
+            max_connections=max_connections,
+            geohash_precision=weather_geohash_precision,
+            cache_ttl_s=weather_cache_ttl_s,
+            redis_url=redis_url
+        )
+        self.llm = AsyncGroqLLMService(groq_key, cache_ttl_s=llm_cache_ttl_s, redis_url=redis_url)
+        self.llm_batcher = None
+        self.enrichment_deadline_s = enrichment_deadline_s
+        self.scorer = LocalRouteScorer(margin=llm_margin)
+        self.corridor_samples = corridor_samples
+        self.reasoning_broker = reasoning_broker
+        self.llm_decision_timeout_s = llm_decision_timeout_s
+        self.llm_explain_local = llm_explain_local
+        # Tarefas de justificativa em background (referência evita coleta pelo GC)
+        self._background: Set[asyncio.Task] = set()
+
+    async def optimize_route(
+        self,
+        origin: Tuple[float, float],
+        destination: Tuple[float, float],
+        constraints: Optional[Dict] = None,
+        defer_reasoning: bool = False
+    ) -> Optional[Dict]:
+        """Mesmo contrato de RouteOptimizer.optimize_route"""
+        defer_reasoning = defer_reasoning and self.reasoning_broker is not None
+        if constraints is None:
+            constraints = {"avoid": [], "prefer": ["fastest"]}
+
+        logger.info(f"Optimizing route (async) from {origin} to {destination} with constraints: {constraints}")
+
+        # 1. Rotas alternativas do TomTom com dados de tráfego
+        tomtom_routes = await self.tomtom.get_route_with_traffic(origin, destination, alternatives=2)
+        if not tomtom_routes or not tomtom_routes.get("routes"):
+            logger.error("TomTom returned no routes")
+            return None
+
+        # 2. Corredor de clima (todas as consultas concorrentes, um deadline)
+        route_coords, corridors, all_points = self._prepare_corridors(tomtom_routes, origin, destination)
+        all_weather = await self._fetch_weather_concurrently(all_points)
+        candidates = self._build_candidates(tomtom_routes, corridors, all_weather)
+
+        # 3. Pontuação local; o LLM só entra se a escolha for ambígua
+        local_result = self.scorer.score(constraints, candidates)
+        reasoning_id = None
+        llm_result = None
+
+        if local_result["needs_llm"]:
+            logger.info(f"Calling LLM: {local_result['reason']}")
+            if defer_reasoning:
+                reasoning_id = self.reasoning_broker.create()
+                llm_result = await self._stream_llm_decision(
+                    reasoning_id, constraints, candidates, local_result["selected_candidate"]
+                )
+            else:
+                llm_result = await self.llm.analyze_routes(constraints, candidates)
+
+        decision_source, selected_id, reasoning = self._resolve_decision(
+            constraints, candidates, local_result, llm_result
+        )
+
+        # 4. Rota selecionada (+ justificativa provisória no modo assíncrono)
+        selected_route = next((c for c in candidates if c["id"] == selected_id), candidates[0])
+        if defer_reasoning:
+            reasoning = reasoning or self.llm.explain_route_choice(selected_route, candidates, constraints)
+        if defer_reasoning and reasoning_id is None and (decision_source != "local" or self.llm_explain_local):
+            reasoning_id = self.reasoning_broker.create()
+            self._spawn(self._publish_reasoning(
+                reasoning_id,
+                constraints,
+                [dict(c) for c in candidates],
+                selected_route["id"],
+                reasoning
+            ))
+
+        # 5. Resposta final
+        return self._build_result(
+            origin, destination, constraints, candidates, route_coords,
+            selected_route, reasoning, decision_source, reasoning_id
+        )
+
+    def _spawn(self, coro: Awaitable) -> asyncio.Task:
+        """Agenda uma corrotina em background mantendo a referência até o fim"""
+        task = asyncio.ensure_future(coro)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+        return task
+
+    async def _stream_llm_decision(
+        self,
+        reasoning_id: str,
+        constraints: Dict,
+        candidates: List[Dict],
+        fallback_id: int
+    ) -> Optional[Dict]:
+        """Versão asyncio de RouteOptimizer._stream_llm_decision"""
+        decision = asyncio.get_running_loop().create_future()
+        self._spawn(self._stream_llm_reasoning(
+            reasoning_id,
+            constraints,
+            [dict(c) for c in candidates],
+            fallback_id,
+            decision
+        ))
+        # shield: se a requisição cair ou desistir, o stream segue publicando no broker
+        try:
+            return await asyncio.wait_for(asyncio.shield(decision), self.llm_decision_timeout_s)
+        except asyncio.TimeoutError:
+            # Sem await entre o timeout e o cancel: a decisão não chega no meio
+            decision.cancel()
+            logger.warning(
+                f"LLM decision timed out after {self.llm_decision_timeout_s}s for {reasoning_id}; "
+                f"using local scoring selection"
+            )
+            return None
+
+    async def _stream_llm_reasoning(
+        self,
+        reasoning_id: str,
+        constraints: Dict,
+        candidates: List[Dict],
+        fallback_id: int,
+        decision: "asyncio.Future"
+    ) -> None:
+        """Versão asyncio de RouteOptimizer._stream_llm_reasoning"""
+        def settle(value: Optional[Dict]) -> None:
+            if not decision.done():
+                decision.set_result(value)
+
+        def on_token(text: str) -> None:
+            self.reasoning_broker.publish(reasoning_id, "token", {"text": text})
+
+        result = None
+        try:
+            result = await self.llm.analyze_routes(
+                constraints, candidates, on_decision=settle, on_reasoning_token=on_token
+            )
+        except Exception as e:
+            logger.error(f"Streaming LLM analysis failed for {reasoning_id}: {e}")
+        finally:
+            settle(result)
+
+        try:
+            chosen = None if decision.cancelled() else decision.result()
+            if result and result.get("reasoning") and (chosen or result.get("selected_candidate") == fallback_id):
+                self.reasoning_broker.publish(
+                    reasoning_id, "reasoning", {"text": result["reasoning"], "source": "llm"}
+                )
+            else:
+                selected_id = chosen["selected_candidate"] if chosen else fallback_id
+                selected = next((c for c in candidates if c["id"] == selected_id), candidates[0])
+                self.reasoning_broker.publish(reasoning_id, "reasoning", {
+                    "text": self.llm.explain_route_choice(selected, candidates, constraints),
+                    "source": "fallback"
+                })
+        finally:
+            self.reasoning_broker.close(reasoning_id)
+
+    async def _publish_reasoning(
+        self,
+        reasoning_id: str,
+        constraints: Dict,
+        candidates: List[Dict],
+        selected_id: int,
+        fallback_text: str
+    ) -> None:
+        """Gera a justificativa com o LLM (em background) e publica no broker"""
+        try:
+            text = await self.llm.explain_routes(constraints, candidates, selected_id)
+            if text:
+                self.reasoning_broker.publish(reasoning_id, "reasoning", {"text": text, "source": "llm"})
+            else:
+                self.reasoning_broker.publish(reasoning_id, "reasoning", {"text": fallback_text, "source": "fallback"})
+        except Exception as e:
+            logger.error(f"Async reasoning failed for {reasoning_id}: {e}")
+            self.reasoning_broker.publish(reasoning_id, "reasoning", {"text": fallback_text, "source": "fallback"})
+        finally:
+            self.reasoning_broker.close(reasoning_id)
+
+    async def _fetch_weather_concurrently(
+        self,
+        points: List[Tuple[float, float]]
+    ) -> List[Optional[Dict]]:
+        """
+        Consulta o clima de vários pontos concorrentemente
+
+        Mesmo contrato de RouteOptimizer._fetch_weather_concurrently: memo
+        por geohash na requisição e um único deadline para todas as consultas.
+        """
+        if not points:
+            return []
+
+        keys = [self.weather.location_key(lat, lon) for lat, lon in points]
+        unique_points = {}
+        for key, point in zip(keys, points):
+            unique_points.setdefault(key, point)
+
+        tasks = {
+            key: asyncio.ensure_future(self.weather.get_weather(lat, lon))
+            for key, (lat, lon) in unique_points.items()
+        }
+        done, not_done = await asyncio.wait(tasks.values(), timeout=self.enrichment_deadline_s)
+
+        if not_done:
+            logger.warning(
+                f"Weather enrichment deadline ({self.enrichment_deadline_s}s) exceeded: "
+                f"{len(not_done)}/{len(tasks)} lookups without response"
+            )
+            for task in not_done:
+                task.cancel()
+
+        memo = {}
+        for key, task in tasks.items():
+            if task in done and not task.cancelled() and task.exception() is None:
+                memo[key] = task.result()
+            else:
+                memo[key] = None  # Graceful degradation: fator 1.0
+
+        logger.debug(f"Weather enrichment: {len(points)} points, {len(tasks)} upstream lookups")
+        return [memo[key] for key in keys]
+
+    async def aclose(self) -> None:
+        """Fecha os clientes HTTP (shutdown do servidor ASGI)"""
+        await asyncio.gather(self.tomtom.aclose(), self.weather.aclose(), self.llm.aclose())
@@ -0,0 +1,76 @@
+# utils/compression.py
+"""
+Compressão das respostas HTTP do Flask (brotli ou gzip)
+
+O algoritmo é negociado pelo cabeçalho Accept-Encoding. Brotli só é usado
+se o pacote `brotli` estiver instalado; caso contrário, cai para gzip.
+"""
+import gzip
+import logging
+
+try:
+    import brotli
+except ImportError:  # Dependência opcional
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# Tipos que valem a pena comprimir (texto)
+COMPRESSIBLE_MIMETYPES = ("application/json", "application/geo+json", "text/html", "text/css", "text/javascript", "application/javascript")
+
+# Codificações oferecidas, em ordem de preferência
+OFFERED_ENCODINGS = ["br", "gzip"] if brotli is not None else ["gzip"]
+
+
+def compress(data: bytes, encoding: str, gzip_level: int = 6, brotli_quality: int = 5) -> bytes:
+    """Comprime data com a codificação negociada ("br" ou "gzip")"""
+    if encoding == "br":
+        return brotli.compress(data, quality=brotli_quality)
+    return gzip.compress(data, compresslevel=gzip_level)
+
+
+def init_compression(app, min_size: int = 1024, gzip_level: int = 6, brotli_quality: int = 5):
+    """
+    Registra o hook de compressão no app Flask
+    
+    Args:
+        app: Instância Flask
+        min_size: Respostas menores que isso (bytes) não são comprimidas
+        gzip_level: Nível gzip (1-9)
+        brotli_quality: Qualidade brotli (0-11; 5 é um bom equilíbrio p/ respostas dinâmicas)
+    """
+    from flask import request
+    
+    offered = OFFERED_ENCODINGS
+    
+    @app.after_request
+    def compress_response(response):
+        # Respostas em streaming (NDJSON/SSE) e já codificadas passam direto
+        if (
+            response.direct_passthrough
+            or response.is_streamed
+            or response.status_code < 200
+            or response.status_code in (204, 304)
+            or "Content-Encoding" in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES
+        ):
+            return response
+        
+        response.vary.add("Accept-Encoding")
+        encoding = request.accept_encodings.best_match(offered)
+        if not encoding:
+            return response
+        
+        data = response.get_data()
+        if len(data) < min_size:
+            return response
+        
+        compressed = compress(data, encoding, gzip_level, brotli_quality)
+        
+        response.set_data(compressed)
+        response.headers["Content-Encoding"] = encoding
+        response.headers["Content-Length"] = str(len(compressed))
+        return response
+    
+    logger.info(f"Compressão HTTP ativada ({', '.join(offered)})")
+    return app
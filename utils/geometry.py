@@ -0,0 +1,374 @@
+# utils/geometry.py
+"""
+Operações vetorizadas (NumPy) sobre a geometria das rotas
+
+As polylines do TomTom chegam como lista de dicts
+{"latitude": ..., "longitude": ...}; aqui elas são convertidas uma única vez
+para um array float64 contíguo de shape (N, 2) no formato [lat, lon],
+e todos os cálculos operam sobre o array inteiro.
+"""
+from typing import Iterable, Optional, Tuple
+
+import numpy as np
+
+# Raio médio da Terra (metros)
+EARTH_RADIUS_M = 6371008.8
+
+
+def to_array(points: Iterable) -> np.ndarray:
+    """
+    Converte pontos de rota em array (N, 2) [lat, lon]
+    
+    Args:
+        points: Lista de dicts TomTom ({"latitude", "longitude"}),
+            dicts {"lat", "lon"} ou pares (lat, lon)
+            
+    Returns:
+        np.ndarray float64 C-contíguo; shape (0, 2) se não houver pontos
+    """
+    if isinstance(points, np.ndarray):
+        return np.ascontiguousarray(points, dtype=np.float64).reshape(-1, 2)
+    
+    points = list(points)
+    if not points:
+        return np.empty((0, 2), dtype=np.float64)
+    
+    first = points[0]
+    if isinstance(first, dict):
+        lat_key, lon_key = ("latitude", "longitude") if "latitude" in first else ("lat", "lon")
+        flat = (v for p in points for v in (p[lat_key], p[lon_key]))
+    else:
+        flat = (v for p in points for v in (p[0], p[1]))
+    
+    # fromiter preenche o buffer final direto, sem lista intermediária
+    return np.fromiter(flat, dtype=np.float64, count=2 * len(points)).reshape(-1, 2)
+
+
+def segment_lengths(coords: np.ndarray) -> np.ndarray:
+    """Comprimento (metros, haversine) de cada segmento: shape (N-1,)"""
+    if len(coords) < 2:
+        return np.zeros(0, dtype=np.float64)
+    
+    rad = np.radians(coords)
+    lat1, lon1 = rad[:-1, 0], rad[:-1, 1]
+    lat2, lon2 = rad[1:, 0], rad[1:, 1]
+    
+    a = (
+        np.sin((lat2 - lat1) / 2) ** 2
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def distances_from(lat: float, lon: float, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+    """Distância (metros, haversine) de um ponto a cada ponto de (lats, lons)"""
+    lat1, lon1 = np.radians(lat), np.radians(lon)
+    lat2, lon2 = np.radians(lats), np.radians(lons)
+
+    a = (
+        np.sin((lat2 - lat1) / 2) ** 2
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def cumulative_distance(coords: np.ndarray) -> np.ndarray:
+    """Distância acumulada (metros) desde o primeiro ponto: shape (N,)"""
+    cum = np.zeros(len(coords), dtype=np.float64)
+    if len(coords) > 1:
+        np.cumsum(segment_lengths(coords), out=cum[1:])
+    return cum
+
+
+def length(coords: np.ndarray) -> float:
+    """Comprimento total da polyline (metros)"""
+    return float(segment_lengths(coords).sum())
+
+
+def bounding_box(coords: np.ndarray) -> Optional[Tuple[float, float, float, float]]:
+    """
+    Retângulo envolvente da polyline
+    
+    Returns:
+        (min_lat, min_lon, max_lat, max_lon) ou None se não houver pontos
+    """
+    if len(coords) == 0:
+        return None
+    mins = coords.min(axis=0)
+    maxs = coords.max(axis=0)
+    return (float(mins[0]), float(mins[1]), float(maxs[0]), float(maxs[1]))
+
+
+def interpolate_at(coords: np.ndarray, cum: np.ndarray, distances: np.ndarray) -> np.ndarray:
+    """
+    Pontos ao longo da polyline nas distâncias (metros) pedidas
+    
+    Args:
+        coords: Array (N, 2) [lat, lon]
+        cum: Distância acumulada de coords (cumulative_distance)
+        distances: Distâncias desejadas a partir do início
+        
+    Returns:
+        Array (M, 2) com os pontos interpolados linearmente
+    """
+    distances = np.clip(np.asarray(distances, dtype=np.float64), 0.0, cum[-1])
+    # Índice do segmento que contém cada distância
+    idx = np.clip(np.searchsorted(cum, distances, side="right") - 1, 0, len(coords) - 2)
+    seg_len = cum[idx + 1] - cum[idx]
+    t = np.divide(distances - cum[idx], seg_len, out=np.zeros_like(distances), where=seg_len > 0)
+    return coords[idx] + (coords[idx + 1] - coords[idx]) * t[:, None]
+
+
+def sample_evenly(coords: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Divide a rota em k trechos de mesmo comprimento e amostra o centro de cada um
+    
+    Args:
+        coords: Array (N, 2) [lat, lon]
+        k: Número de amostras
+        
+    Returns:
+        (pontos (k, 2), pesos (k,)) onde o peso é o comprimento (metros)
+        do trecho representado por cada amostra. Para rotas degeneradas
+        (menos de 2 pontos ou comprimento zero) retorna um único ponto com peso 1.
+    """
+    if len(coords) == 0:
+        return np.empty((0, 2), dtype=np.float64), np.zeros(0, dtype=np.float64)
+    
+    cum = cumulative_distance(coords)
+    total = cum[-1]
+    if len(coords) < 2 or total <= 0 or k <= 1:
+        mid = coords[len(coords) // 2] if total <= 0 else interpolate_at(coords, cum, [total / 2])[0]
+        return mid.reshape(1, 2), np.ones(1, dtype=np.float64)
+    
+    step = total / k
+    centers = (np.arange(k, dtype=np.float64) + 0.5) * step
+    return interpolate_at(coords, cum, centers), np.full(k, step, dtype=np.float64)
+
+
+def resample(coords: np.ndarray, spacing_m: float) -> np.ndarray:
+    """
+    Reamostra a polyline com pontos a cada spacing_m metros
+    
+    O primeiro e o último ponto são sempre preservados.
+    
+    Args:
+        coords: Array (N, 2) [lat, lon]
+        spacing_m: Distância entre pontos consecutivos (metros)
+        
+    Returns:
+        Array (M, 2) reamostrado
+    """
+    if len(coords) < 2 or spacing_m <= 0:
+        return coords.copy()
+    
+    cum = cumulative_distance(coords)
+    total = cum[-1]
+    if total <= 0:
+        return coords[:1].copy()
+    
+    distances = np.append(np.arange(0.0, total, spacing_m), total)
+    return interpolate_at(coords, cum, distances)
+
+
+def to_local_meters(coords: np.ndarray, origin_lat: Optional[float] = None) -> np.ndarray:
+    """
+    Projeção equiretangular local (metros) — precisa para trechos curtos
+
+    Args:
+        coords: Array (N, 2) [lat, lon]
+        origin_lat: Latitude de referência da projeção (padrão: média de coords).
+            Arrays projetados com a mesma origem são comparáveis entre si.
+
+    Returns:
+        Array (N, 2) [x, y] em metros
+    """
+    lat0 = np.radians(coords[:, 0].mean() if origin_lat is None else origin_lat)
+    rad = np.radians(coords)
+    xy = np.empty_like(coords)
+    xy[:, 0] = rad[:, 1] * np.cos(lat0) * EARTH_RADIUS_M
+    xy[:, 1] = rad[:, 0] * EARTH_RADIUS_M
+    return xy
+
+
+def simplify_mask(coords: np.ndarray, tolerance_m: float) -> np.ndarray:
+    """
+    Douglas-Peucker: máscara booleana dos pontos mantidos
+    
+    Usa uma pilha (sem recursão) e calcula as distâncias de cada trecho
+    de forma vetorizada sobre todos os pontos internos de uma vez.
+    
+    Args:
+        coords: Array (N, 2) [lat, lon]
+        tolerance_m: Desvio máximo permitido (metros)
+        
+    Returns:
+        Array bool (N,) — True para os pontos que permanecem
+    """
+    n = len(coords)
+    keep = np.zeros(n, dtype=bool)
+    if n == 0:
+        return keep
+    keep[0] = keep[-1] = True
+    if n < 3 or tolerance_m <= 0:
+        keep[:] = True
+        return keep
+    
+    xy = to_local_meters(coords)
+    stack = [(0, n - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        
+        a = xy[start]
+        ab = xy[end] - a
+        ap = xy[start + 1:end] - a
+        ab_len2 = float(ab @ ab)
+        if ab_len2 == 0.0:
+            dist = np.hypot(ap[:, 0], ap[:, 1])
+        else:
+            # Distância ao segmento (projeção limitada a [0, 1])
+            t = np.clip(ap @ ab / ab_len2, 0.0, 1.0)
+            diff = ap - t[:, None] * ab
+            dist = np.hypot(diff[:, 0], diff[:, 1])
+        
+        i = int(np.argmax(dist))
+        if dist[i] > tolerance_m:
+            idx = start + 1 + i
+            keep[idx] = True
+            stack.append((start, idx))
+            stack.append((idx, end))
+    
+    return keep
+
+
+def simplify(coords: np.ndarray, tolerance_m: float) -> np.ndarray:
+    """Douglas-Peucker: retorna apenas os pontos mantidos (array (M, 2))"""
+    return coords[simplify_mask(coords, tolerance_m)]
+
+
+def encode_polyline(coords: np.ndarray, precision: int = 6) -> str:
+    """
+    Codifica a polyline no formato Google Encoded Polyline
+    
+    Vetorizado: arredondamento, deltas, zigzag e a quebra em blocos de
+    5 bits são feitos sobre o array inteiro (sem laço por ponto).
+    
+    Args:
+        coords: Array (N, 2) [lat, lon]
+        precision: Casas decimais (5 = padrão Google, 6 = "polyline6")
+        
+    Returns:
+        String ASCII codificada
+    """
+    if len(coords) == 0:
+        return ""
+    
+    ints = np.round(np.asarray(coords, dtype=np.float64) * (10 ** precision)).astype(np.int64)
+    deltas = np.diff(ints, axis=0, prepend=np.zeros((1, 2), dtype=np.int64)).ravel()
+    # Zigzag: inteiros com sinal -> sem sinal (bit menos significativo = sinal)
+    values = ((deltas << 1) ^ (deltas >> 63)).astype(np.uint64)
+    
+    # Blocos de 5 bits por valor (int64 zigzag cabe em 13 blocos)
+    shifts = np.arange(13, dtype=np.uint64) * np.uint64(5)
+    chunks = (values[:, None] >> shifts[None, :]) & np.uint64(0x1F)
+    # Quantidade de blocos necessária para cada valor (mínimo 1)
+    nbits = np.zeros(len(values), dtype=np.int64)
+    nonzero = values > 0
+    nbits[nonzero] = np.floor(np.log2(values[nonzero].astype(np.float64))).astype(np.int64) + 1
+    nchunks = np.maximum(1, (nbits + 4) // 5)
+    
+    col = np.arange(13)[None, :]
+    used = col < nchunks[:, None]
+    # Todos os blocos, exceto o último de cada valor, levam o bit de continuação
+    chunks = chunks | np.where(col < (nchunks[:, None] - 1), np.uint64(0x20), np.uint64(0))
+    return (chunks[used] + np.uint64(63)).astype(np.uint8).tobytes().decode("ascii")
+
+
+def decode_polyline(encoded: str, precision: int = 6) -> np.ndarray:
+    """
+    Decodifica uma Google Encoded Polyline (inverso de encode_polyline)
+
+    Vetorizado: os blocos de 5 bits são agrupados por valor com reduceat
+    e os deltas são acumulados com cumsum.
+
+    Raises:
+        ValueError: string truncada ou com caracteres fora do alfabeto
+
+    Returns:
+        Array (N, 2) [lat, lon]
+    """
+    if not encoded:
+        return np.empty((0, 2), dtype=np.float64)
+
+    raw = np.frombuffer(encoded.encode("ascii"), dtype=np.uint8).astype(np.int64) - 63
+    if np.any((raw < 0) | (raw > 0x3F)) or raw[-1] & 0x20:
+        raise ValueError("Polyline inválida")
+
+    # Cada valor termina no primeiro bloco sem o bit de continuação
+    ends = (raw & 0x20) == 0
+    starts = np.flatnonzero(np.concatenate(([True], ends[:-1])))
+    if len(starts) % 2:
+        raise ValueError("Polyline inválida: número ímpar de valores")
+    position = np.arange(len(raw)) - np.repeat(starts, np.diff(np.append(starts, len(raw))))
+    values = np.add.reduceat((raw & 0x1F) << (5 * position), starts)
+    # Zigzag inverso: bit menos significativo = sinal
+    deltas = (values >> 1) ^ -(values & 1)
+    return np.cumsum(deltas.reshape(-1, 2), axis=0) / float(10 ** precision)
+
+
+def snap_to_polyline(
+    points: np.ndarray,
+    line: np.ndarray,
+    max_dist_m: float,
+    block_size: int = 1_000_000
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Projeta cada ponto no segmento mais próximo da polyline
+
+    Pontos a mais de max_dist_m da linha ficam como estão. As distâncias
+    ponto x segmento são calculadas em blocos de pontos para limitar a
+    memória a ~block_size pares por vez.
+
+    Args:
+        points: Array (N, 2) [lat, lon]
+        line: Polyline (M, 2) [lat, lon], M >= 2
+        max_dist_m: Distância máxima para encaixar um ponto (metros)
+
+    Returns:
+        (pontos (N, 2), distância de cada ponto original à linha (N,))
+    """
+    if len(points) == 0 or len(line) < 2:
+        return points.copy(), np.full(len(points), np.inf)
+
+    origin = float(line[:, 0].mean())
+    line_xy = to_local_meters(line, origin)
+    a = line_xy[:-1]
+    ab = line_xy[1:] - a
+    ab_len2 = np.einsum("ij,ij->i", ab, ab)
+    points_xy = to_local_meters(points, origin)
+
+    snapped = points.copy()
+    dist = np.empty(len(points), dtype=np.float64)
+    step = max(1, block_size // len(a))
+    for start in range(0, len(points), step):
+        p = points_xy[start:start + step]
+        ap = p[:, None, :] - a[None, :, :]
+        t = np.clip(
+            np.divide(np.einsum("nmk,mk->nm", ap, ab), ab_len2, out=np.zeros((len(p), len(a))), where=ab_len2 > 0),
+            0.0, 1.0
+        )
+        diff = ap - t[:, :, None] * ab[None, :, :]
+        d2 = np.einsum("nmk,nmk->nm", diff, diff)
+        seg = np.argmin(d2, axis=1)
+        rows = np.arange(len(p))
+        block_dist = np.sqrt(d2[rows, seg])
+        dist[start:start + step] = block_dist
+
+        close = block_dist <= max_dist_m
+        ts = t[rows, seg][close]
+        idx = seg[close]
+        snapped[start:start + step][close] = line[idx] + (line[idx + 1] - line[idx]) * ts[:, None]
+
+    return snapped, dist
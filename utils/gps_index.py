@@ -0,0 +1,627 @@
+# utils/gps_index.py
+"""
+Índice espacial em disco sobre os fixes de GPS ingeridos
+
+Consultas de painel de frota ("quais veículos passaram perto de X na
+última hora") não podem varrer todos os fixes. O índice divide o mapa numa
+grade regular (cell_deg graus) e guarda os pontos em segmentos imutáveis,
+cada um ordenado pela célula:
+
+- a thread escritora da ingestão chama add() a cada lote gravado; os
+  pontos ficam num buffer vivo (consultado por varredura vetorizada)
+- ao atingir segment_points ou segment_interval_s, o buffer vira um
+  segmento .npy (pontos ordenados por célula) + .cells.npy (células
+  distintas e onde começam), gravados de forma atômica
+- segmentos são abertos com mmap sob demanda: uma consulta usa
+  searchsorted nas células da bbox e lê só essas faixas; o intervalo de
+  tempo do nome do arquivo descarta segmentos fora da janela sem abri-los.
+  No máximo max_open_segments ficam abertos (LRU, um fd cada)
+- uma thread de manutenção (compact()) funde segmentos pequenos em
+  camadas de tamanho (fanout por camada, até compact_max_points), apaga
+  os de entrada e remove os segmentos mais antigos que retention_s
+
+Os segmentos ficam num diretório compartilhado: cada processo do gunicorn
+vê os segmentos de todos, mas só o próprio buffer vivo (fixes de outros
+processos aparecem em até segment_interval_s). Um processo compacta por
+vez (flock em .compact.lock); a troca entradas -> segmento fundido é
+feita sob flock exclusivo em .segments.lock, e as leituras listam e abrem
+os segmentos sob flock compartilhado, então nunca veem as duas versões.
+"""
+import logging
+import math
+import os
+import socket
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: sem coordenação entre processos (um processo só)
+    fcntl = None
+
+from services.metrics import metrics
+from utils import geometry
+
+logger = logging.getLogger(__name__)
+
+# Ponto indexado: fix + célula da grade (chave de ordenação do segmento)
+INDEX_RECORD = np.dtype([
+    ("cell", "<i8"),
+    ("lat", "<f8"),
+    ("lon", "<f8"),
+    ("timestamp", "<i8"),
+    ("alt", "<f4"),
+    ("device", "<u4")
+])
+
+SEGMENT_SUFFIX = ".npy"
+CELLS_SUFFIX = ".cells.npy"
+COMPACT_LOCK = ".compact.lock"
+SEGMENTS_LOCK = ".segments.lock"
+# Idade a partir da qual .tmp e .cells.npy sem segmento são restos de falha
+ORPHAN_AGE_S = 3600
+
+# Metros por grau de latitude (usado para converter raios em bboxes)
+_M_PER_DEG = math.pi * geometry.EARTH_RADIUS_M / 180
+
+
+def _cells_path(path: Path) -> Path:
+    return path.with_name(path.name[:-len(SEGMENT_SUFFIX)] + CELLS_SUFFIX)
+
+
+def _time_range(path: Path) -> Tuple[int, int]:
+    """(t_min, t_max) do nome seg-<t_min>-<t_max>-...; ValueError se não for um segmento"""
+    _, t_min, t_max, _ = path.name.split("-", 3)
+    return int(t_min), int(t_max)
+
+
+class _Segment:
+    """
+    Segmento imutável aberto com mmap
+
+    Fechar é só soltar a referência: o mmap (e o fd) some quando a última
+    consulta em andamento larga suas views.
+    """
+
+    __slots__ = ("path", "t_min", "t_max", "points", "cells", "starts")
+
+    def __init__(self, path: Path, t_min: int, t_max: int):
+        self.path = path
+        self.t_min = t_min
+        self.t_max = t_max
+        self.points = np.load(path, mmap_mode="r")
+        # Diretório de células é pequeno: fica em memória (sem um segundo fd)
+        cells = np.load(_cells_path(path))
+        self.cells = cells["cell"]
+        self.starts = cells["start"]
+
+    def cell_range(self, first_cell: int, last_cell: int) -> np.ndarray:
+        """Pontos com first_cell <= célula <= last_cell (view sobre o mmap)"""
+        lo = int(np.searchsorted(self.cells, first_cell, side="left"))
+        hi = int(np.searchsorted(self.cells, last_cell, side="right"))
+        if hi <= lo:
+            return self.points[:0]
+        end = int(self.starts[hi]) if hi < len(self.starts) else len(self.points)
+        return self.points[int(self.starts[lo]):end]
+
+    def bbox_ranges(self, row_lo: int, row_hi: int, col_lo: int, col_hi: int, cols: int) -> Iterator[np.ndarray]:
+        """
+        Faixas de pontos das células da caixa (linhas row_lo..row_hi, colunas col_lo..col_hi)
+
+        Uma faixa por linha da grade; se a caixa tem mais linhas que o
+        segmento tem células, uma busca só do canto inicial ao final (o
+        filtro fino da bbox descarta o que sobrar).
+        """
+        if row_hi - row_lo + 1 > len(self.cells):
+            yield self.cell_range(row_lo * cols + col_lo, row_hi * cols + col_hi)
+            return
+        for row in range(row_lo, row_hi + 1):
+            yield self.cell_range(row * cols + col_lo, row * cols + col_hi)
+
+
+class GPSSpatialIndex:
+    """
+    Índice em grade dos fixes de GPS (thread-safe)
+
+    Métodos principais:
+    - add(records): Indexa um lote de GPS_RECORD (incremental)
+    - bbox(min_lat, min_lon, max_lat, max_lon, t_start, t_end): Pontos na caixa
+    - radius(lat, lon, radius_m, t_start, t_end): Pontos no raio (com distância)
+    - nearest(lat, lon, k, t_start, t_end): k pontos mais próximos
+    - flush(): Grava o buffer vivo como segmento
+    - maybe_flush(): flush() se o buffer vivo passou de segment_interval_s
+    - compact(): Retenção + fusão de segmentos pequenos (thread de manutenção)
+    - close(): Para a thread de manutenção
+    """
+
+    def __init__(
+        self,
+        directory: Union[str, Path],
+        cell_deg: float = 0.01,
+        segment_points: int = 1_000_000,
+        segment_interval_s: float = 60,
+        max_radius_m: float = 50_000,
+        max_open_segments: int = 256,
+        compact_interval_s: float = 60,
+        compact_fanout: int = 8,
+        compact_max_points: Optional[int] = None,
+        retention_s: float = 7 * 24 * 3600
+    ):
+        """
+        Args:
+            directory: Diretório dos segmentos (compartilhado entre processos)
+            cell_deg: Lado da célula da grade em graus (0.01 ≈ 1,1 km)
+            segment_points: Pontos no buffer vivo que disparam um segmento
+            segment_interval_s: Idade máxima do buffer vivo antes de virar segmento
+            max_radius_m: Maior raio de busca do nearest
+            max_open_segments: Segmentos abertos (mmap) ao mesmo tempo
+            compact_interval_s: Intervalo da manutenção em background (0 = só compact() manual)
+            compact_fanout: Segmentos de uma camada de tamanho fundidos de uma vez
+            compact_max_points: Segmentos com isso de pontos não são mais
+                fundidos (None = segment_points)
+            retention_s: Idade (pelo timestamp dos fixes) a partir da qual um
+                segmento é apagado (0 = sem retenção)
+        """
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.cell_deg = cell_deg
+        self.segment_points = segment_points
+        self.segment_interval_s = segment_interval_s
+        self.max_radius_m = max_radius_m
+        self.max_open_segments = max_open_segments
+        self.compact_fanout = max(2, compact_fanout)
+        self.compact_max_points = compact_max_points or segment_points
+        self.retention_s = retention_s
+        # Colunas da grade: células de uma mesma linha (latitude) são contíguas
+        self._cols = int(math.ceil(360 / cell_deg)) + 1
+
+        self._lock = threading.Lock()
+        self._live: List[np.ndarray] = []
+        self._live_count = 0
+        self._live_since = time.monotonic()
+        # Pontos sendo gravados: continuam visíveis até o segmento aparecer
+        self._flushing: List[np.ndarray] = []
+        # Segmentos no diretório: nome -> (caminho, t_min, t_max)
+        self._catalog: Dict[str, Tuple[Path, int, int]] = {}
+        # Segmentos abertos, do menos ao mais recentemente consultado
+        self._open: "OrderedDict[str, _Segment]" = OrderedDict()
+        self._dir_mtime = None
+        self._seq = 0
+        # fd do flock compartilhado das leituras (serializadas por _lock)
+        self._lock_fd = os.open(self.directory / SEGMENTS_LOCK, os.O_RDWR | os.O_CREAT, 0o644)
+
+        self._stop = threading.Event()
+        self._compactor = None
+        if compact_interval_s > 0:
+            self._compactor = threading.Thread(
+                target=self._compact_loop, args=(compact_interval_s,), name="gps-index-compact", daemon=True
+            )
+            self._compactor.start()
+
+    # ------------------------------------------------------------------
+    # Escrita
+    # ------------------------------------------------------------------
+
+    def _cells(self, lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+        row = np.floor((np.asarray(lat) + 90) / self.cell_deg).astype(np.int64)
+        col = np.floor((np.asarray(lon) + 180) / self.cell_deg).astype(np.int64)
+        return row * self._cols + col
+
+    def add(self, records: np.ndarray) -> None:
+        """Indexa um lote de GPS_RECORD (chamado pela thread escritora da ingestão)"""
+        if len(records) == 0:
+            return
+        points = np.empty(len(records), dtype=INDEX_RECORD)
+        points["cell"] = self._cells(records["lat"], records["lon"])
+        for name in ("lat", "lon", "timestamp", "alt", "device"):
+            points[name] = records[name]
+
+        with self._lock:
+            if not self._live:
+                self._live_since = time.monotonic()
+            self._live.append(points)
+            self._live_count += len(points)
+            full = self._live_count >= self.segment_points
+        if full:
+            self.flush()
+        else:
+            self.maybe_flush()
+
+    def maybe_flush(self) -> None:
+        """Grava o buffer vivo se ele já tem segment_interval_s (visível aos outros processos)"""
+        with self._lock:
+            due = bool(self._live) and time.monotonic() - self._live_since >= self.segment_interval_s
+        if due:
+            self.flush()
+
+    def flush(self) -> Optional[Path]:
+        """Grava o buffer vivo como um segmento ordenado por célula"""
+        with self._lock:
+            if not self._live:
+                return None
+            pending = np.concatenate(self._live)
+            self._live, self._live_count = [], 0
+            self._flushing.append(pending)
+            self._seq += 1
+            seq = self._seq
+
+        start = time.perf_counter()
+        tmp, path, cells = self._prepare_segment(pending, str(seq))
+        with self._lock:
+            # Troca buffer -> segmento sem janela em que os pontos somem ou duplicam
+            os.replace(tmp, path)
+            self._flushing = [p for p in self._flushing if p is not pending]
+            self._dir_mtime = None
+
+        metrics.incr("gps_index.segments")
+        metrics.observe("gps_index.flush_ms", (time.perf_counter() - start) * 1000)
+        logger.info(f"GPS index segment written: {path.name} ({len(pending)} points, {cells} cells)")
+        return path
+
+    def _prepare_segment(self, points: np.ndarray, tag: str) -> Tuple[Path, Path, int]:
+        """
+        Ordena points por célula e grava o segmento ainda como .tmp
+
+        Returns:
+            (tmp, path, células): o chamador publica com os.replace(tmp, path)
+        """
+        points = points[np.argsort(points["cell"], kind="stable")]
+        cells, starts = np.unique(points["cell"], return_index=True)
+        directory = np.empty(len(cells), dtype=[("cell", "<i8"), ("start", "<i8")])
+        directory["cell"], directory["start"] = cells, starts
+
+        t_min, t_max = int(points["timestamp"].min()), int(points["timestamp"].max())
+        stem = f"seg-{t_min}-{t_max}-{socket.gethostname()}-{os.getpid()}-{tag}"
+        path = self.directory / (stem + SEGMENT_SUFFIX)
+        cells_path = self.directory / (stem + CELLS_SUFFIX)
+        # Diretório de células primeiro: o segmento só aparece (rename) completo
+        os.replace(self._save_tmp(cells_path, directory), cells_path)
+        return self._save_tmp(path, points), path, len(cells)
+
+    @staticmethod
+    def _save_tmp(path: Path, array: np.ndarray) -> Path:
+        """Grava array ao lado de path (.tmp); o chamador publica com os.replace"""
+        tmp = path.with_name(path.name + ".tmp")
+        with tmp.open("wb") as f:
+            np.save(f, array)
+        return tmp
+
+    # ------------------------------------------------------------------
+    # Manutenção (compactação e retenção)
+    # ------------------------------------------------------------------
+
+    def _compact_loop(self, interval_s: float) -> None:
+        while not self._stop.wait(interval_s):
+            try:
+                self.compact()
+            except Exception as e:
+                metrics.incr("gps_index.error")
+                logger.error(f"GPS index compaction failed: {e}")
+
+    def close(self) -> None:
+        """Para a thread de manutenção (os segmentos ficam como estão)"""
+        self._stop.set()
+        if self._compactor is not None:
+            self._compactor.join(timeout=10)
+
+    def compact(self) -> int:
+        """
+        Uma rodada de manutenção: retenção, restos de falhas e fusões
+
+        Cada camada de tamanho (potências de compact_fanout) com
+        compact_fanout segmentos é fundida num só, do mais antigo para o
+        mais recente, então o número de segmentos cresce com o log do
+        volume e não com o tempo de atividade. Se outro processo já está
+        compactando, a rodada é pulada.
+
+        Returns:
+            Segmentos removidos (apagados pela retenção ou fundidos)
+        """
+        if fcntl is None:
+            return self._compact_round()
+        with open(self.directory / COMPACT_LOCK, "a") as lock:
+            try:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return 0
+            return self._compact_round()
+
+    def _compact_round(self) -> int:
+        segments = self._scan()
+        removed = 0
+
+        if self.retention_s > 0:
+            cutoff = int((time.time() - self.retention_s) * 1000)
+            expired = [path for path, _, t_max in segments if t_max < cutoff]
+            if expired:
+                self._swap(None, expired)
+                metrics.incr("gps_index.pruned", len(expired))
+                logger.info(f"GPS index retention removed {len(expired)} segments")
+                removed += len(expired)
+                segments = [s for s in segments if s[2] >= cutoff]
+        self._remove_orphans()
+
+        tiers: Dict[int, List[Tuple[int, Path, int]]] = {}
+        for path, t_min, _ in segments:
+            try:
+                size = max(1, (path.stat().st_size - 128) // INDEX_RECORD.itemsize)
+            except OSError:
+                continue
+            if size < self.compact_max_points:
+                tier = int(math.log(size, self.compact_fanout))
+                tiers.setdefault(tier, []).append((t_min, path, size))
+
+        for tier in sorted(tiers):
+            group, total = [], 0
+            for _, path, size in sorted(tiers[tier]):
+                group.append(path)
+                total += size
+                if len(group) == self.compact_fanout or total >= self.compact_max_points:
+                    if len(group) > 1:
+                        self._merge(group)
+                        removed += len(group)
+                    group, total = [], 0
+        return removed
+
+    def _merge(self, paths: List[Path]) -> None:
+        """Funde segmentos num só e apaga os de entrada"""
+        start = time.perf_counter()
+        points = np.concatenate([np.load(path, mmap_mode="r") for path in paths])
+        with self._lock:
+            self._seq += 1
+            seq = self._seq
+        tmp, path, cells = self._prepare_segment(points, f"c{seq}")
+        self._swap(tmp, paths, path)
+        metrics.incr("gps_index.compactions")
+        metrics.observe("gps_index.compact_ms", (time.perf_counter() - start) * 1000)
+        logger.info(f"GPS index compacted {len(paths)} segments into {path.name} ({len(points)} points, {cells} cells)")
+
+    def _swap(self, tmp: Optional[Path], old: List[Path], path: Optional[Path] = None) -> None:
+        """Publica tmp como path e apaga old numa única troca (flock exclusivo)"""
+        with self._segments_lock(exclusive=True):
+            if tmp is not None:
+                os.replace(tmp, path)
+            for segment in old:
+                for target in (segment, _cells_path(segment)):
+                    try:
+                        target.unlink()
+                    except FileNotFoundError:
+                        pass
+        with self._lock:
+            self._dir_mtime = None
+
+    def _remove_orphans(self) -> None:
+        """Apaga .tmp e diretórios de células sem segmento deixados por processos que caíram"""
+        cutoff = time.time() - ORPHAN_AGE_S
+        for path in self.directory.glob("seg-*"):
+            if path.name.endswith(CELLS_SUFFIX):
+                orphan = not path.with_name(path.name[:-len(CELLS_SUFFIX)] + SEGMENT_SUFFIX).exists()
+            else:
+                orphan = path.name.endswith(".tmp")
+            try:
+                if orphan and path.stat().st_mtime < cutoff:
+                    path.unlink()
+            except OSError:
+                pass
+
+    @contextmanager
+    def _segments_lock(self, exclusive: bool):
+        """
+        flock em .segments.lock: exclusivo na troca de segmentos, compartilhado na leitura
+
+        A escrita usa um fd próprio, então também exclui as leituras deste processo.
+        """
+        if fcntl is None:
+            yield
+            return
+        fd = os.open(self.directory / SEGMENTS_LOCK, os.O_RDWR | os.O_CREAT, 0o644) if exclusive else self._lock_fd
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            yield
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            if exclusive:
+                os.close(fd)
+
+    # ------------------------------------------------------------------
+    # Leitura
+    # ------------------------------------------------------------------
+
+    def _scan(self) -> List[Tuple[Path, int, int]]:
+        """Segmentos publicados no diretório: (caminho, t_min, t_max)"""
+        found = []
+        for path in self.directory.glob(f"seg-*{SEGMENT_SUFFIX}"):
+            if path.name.endswith(CELLS_SUFFIX):
+                continue
+            try:
+                t_min, t_max = _time_range(path)
+            except ValueError:
+                logger.warning(f"Ignoring GPS index segment {path.name}: unexpected name")
+                continue
+            found.append((path, t_min, t_max))
+        return found
+
+    def _refresh_segments(self) -> None:
+        """Relê o catálogo quando o diretório muda (chamar com _lock e o flock compartilhado)"""
+        mtime = self.directory.stat().st_mtime_ns
+        if mtime == self._dir_mtime:
+            return
+        self._catalog = {path.name: (path, t_min, t_max) for path, t_min, t_max in self._scan()}
+        for name in [name for name in self._open if name not in self._catalog]:
+            del self._open[name]
+        self._dir_mtime = mtime
+
+    def _open_segment(self, name: str) -> Optional[_Segment]:
+        """Segmento aberto (LRU de max_open_segments); chamar com _lock e o flock compartilhado"""
+        segment = self._open.get(name)
+        if segment is not None:
+            self._open.move_to_end(name)
+            return segment
+        path, t_min, t_max = self._catalog[name]
+        try:
+            segment = _Segment(path, t_min, t_max)
+        except (ValueError, OSError) as e:
+            logger.warning(f"Ignoring GPS index segment {name}: {e}")
+            return None
+        self._open[name] = segment
+        while len(self._open) > self.max_open_segments:
+            self._open.popitem(last=False)
+        return segment
+
+    def _candidates(
+        self,
+        min_lat: float,
+        min_lon: float,
+        max_lat: float,
+        max_lon: float,
+        t_start: Optional[int],
+        t_end: Optional[int]
+    ) -> Iterator[np.ndarray]:
+        """Faixas de pontos (segmentos + buffer vivo) que podem estar na caixa e na janela"""
+        with self._lock, self._segments_lock(exclusive=False):
+            self._refresh_segments()
+            segments = []
+            for name, (_, seg_min, seg_max) in self._catalog.items():
+                if (t_start is not None and seg_max < t_start) or (t_end is not None and seg_min >= t_end):
+                    continue
+                segment = self._open_segment(name)
+                if segment is not None:
+                    segments.append(segment)
+            live = self._live + self._flushing
+
+        row_lo, row_hi = (int(r) // self._cols for r in self._cells([min_lat, max_lat], [min_lon, min_lon]))
+        col_lo, col_hi = (int(c) % self._cols for c in self._cells([min_lat, min_lat], [min_lon, max_lon]))
+        for segment in segments:
+            yield from segment.bbox_ranges(row_lo, row_hi, col_lo, col_hi, self._cols)
+        yield from live
+
+    def bbox(
+        self,
+        min_lat: float,
+        min_lon: float,
+        max_lat: float,
+        max_lon: float,
+        t_start: Optional[int] = None,
+        t_end: Optional[int] = None
+    ) -> np.ndarray:
+        """
+        Pontos (INDEX_RECORD) dentro da caixa e de t_start <= timestamp < t_end (ms)
+
+        A caixa é limitada a lat [-90, 90] e lon [-180, 180]; coordenadas
+        não finitas levantam ValueError.
+        """
+        if not all(math.isfinite(v) for v in (min_lat, min_lon, max_lat, max_lon)):
+            raise ValueError("bbox com coordenadas não finitas")
+        min_lat, max_lat = max(-90.0, min_lat), min(90.0, max_lat)
+        min_lon, max_lon = max(-180.0, min_lon), min(180.0, max_lon)
+        if min_lat > max_lat or min_lon > max_lon:
+            return np.empty(0, dtype=INDEX_RECORD)
+
+        start = time.perf_counter()
+        parts = []
+        for points in self._candidates(min_lat, min_lon, max_lat, max_lon, t_start, t_end):
+            if len(points) == 0:
+                continue
+            lat, lon, ts = points["lat"], points["lon"], points["timestamp"]
+            mask = (lat >= min_lat) & (lat <= max_lat) & (lon >= min_lon) & (lon <= max_lon)
+            if t_start is not None:
+                mask &= ts >= t_start
+            if t_end is not None:
+                mask &= ts < t_end
+            if mask.any():
+                parts.append(points[mask])
+        metrics.observe("gps_index.query_ms", (time.perf_counter() - start) * 1000)
+        return np.concatenate(parts) if parts else np.empty(0, dtype=INDEX_RECORD)
+
+    def radius(
+        self,
+        lat: float,
+        lon: float,
+        radius_m: float,
+        t_start: Optional[int] = None,
+        t_end: Optional[int] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Pontos a até radius_m metros de (lat, lon)
+
+        Returns:
+            (pontos, distâncias em metros), ordenados por distância
+        """
+        if not all(math.isfinite(v) for v in (lat, lon, radius_m)):
+            raise ValueError("Centro ou raio não finito")
+        dlat = radius_m / _M_PER_DEG
+        dlon = radius_m / (_M_PER_DEG * max(math.cos(math.radians(lat)), 1e-6))
+        points = self.bbox(
+            max(-90.0, lat - dlat), max(-180.0, lon - dlon),
+            min(90.0, lat + dlat), min(180.0, lon + dlon),
+            t_start, t_end
+        )
+        dist = geometry.distances_from(lat, lon, points["lat"], points["lon"])
+        inside = dist <= radius_m
+        points, dist = points[inside], dist[inside]
+        order = np.argsort(dist, kind="stable")
+        return points[order], dist[order]
+
+    def nearest(
+        self,
+        lat: float,
+        lon: float,
+        k: int = 10,
+        t_start: Optional[int] = None,
+        t_end: Optional[int] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        k pontos mais próximos de (lat, lon), buscando em raios crescentes
+
+        Começa no tamanho de uma célula e dobra até achar k pontos ou chegar
+        a max_radius_m.
+        """
+        radius_m = self.cell_deg * _M_PER_DEG
+        while True:
+            points, dist = self.radius(lat, lon, radius_m, t_start, t_end)
+            if len(points) >= k or radius_m >= self.max_radius_m:
+                return points[:k], dist[:k]
+            radius_m = min(radius_m * 2, self.max_radius_m)
+
+    def stats(self) -> Dict:
+        """Snapshot para /metrics"""
+        with self._lock:
+            return {
+                "segments": len(self._catalog),
+                "open_segments": len(self._open),
+                "live_points": self._live_count,
+                "cell_deg": self.cell_deg
+            }
+
+
+def summarize_devices(points: np.ndarray, dist: Optional[np.ndarray] = None) -> List[Dict]:
+    """
+    Um resumo por dispositivo: último fix visto e (se houver) menor distância
+
+    Responde "quais veículos estiveram perto de X" a partir dos pontos de uma consulta.
+    """
+    if len(points) == 0:
+        return []
+    devices = points["device"]
+    summary = []
+    for device in np.unique(devices):
+        mask = devices == device
+        subset = points[mask]
+        last = subset[int(np.argmax(subset["timestamp"]))]
+        item = {
+            "device": int(device),
+            "fixes": int(mask.sum()),
+            "last_timestamp": int(last["timestamp"]),
+            "last_lat": float(last["lat"]),
+            "last_lon": float(last["lon"])
+        }
+        if dist is not None:
+            item["min_dist_m"] = round(float(dist[mask].min()), 1)
+        summary.append(item)
+    return summary
@@ -0,0 +1,463 @@
+# utils/gps_ingest.py
+"""
+Pipeline de ingestão de GPS (substitui o append linha a linha em CSV)
+
+O append_gps_data antigo abria o CSV e escrevia uma linha por chamada sob um
+threading.Lock global: todos os escritores ficavam em fila e o lock nem
+protegia entre processos do gunicorn. Aqui:
+
+- POST /gps recebe lotes de fixes (POST /gps/compact, os mesmos lotes com
+  colunas delta-codificadas, ver decode_delta_fixes) e os copia para um
+  ring buffer em memória (array NumPy pré-alocado, cópia vetorizada)
+- uma thread escritora esvazia o buffer em lotes grandes (por tamanho ou
+  por tempo) num log binário append-only, um arquivo por processo (sem
+  disputa entre processos)
+- backpressure: com o buffer cheio, o lote é recusado (o cliente reenvia)
+  ou os fixes mais antigos são descartados, conforme a política
+- fsync configurável: a cada lote, por intervalo ou nunca (cache do SO)
+
+Formato do log (.gpslog): cabeçalho de 16 bytes (magic + tamanho do
+registro) seguido de registros GPS_RECORD de largura fixa, little-endian.
+"""
+import logging
+import os
+import socket
+import struct
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+import numpy as np
+
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Registro de largura fixa (32 bytes): alt NaN quando o dispositivo não informa
+GPS_RECORD = np.dtype([
+    ("lat", "<f8"),
+    ("lon", "<f8"),
+    ("alt", "<f4"),
+    ("device", "<u4"),  # id numérico do veículo/dispositivo (0 = desconhecido)
+    ("timestamp", "<i8")  # epoch em milissegundos
+])
+
+LOG_MAGIC = b"GPSLOG1\0"
+LOG_HEADER = struct.Struct("<8sII")  # magic, tamanho do registro, reservado
+LOG_SUFFIX = ".gpslog"
+
+# Timestamps abaixo disso estão em segundos (1e11 ms ~ 1973)
+_SECONDS_THRESHOLD = 1e11
+
+# Escalas do formato compacto: micrograus e decímetros
+DELTA_DEGREE_SCALE = 1e6
+DELTA_ALT_SCALE = 10.0
+
+OVERFLOW_POLICIES = ("reject", "drop_oldest")
+FSYNC_POLICIES = ("always", "interval", "never")
+
+
+def fixes_to_records(fixes: List, device: int = 0) -> np.ndarray:
+    """
+    Converte fixes do payload de /gps em registros GPS_RECORD
+
+    Aceita linhas [lat, lon, alt, timestamp] (alt pode ser null) ou objetos
+    {"lat", "lon", "alt", "timestamp"}. Timestamps em segundos são
+    convertidos para milissegundos. Fixes fora da faixa válida são descartados.
+    Todos os fixes do lote recebem o id de dispositivo device.
+
+    Raises:
+        ValueError: formato do lote inválido
+    """
+    invalid = "Fixes inválidos: use [lat, lon, alt, timestamp] ou objetos com esses campos"
+    if len(fixes) and isinstance(fixes[0], dict):
+        # Lote de objetos: todos precisam ser objetos (sem misturar com linhas)
+        if not all(isinstance(f, dict) for f in fixes):
+            raise ValueError(invalid)
+        rows = [(f.get("lat"), f.get("lon"), f.get("alt"), f.get("timestamp")) for f in fixes]
+    else:
+        rows = fixes
+    try:
+        table = np.array(rows, dtype=np.float64)
+    except (TypeError, ValueError):
+        raise ValueError(invalid)
+    if table.ndim != 2 or table.shape[1] != 4:
+        raise ValueError("Cada fix deve ter lat, lon, alt e timestamp")
+
+    lat, lon, alt, ts = table.T
+    valid = (
+        np.isfinite(lat) & (np.abs(lat) <= 90)
+        & np.isfinite(lon) & (np.abs(lon) <= 180)
+        & np.isfinite(ts) & (ts > 0)
+    )
+    ts = np.where(ts < _SECONDS_THRESHOLD, ts * 1000, ts)
+
+    records = np.empty(int(valid.sum()), dtype=GPS_RECORD)
+    records["lat"] = lat[valid]
+    records["lon"] = lon[valid]
+    records["alt"] = alt[valid]
+    records["device"] = device
+    records["timestamp"] = ts[valid]
+    return records
+
+
+def _delta_column(payload: Dict, name: str, n: Optional[int]) -> np.ndarray:
+    values = payload.get(name)
+    if not isinstance(values, list) or (n is not None and len(values) != n):
+        raise ValueError(f"Coluna {name} ausente ou com tamanho diferente das outras")
+    try:
+        column = np.array(values, dtype=np.float64)
+    except (TypeError, ValueError):
+        raise ValueError(f"Coluna {name} deve conter apenas inteiros")
+    if column.ndim != 1 or not np.all(np.isfinite(column)) or np.any(column != np.round(column)):
+        raise ValueError(f"Coluna {name} deve conter apenas inteiros")
+    return column
+
+
+def decode_delta_fixes(payload: Dict, device: int = 0) -> np.ndarray:
+    """
+    Decodifica um lote compacto (POST /gps/compact) em registros GPS_RECORD
+
+    Formato (colunas de inteiros, enviado pelo geolocation.js):
+        {"t0": epoch_ms, "lat": [...], "lon": [...], "dt": [...], "alt": [...]}
+    - lat/lon: micrograus; o primeiro valor é absoluto e os demais são a
+      diferença para o fix anterior
+    - dt: milissegundos desde o fix anterior (o primeiro, desde t0)
+    - alt (opcional): decímetros, codificado como lat/lon
+
+    Depois da decodificação, a validação é a mesma de fixes_to_records.
+
+    Raises:
+        ValueError: formato do lote inválido
+    """
+    t0 = payload.get("t0")
+    if not isinstance(t0, (int, float)) or isinstance(t0, bool):
+        raise ValueError("Campo t0 (epoch em ms) ausente ou inválido")
+    lat = _delta_column(payload, "lat", None)
+    lon = _delta_column(payload, "lon", len(lat))
+    dt = _delta_column(payload, "dt", len(lat))
+
+    table = np.empty((len(lat), 4), dtype=np.float64)
+    table[:, 0] = np.cumsum(lat) / DELTA_DEGREE_SCALE
+    table[:, 1] = np.cumsum(lon) / DELTA_DEGREE_SCALE
+    if payload.get("alt") is not None:
+        table[:, 2] = np.cumsum(_delta_column(payload, "alt", len(lat))) / DELTA_ALT_SCALE
+    else:
+        table[:, 2] = np.nan
+    table[:, 3] = t0 + np.cumsum(dt)
+    return fixes_to_records(table, device=device)
+
+
+class GPSRingBuffer:
+    """
+    Buffer circular de GPS_RECORD (thread-safe)
+
+    Métodos principais:
+    - push(records): Enfileira um lote inteiro (0 se recusado por estar cheio)
+    - drain(max_records): Retira até max_records, em ordem de chegada
+    - wait(min_records, timeout_s): Espera até haver min_records (ou timeout)
+    """
+
+    def __init__(self, capacity: int = 1_000_000, overflow: str = "reject"):
+        """
+        Args:
+            capacity: Máximo de fixes em memória (32 bytes cada)
+            overflow: "reject" recusa o lote que não cabe; "drop_oldest"
+                descarta os fixes mais antigos para abrir espaço
+        """
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Política de overflow inválida: {overflow}")
+        self.capacity = capacity
+        self.overflow = overflow
+        self._data = np.empty(capacity, dtype=GPS_RECORD)
+        self._head = 0
+        self._size = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def __len__(self) -> int:
+        with self._cond:
+            return self._size
+
+    def push(self, records: np.ndarray) -> int:
+        """Copia records para o buffer; devolve quantos foram aceitos"""
+        n = len(records)
+        if n == 0:
+            return 0
+        with self._cond:
+            free = self.capacity - self._size
+            if n > free:
+                if self.overflow == "reject":
+                    metrics.incr("gps.rejected", n)
+                    return 0
+                if n > self.capacity:
+                    records = records[-self.capacity:]
+                    n = self.capacity
+                dropped = n - free
+                self._head = (self._head + dropped) % self.capacity
+                self._size -= dropped
+                metrics.incr("gps.dropped", dropped)
+
+            tail = (self._head + self._size) % self.capacity
+            first = min(n, self.capacity - tail)
+            self._data[tail:tail + first] = records[:first]
+            self._data[:n - first] = records[first:]
+            self._size += n
+            self._cond.notify()
+        metrics.incr("gps.accepted", n)
+        return n
+
+    def drain(self, max_records: int) -> np.ndarray:
+        """Retira (cópia) até max_records fixes do início do buffer"""
+        with self._cond:
+            n = min(self._size, max_records)
+            first = min(n, self.capacity - self._head)
+            out = np.concatenate((
+                self._data[self._head:self._head + first],
+                self._data[:n - first]
+            ))
+            self._head = (self._head + n) % self.capacity
+            self._size -= n
+            return out
+
+    def wait(self, min_records: int, timeout_s: float) -> None:
+        """Bloqueia até haver min_records fixes, o buffer fechar ou timeout_s passar"""
+        with self._cond:
+            self._cond.wait_for(lambda: self._size >= min_records or self._closed, timeout_s)
+
+    def close(self) -> None:
+        """Acorda a thread escritora para o flush final"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+class GPSLogWriter:
+    """
+    Log binário append-only de GPS_RECORD
+
+    Um arquivo por processo (host + pid no nome), rotacionado por tamanho;
+    cada lote é um único write() de registros contíguos.
+    """
+
+    def __init__(
+        self,
+        directory: Union[str, Path],
+        fsync: str = "interval",
+        fsync_interval_s: float = 1.0,
+        max_segment_bytes: int = 256 * 1024 * 1024
+    ):
+        """
+        Args:
+            directory: Diretório dos arquivos .gpslog
+            fsync: "always" (a cada lote), "interval" (no máximo a cada
+                fsync_interval_s) ou "never" (fica a cargo do SO)
+            fsync_interval_s: Intervalo da política "interval"
+            max_segment_bytes: Tamanho a partir do qual um novo arquivo é aberto
+        """
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Política de fsync inválida: {fsync}")
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.fsync = fsync
+        self.fsync_interval_s = fsync_interval_s
+        self.max_segment_bytes = max_segment_bytes
+        self.path: Optional[Path] = None
+        self._fd: Optional[int] = None
+        self._segment_bytes = 0
+        self._last_fsync = time.monotonic()
+
+    def _open_segment(self) -> None:
+        """Fecha o arquivo atual (se houver) e abre um novo segmento"""
+        self.close()
+        name = f"gps-{socket.gethostname()}-{os.getpid()}-{time.time_ns()}{LOG_SUFFIX}"
+        self.path = self.directory / name
+        self._fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        os.write(self._fd, LOG_HEADER.pack(LOG_MAGIC, GPS_RECORD.itemsize, 0))
+        self._segment_bytes = LOG_HEADER.size
+        logger.info(f"GPS log segment opened: {self.path}")
+
+    def append(self, records: np.ndarray) -> None:
+        """Grava um lote de registros (e faz fsync conforme a política)"""
+        if self._fd is None or self._segment_bytes >= self.max_segment_bytes:
+            self._open_segment()
+        data = np.ascontiguousarray(records, dtype=GPS_RECORD).tobytes()
+        view = memoryview(data)
+        while view:
+            written = os.write(self._fd, view)
+            view = view[written:]
+        self._segment_bytes += len(data)
+
+        now = time.monotonic()
+        if self.fsync == "always" or (
+            self.fsync == "interval" and now - self._last_fsync >= self.fsync_interval_s
+        ):
+            os.fsync(self._fd)
+            self._last_fsync = now
+
+    def close(self) -> None:
+        if self._fd is not None:
+            if self.fsync != "never":
+                os.fsync(self._fd)
+            os.close(self._fd)
+            self._fd = None
+
+
+def read_gps_log(path: Union[str, Path]) -> np.ndarray:
+    """
+    Lê um .gpslog como array GPS_RECORD (memory-mapped, sem cópia)
+
+    Um registro final incompleto (processo interrompido no meio do write)
+    é ignorado.
+    """
+    path = Path(path)
+    with path.open("rb") as f:
+        magic, record_size, _ = LOG_HEADER.unpack(f.read(LOG_HEADER.size))
+    if magic != LOG_MAGIC or record_size != GPS_RECORD.itemsize:
+        raise ValueError(f"Arquivo não é um log GPS compatível: {path}")
+    count = (path.stat().st_size - LOG_HEADER.size) // record_size
+    if count == 0:
+        return np.empty(0, dtype=GPS_RECORD)
+    return np.memmap(path, dtype=GPS_RECORD, mode="r", offset=LOG_HEADER.size, shape=(count,))
+
+
+class GPSIngestor:
+    """
+    Ring buffer + thread escritora
+
+    Antes da gravação, cada lote passa pelo compressor de trilhas
+    (opcional, utils.trajectory); o que é gravado no log também alimenta o
+    índice espacial (opcional, utils.gps_index), mantido de forma incremental.
+
+    Métodos principais:
+    - submit(records): Enfileira um lote (False se recusado por backpressure)
+    - stats(): Ocupação do buffer e totais gravados
+    - close(): Flush final (registrado no atexit pelo app)
+    """
+
+    def __init__(
+        self,
+        writer: GPSLogWriter,
+        capacity: int = 1_000_000,
+        overflow: str = "reject",
+        batch_size: int = 16384,
+        flush_interval_s: float = 0.5,
+        index=None,
+        compressor=None
+    ):
+        """
+        Args:
+            writer: Destino dos lotes
+            capacity: Capacidade do ring buffer (fixes)
+            overflow: Política quando o buffer enche ("reject" ou "drop_oldest")
+            batch_size: Fixes acumulados que disparam um flush
+            flush_interval_s: Tempo máximo de um fix no buffer antes do flush
+            index: GPSSpatialIndex alimentado com cada lote gravado (ou None)
+            compressor: TrajectoryCompressor aplicado a cada lote antes da
+                gravação (ou None para gravar os fixes como chegaram)
+        """
+        self.writer = writer
+        self.index = index
+        self.compressor = compressor
+        self.buffer = GPSRingBuffer(capacity, overflow)
+        self.batch_size = batch_size
+        self.flush_interval_s = flush_interval_s
+        self._written = 0
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="gps-writer", daemon=True)
+        self._thread.start()
+        logger.info(
+            f"GPSIngestor ativo (capacidade={capacity}, lote={batch_size}, "
+            f"flush={flush_interval_s}s, fsync={writer.fsync})"
+        )
+
+    def submit(self, records: np.ndarray) -> bool:
+        """Enfileira records; False se o buffer recusou o lote (backpressure)"""
+        if self._closed:
+            return False
+        return self.buffer.push(records) == len(records)
+
+    def _run(self) -> None:
+        """Loop da thread escritora: flush por tamanho ou por tempo"""
+        while True:
+            self.buffer.wait(self.batch_size, self.flush_interval_s)
+            while len(self.buffer):
+                if not self._write(self._compress(self.buffer.drain(self.batch_size * 4))):
+                    break
+            # Trilhas de dispositivos que pararam de mandar fixes
+            self._write(self._flush_compressor())
+            if self.index is not None:
+                self._index_call(self.index.flush if self._closed else self.index.maybe_flush)
+            if self._closed:
+                return
+
+    def _write(self, batch: np.ndarray) -> bool:
+        """Grava um lote no log e no índice; False se a escrita falhou"""
+        if len(batch) == 0:
+            return True
+        start = time.perf_counter()
+        try:
+            self.writer.append(batch)
+        except OSError as e:
+            metrics.incr("gps.write_error", len(batch))
+            logger.error(f"GPS log write failed ({len(batch)} fixes lost): {e}")
+            return False
+        metrics.observe("gps.flush_ms", (time.perf_counter() - start) * 1000)
+        metrics.incr("gps.written", len(batch))
+        self._written += len(batch)
+        self._index_batch(batch)
+        return True
+
+    def _compress(self, batch: np.ndarray) -> np.ndarray:
+        """Falhas do compressor gravam o lote inteiro (nunca perdem fixes)"""
+        if self.compressor is None or len(batch) == 0:
+            return batch
+        try:
+            return self.compressor.compress(batch)
+        except Exception as e:
+            metrics.incr("trajectory.error")
+            logger.error(f"GPS trajectory compression failed: {e}")
+            return batch
+
+    def _flush_compressor(self) -> np.ndarray:
+        """Caudas ociosas há um heartbeat (todas no encerramento)"""
+        if self.compressor is None:
+            return np.empty(0, dtype=GPS_RECORD)
+        try:
+            return self.compressor.flush(None if self._closed else self.compressor.heartbeat_ms / 1000)
+        except Exception as e:
+            metrics.incr("trajectory.error")
+            logger.error(f"GPS trajectory flush failed: {e}")
+            return np.empty(0, dtype=GPS_RECORD)
+
+    def _index_batch(self, batch: np.ndarray) -> None:
+        if self.index is not None:
+            self._index_call(self.index.add, batch)
+
+    def _index_call(self, fn, *args) -> None:
+        """Falhas do índice não podem parar a gravação do log"""
+        try:
+            fn(*args)
+        except Exception as e:
+            metrics.incr("gps_index.error")
+            logger.error(f"GPS index update failed: {e}")
+
+    def stats(self) -> Dict:
+        """Snapshot para /metrics"""
+        return {
+            "buffered": len(self.buffer),
+            "capacity": self.buffer.capacity,
+            "overflow": self.buffer.overflow,
+            "written": self._written,
+            "segment": self.writer.path.name if self.writer.path else None
+        }
+
+    def close(self, timeout_s: float = 10.0) -> None:
+        """Para de aceitar fixes, grava o que estiver no buffer e fecha o log"""
+        if self._closed:
+            return
+        self._closed = True
+        self.buffer.close()
+        self._thread.join(timeout_s)
+        self.writer.close()
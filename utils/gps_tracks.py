@@ -0,0 +1,272 @@
+# utils/gps_tracks.py
+"""
+Formato colunar de trilhas GPS (.gpstrk), mapeável em memória
+
+O gps_data.csv (lat,lon,alt,timestamp) é texto: qualquer análise precisa
+parsear o arquivo inteiro. O .gpstrk guarda as mesmas colunas em binário
+de largura fixa, em chunks ordenados por tempo:
+
+    cabeçalho (64 bytes)  magic, versão, nº de chunks, offset do índice, nº de pontos
+    chunk 0               timestamp int64[n] | lat float64[n] | lon float64[n] | alt float32[n] | device uint32[n]
+    chunk 1 ...
+    índice                por chunk: offset, n, t_min, t_max
+
+Com o arquivo mapeado (np.memmap), cada coluna de um chunk é uma view
+NumPy sem cópia; uma consulta por intervalo de tempo usa o índice para
+tocar só os chunks envolvidos.
+
+Conversão: convert_csv (CSV legado) e convert_gps_logs (logs .gpslog da
+ingestão). Linha de comando:
+
+    python -m utils.gps_tracks data/gps_data.csv data/gps_data.gpstrk
+"""
+import logging
+import struct
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Union
+
+import numpy as np
+
+from utils.gps_ingest import GPS_RECORD, fixes_to_records, read_gps_log
+
+logger = logging.getLogger(__name__)
+
+TRACK_MAGIC = b"GPSTRK1\0"
+TRACK_VERSION = 1
+# magic, versão, nº de chunks, offset do índice, nº de pontos (+ reservado até 64 bytes)
+TRACK_HEADER = struct.Struct("<8sIIQQ32x")
+
+CHUNK_INDEX = np.dtype([
+    ("offset", "<u8"),
+    ("count", "<u8"),
+    ("t_min", "<i8"),
+    ("t_max", "<i8")
+])
+
+# Ordem e tipo das colunas dentro de cada chunk
+TRACK_COLUMNS = (
+    ("timestamp", np.dtype("<i8")),
+    ("lat", np.dtype("<f8")),
+    ("lon", np.dtype("<f8")),
+    ("alt", np.dtype("<f4")),
+    ("device", np.dtype("<u4"))
+)
+
+
+def _chunk_nbytes(count: int) -> int:
+    """Tamanho de um chunk com count pontos (alinhado a 8 bytes)"""
+    size = sum(dtype.itemsize for _, dtype in TRACK_COLUMNS) * count
+    return (size + 7) & ~7
+
+
+class GPSTrackWriter:
+    """
+    Escreve um .gpstrk a partir de lotes de GPS_RECORD em ordem de tempo
+
+    Métodos principais:
+    - append(records): Acrescenta pontos (timestamps não decrescentes)
+    - close(): Grava o último chunk, o índice e o cabeçalho final
+    """
+
+    def __init__(self, path: Union[str, Path], chunk_size: int = 65536):
+        """
+        Args:
+            path: Arquivo de saída (sobrescrito)
+            chunk_size: Pontos por chunk (granularidade das consultas por tempo)
+        """
+        self.path = Path(path)
+        self.chunk_size = chunk_size
+        self._file = self.path.open("wb")
+        self._file.write(TRACK_HEADER.pack(TRACK_MAGIC, TRACK_VERSION, 0, 0, 0))
+        self._pending = np.empty(0, dtype=GPS_RECORD)
+        self._index = []
+        self._count = 0
+        self._last_ts: Optional[int] = None
+
+    def __enter__(self) -> "GPSTrackWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def append(self, records: np.ndarray) -> None:
+        """
+        Acrescenta pontos à trilha
+
+        Raises:
+            ValueError: timestamps fora de ordem (o índice por tempo depende dela)
+        """
+        if len(records) == 0:
+            return
+        ts = records["timestamp"]
+        if np.any(ts[1:] < ts[:-1]) or (self._last_ts is not None and ts[0] < self._last_ts):
+            raise ValueError("Pontos devem ser acrescentados em ordem de timestamp")
+        self._last_ts = int(ts[-1])
+
+        pending = np.concatenate((self._pending, records)) if len(self._pending) else records
+        full = len(pending) - len(pending) % self.chunk_size
+        for start in range(0, full, self.chunk_size):
+            self._write_chunk(pending[start:start + self.chunk_size])
+        self._pending = pending[full:].copy()
+
+    def _write_chunk(self, records: np.ndarray) -> None:
+        offset = self._file.tell()
+        for name, dtype in TRACK_COLUMNS:
+            self._file.write(np.ascontiguousarray(records[name], dtype=dtype).tobytes())
+        padding = _chunk_nbytes(len(records)) - (self._file.tell() - offset)
+        self._file.write(b"\0" * padding)
+        ts = records["timestamp"]
+        self._index.append((offset, len(records), ts[0], ts[-1]))
+        self._count += len(records)
+
+    def close(self) -> None:
+        if self._file.closed:
+            return
+        if len(self._pending):
+            self._write_chunk(self._pending)
+            self._pending = np.empty(0, dtype=GPS_RECORD)
+        index_offset = self._file.tell()
+        self._file.write(np.array(self._index, dtype=CHUNK_INDEX).tobytes())
+        self._file.seek(0)
+        self._file.write(TRACK_HEADER.pack(
+            TRACK_MAGIC, TRACK_VERSION, len(self._index), index_offset, self._count
+        ))
+        self._file.close()
+        logger.info(f"GPS track written: {self.path} ({self._count} points, {len(self._index)} chunks)")
+
+
+class GPSTrack:
+    """
+    Leitura de um .gpstrk mapeado em memória (zero-copy)
+
+    Métodos principais:
+    - chunk(i): Colunas do chunk i (views sobre o arquivo)
+    - slice(t_start, t_end): Pontos com t_start <= timestamp < t_end
+    - time_range: (primeiro, último) timestamp da trilha
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self._mm = np.memmap(self.path, dtype=np.uint8, mode="r")
+        magic, version, chunks, index_offset, count = TRACK_HEADER.unpack_from(self._mm, 0)
+        if magic != TRACK_MAGIC or version != TRACK_VERSION:
+            raise ValueError(f"Arquivo não é uma trilha GPS compatível: {self.path}")
+        self.count = count
+        self.index = np.frombuffer(self._mm, dtype=CHUNK_INDEX, count=chunks, offset=index_offset)
+
+    def __len__(self) -> int:
+        return self.count
+
+    @property
+    def time_range(self) -> Optional[tuple]:
+        if len(self.index) == 0:
+            return None
+        return int(self.index["t_min"][0]), int(self.index["t_max"][-1])
+
+    def chunk(self, i: int) -> Dict[str, np.ndarray]:
+        """Colunas do chunk i como arrays somente leitura sobre o mapeamento"""
+        offset, count = int(self.index["offset"][i]), int(self.index["count"][i])
+        columns = {}
+        for name, dtype in TRACK_COLUMNS:
+            columns[name] = np.frombuffer(self._mm, dtype=dtype, count=count, offset=offset)
+            offset += dtype.itemsize * count
+        return columns
+
+    def slice(self, t_start: Optional[int] = None, t_end: Optional[int] = None) -> Dict[str, np.ndarray]:
+        """
+        Pontos com t_start <= timestamp < t_end (ms; None = sem limite)
+
+        Só os chunks que cruzam o intervalo são lidos. Se o intervalo cair
+        num único chunk, as colunas devolvidas são views sem cópia.
+        """
+        t_min, t_max = self.index["t_min"], self.index["t_max"]
+        first = 0 if t_start is None else int(np.searchsorted(t_max, t_start, side="left"))
+        last = len(self.index) if t_end is None else int(np.searchsorted(t_min, t_end, side="left"))
+
+        parts = []
+        for i in range(first, last):
+            columns = self.chunk(i)
+            ts = columns["timestamp"]
+            lo = 0 if t_start is None else int(np.searchsorted(ts, t_start, side="left"))
+            hi = len(ts) if t_end is None else int(np.searchsorted(ts, t_end, side="left"))
+            if hi > lo:
+                parts.append({name: column[lo:hi] for name, column in columns.items()})
+
+        if len(parts) == 1:
+            return parts[0]
+        if not parts:
+            return {name: np.empty(0, dtype=dtype) for name, dtype in TRACK_COLUMNS}
+        return {name: np.concatenate([p[name] for p in parts]) for name, _ in TRACK_COLUMNS}
+
+    def close(self) -> None:
+        """Libera o mapeamento (views devolvidas antes deixam de ser válidas)"""
+        mm = getattr(self._mm, "_mmap", None)
+        self.index = None
+        self._mm = None
+        if mm is not None:
+            mm.close()
+
+
+def _write_sorted(records: np.ndarray, out_path: Union[str, Path], chunk_size: int) -> int:
+    records = records[np.argsort(records["timestamp"], kind="stable")]
+    with GPSTrackWriter(out_path, chunk_size=chunk_size) as writer:
+        writer.append(records)
+    return len(records)
+
+
+def convert_csv(
+    csv_path: Union[str, Path],
+    out_path: Union[str, Path],
+    chunk_size: int = 65536
+) -> int:
+    """
+    Converte o CSV legado (lat,lon,alt,timestamp) para .gpstrk
+
+    Timestamps numéricos (s ou ms) ou textuais (ISO 8601) são aceitos;
+    linhas inválidas são descartadas. Os pontos são ordenados por tempo.
+
+    Returns:
+        Número de pontos gravados
+    """
+    import pandas as pd
+
+    frames = []
+    for frame in pd.read_csv(csv_path, usecols=["lat", "lon", "alt", "timestamp"], chunksize=1_000_000):
+        ts = pd.to_numeric(frame["timestamp"], errors="coerce")
+        if ts.isna().any():
+            parsed = pd.to_datetime(frame["timestamp"], errors="coerce", utc=True)
+            ts = ts.fillna((parsed - pd.Timestamp(0, tz="UTC")) // pd.Timedelta(milliseconds=1))
+        frame = frame.assign(timestamp=ts)
+        table = frame[["lat", "lon", "alt", "timestamp"]].apply(pd.to_numeric, errors="coerce")
+        frames.append(fixes_to_records(table.to_numpy(dtype=np.float64)))
+
+    records = np.concatenate(frames) if frames else np.empty(0, dtype=GPS_RECORD)
+    return _write_sorted(records, out_path, chunk_size)
+
+
+def convert_gps_logs(
+    log_paths: Iterable[Union[str, Path]],
+    out_path: Union[str, Path],
+    chunk_size: int = 65536
+) -> int:
+    """Junta logs .gpslog da ingestão (utils.gps_ingest) num .gpstrk ordenado por tempo"""
+    logs = [read_gps_log(path) for path in log_paths]
+    records = np.concatenate(logs) if logs else np.empty(0, dtype=GPS_RECORD)
+    return _write_sorted(records, out_path, chunk_size)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Converte trilhas GPS (CSV ou .gpslog) para .gpstrk")
+    parser.add_argument("inputs", nargs="+", type=Path, help="CSV legado ou arquivos .gpslog")
+    parser.add_argument("output", type=Path, help="Arquivo .gpstrk de saída")
+    parser.add_argument("--chunk-size", type=int, default=65536)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if len(args.inputs) == 1 and args.inputs[0].suffix == ".csv":
+        total = convert_csv(args.inputs[0], args.output, args.chunk_size)
+    else:
+        total = convert_gps_logs(args.inputs, args.output, args.chunk_size)
+    print(f"{total} pontos gravados em {args.output}")
@@ -0,0 +1,169 @@
+# utils/reasoning_broker.py
+"""
+Entrega assíncrona das justificativas do LLM (Server-Sent Events)
+
+O /rota devolve a rota assim que a escolha é feita, junto com um
+reasoning_id; a justificativa em linguagem natural é gerada em background
+e publicada aqui como eventos, que o endpoint SSE repassa ao navegador.
+
+Os jobs ficam em memória do processo (o reasoning_id só é válido no
+worker que atendeu o /rota) e expiram após ttl_s.
+"""
+import logging
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class _ReasoningJob:
+    """Eventos publicados para um reasoning_id"""
+    
+    __slots__ = ("events", "listeners", "done", "created_at", "condition")
+    
+    def __init__(self):
+        self.events: List[Tuple[str, Any]] = []
+        # (evento, callback) registrados por on_event
+        self.listeners: List[Tuple[str, Callable[[Any], None]]] = []
+        self.done = False
+        self.created_at = time.monotonic()
+        self.condition = threading.Condition()
+
+
+class ReasoningBroker:
+    """
+    Registro de jobs de justificativa + fila de eventos por job
+    
+    Métodos principais:
+    - create(): Novo reasoning_id
+    - publish(id, event, data): Publica um evento ("token", "reasoning", ...)
+    - on_event(id, event, callback): Chama callback(dados) quando o evento sair
+    - close(id): Marca o job como concluído (emite "done")
+    - stream(id, ...): Itera os eventos (com replay desde o início)
+    """
+    
+    def __init__(self, ttl_s: float = 300, max_jobs: int = 1000):
+        self.ttl_s = ttl_s
+        self.max_jobs = max_jobs
+        self._lock = threading.Lock()
+        self._jobs: Dict[str, _ReasoningJob] = {}
+    
+    def create(self) -> str:
+        """Cria um job e retorna seu reasoning_id"""
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._evict()
+            self._jobs[job_id] = _ReasoningJob()
+        return job_id
+    
+    def _evict(self) -> None:
+        """Remove jobs expirados e, se preciso, os mais antigos (chamar com _lock)"""
+        now = time.monotonic()
+        expired = [k for k, job in self._jobs.items() if now - job.created_at > self.ttl_s]
+        for k in expired:
+            del self._jobs[k]
+        while len(self._jobs) >= self.max_jobs:
+            del self._jobs[next(iter(self._jobs))]
+    
+    def _get(self, job_id: str) -> Optional[_ReasoningJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+    
+    def publish(self, job_id: str, event: str, data: Any) -> None:
+        """Publica um evento para os assinantes de job_id (ignora jobs expirados)"""
+        job = self._get(job_id)
+        if job is None:
+            return
+        with job.condition:
+            job.events.append((event, data))
+            job.condition.notify_all()
+            listeners = [callback for name, callback in job.listeners if name == event]
+        for callback in listeners:
+            self._notify(job_id, callback, data)
+    
+    def on_event(self, job_id: str, event: str, callback: Callable[[Any], None]) -> bool:
+        """
+        Chama callback(dados) na thread que publicar event em job_id
+        
+        Se o evento já saiu, o callback roda na hora (replay, como em
+        stream). O callback não deve bloquear: quem publica pode ser o
+        event loop do ASGI.
+        
+        Returns:
+            False se o job não existir (ou já tiver expirado)
+        """
+        job = self._get(job_id)
+        if job is None:
+            return False
+        with job.condition:
+            published = [data for name, data in job.events if name == event]
+            job.listeners.append((event, callback))
+        for data in published:
+            self._notify(job_id, callback, data)
+        return True
+    
+    @staticmethod
+    def _notify(job_id: str, callback: Callable[[Any], None], data: Any) -> None:
+        """Falhas de um callback não podem interromper quem publica"""
+        try:
+            callback(data)
+        except Exception as e:
+            logger.error(f"Reasoning listener failed for {job_id}: {e}")
+    
+    def close(self, job_id: str) -> None:
+        """Finaliza o job: assinantes recebem "done" e o stream termina"""
+        job = self._get(job_id)
+        if job is None:
+            return
+        with job.condition:
+            job.done = True
+            job.condition.notify_all()
+    
+    def stream(
+        self,
+        job_id: str,
+        timeout_s: float = 60,
+        heartbeat_s: float = 15
+    ) -> Optional[Iterator[Tuple[Optional[str], Any]]]:
+        """
+        Itera os eventos de job_id
+        
+        Args:
+            job_id: reasoning_id retornado pelo /rota
+            timeout_s: Tempo máximo de espera pelo fim do job
+            heartbeat_s: Intervalo dos heartbeats (evento None) enquanto espera
+            
+        Returns:
+            Iterador de (evento, dados) terminando em ("done", {}),
+            ou None se o job não existir (ou já tiver expirado)
+        """
+        job = self._get(job_id)
+        if job is None:
+            return None
+        
+        def iterate():
+            deadline = time.monotonic() + timeout_s
+            sent = 0
+            while True:
+                with job.condition:
+                    if sent == len(job.events) and not job.done:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            yield ("done", {"timeout": True})
+                            return
+                        job.condition.wait(min(heartbeat_s, remaining))
+                    pending = job.events[sent:]
+                    finished = job.done
+                sent += len(pending)
+                
+                for item in pending:
+                    yield item
+                if finished and not pending:
+                    yield ("done", {})
+                    return
+                if not pending:
+                    yield (None, None)  # Heartbeat (mantém a conexão viva)
+        
+        return iterate()
@@ -0,0 +1,187 @@
+# utils/route_cache.py
+"""
+Cache de rotas calculadas por /rota (modo padrão e otimizado)
+
+Muitos usuários repetem os mesmos trajetos (casa-trabalho). A chave usa:
+- origem/destino (e waypoints) "encaixados" numa grade geohash (~150 m
+  com precisão 7), então pequenas variações do GPS caem na mesma entrada
+- hash das constraints completas normalizadas (avoid/prefer sem
+  duplicatas, em ordem; campos livres, que vão para o LLM, entram como vieram)
+- no modo otimizado, a janela de tráfego atual (time_bucket_s): o
+  resultado depende do trânsito do momento e nunca atravessa a janela
+
+TTLs: resultados otimizados (tráfego + clima) ficam frescos por pouco
+tempo; a geometria ORS pura dura bem mais. Depois de fresca, a entrada
+ainda é servida por stale_ttl_s enquanto é recalculada em background
+(stale-while-revalidate), então pares quentes não pagam o pipeline inteiro.
+"""
+import hashlib
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from services.cache import TieredCache, geohash_encode
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class RouteCache:
+    """
+    Cache de GeoJSON de rota com stale-while-revalidate
+
+    Métodos principais:
+    - key(coordinates, constraints): Chave (grade + constraints + janela de tráfego)
+    - lookup(key): (valor, stale) ou (None, False)
+    - has(key): Se existe entrada (fresca ou vencida), sem métricas de acesso
+    - store(key, value, traffic_sensitive): Grava com o TTL do tipo de rota
+    - update(key, fn): Reescreve o valor de uma entrada mantendo a validade
+    - refresh(key, fn, *args, traffic_sensitive): Recalcula em background (uma vez por chave)
+    """
+
+    def __init__(
+        self,
+        cache: TieredCache,
+        traffic_ttl_s: float = 300,
+        geometry_ttl_s: float = 24 * 3600,
+        stale_ttl_s: float = 300,
+        time_bucket_s: float = 900,
+        geohash_precision: int = 7,
+        refresh_workers: int = 2
+    ):
+        """
+        Args:
+            cache: Armazenamento (LRU + Redis opcional)
+            traffic_ttl_s: Validade de resultados otimizados (sensíveis a tráfego)
+            geometry_ttl_s: Validade da geometria ORS sem otimização
+            stale_ttl_s: Quanto tempo uma entrada vencida ainda é servida
+                enquanto é recalculada
+            time_bucket_s: Janela de tráfego que entra na chave do modo otimizado
+            geohash_precision: Precisão da grade (7 ≈ 150 m)
+            refresh_workers: Threads para recálculo em background
+        """
+        self.cache = cache
+        self.traffic_ttl_s = traffic_ttl_s
+        self.geometry_ttl_s = geometry_ttl_s
+        self.stale_ttl_s = stale_ttl_s
+        self.time_bucket_s = time_bucket_s
+        self.geohash_precision = geohash_precision
+
+        self._refreshing: Set[str] = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=refresh_workers, thread_name_prefix="route-refresh")
+
+    def key(self, coordinates: List, constraints: Optional[Dict] = None) -> str:
+        """
+        Chave da rota
+
+        Args:
+            coordinates: Pontos [[lon, lat], ...] como chegam em /rota
+            constraints: {"avoid": [...], "prefer": [...], ...} ou None (modo padrão)
+        """
+        cells = ",".join(
+            geohash_encode(float(pt[1]), float(pt[0]), self.geohash_precision) for pt in coordinates
+        )
+        if not constraints:
+            return f"ors:{cells}"
+
+        if isinstance(constraints, dict):
+            constraints = {
+                name: self._normalize_list(value) if name in ("avoid", "prefer") else value
+                for name, value in constraints.items()
+            }
+        encoded = json.dumps(constraints, sort_keys=True, ensure_ascii=False, default=str)
+        digest = hashlib.sha1(encoded.encode("utf-8")).hexdigest()
+        bucket = int(time.time() // self.time_bucket_s)
+        return f"opt:{cells}:c={digest}:t={bucket}"
+
+    @staticmethod
+    def _normalize_list(items: Any) -> Any:
+        """avoid/prefer sem duplicatas, em ordem e em minúsculas (outros tipos passam como vieram)"""
+        if not isinstance(items, list):
+            return items
+        return sorted({
+            item.strip().lower() if isinstance(item, str) else json.dumps(item, sort_keys=True, default=str)
+            for item in items
+        })
+
+    def lookup(self, key: str) -> Tuple[Optional[Any], bool]:
+        """
+        Busca uma rota em cache
+
+        Returns:
+            (valor, stale): stale=True se a entrada já venceu e deve ser
+            recalculada; (None, False) se não houver entrada
+        """
+        entry = self.cache.get(key)
+        if entry is None:
+            metrics.incr("route_cache.miss")
+            return None, False
+        if time.time() < entry["fresh_until"]:
+            metrics.incr("route_cache.hit")
+            return entry["value"], False
+        metrics.incr("route_cache.stale_hit")
+        return entry["value"], True
+
+    def has(self, key: str) -> bool:
+        """Se há entrada servível para key (usado pelo ASGI para delegar ao Flask)"""
+        return self.cache.get(key) is not None
+
+    def store(self, key: str, value: Any, traffic_sensitive: bool) -> None:
+        """Grava value: fresco pelo TTL do tipo de rota, servível por mais stale_ttl_s"""
+        fresh_ttl = self.traffic_ttl_s if traffic_sensitive else self.geometry_ttl_s
+        entry = {"value": value, "fresh_until": time.time() + fresh_ttl}
+        self.cache.set(key, entry, fresh_ttl + self.stale_ttl_s)
+
+    def update(self, key: str, fn: Callable[[Any], Optional[Any]]) -> bool:
+        """
+        Troca o valor de key por fn(valor), sem renovar fresh_until nem o TTL
+
+        Returns:
+            False se não há entrada ou fn devolveu None (nada a mudar)
+        """
+        entry = self.cache.get(key)
+        if entry is None:
+            return False
+        ttl = entry["fresh_until"] + self.stale_ttl_s - time.time()
+        value = fn(entry["value"])
+        if value is None or ttl <= 0:
+            return False
+        self.cache.set(key, {"value": value, "fresh_until": entry["fresh_until"]}, ttl)
+        return True
+
+    def refresh(self, key: str, fn: Callable[..., Optional[Any]], *args, traffic_sensitive: bool) -> None:
+        """
+        Recalcula a entrada em background (no máximo um recálculo por chave)
+
+        fn(*args) devolve o novo valor; None ou exceção mantêm a entrada
+        antiga até ela expirar.
+        """
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+        metrics.incr("route_cache.refresh")
+        self._executor.submit(self._refresh, key, fn, args, traffic_sensitive)
+
+    def _refresh(self, key: str, fn: Callable[..., Optional[Any]], args: tuple, traffic_sensitive: bool) -> None:
+        try:
+            value = fn(*args)
+            if value is not None:
+                self.store(key, value, traffic_sensitive)
+        except Exception as e:
+            metrics.incr("route_cache.refresh_error")
+            logger.warning(f"Route cache refresh failed for {key}: {e}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def stats(self) -> Dict:
+        """Snapshot para /metrics"""
+        stats = self.cache.stats()
+        with self._lock:
+            stats["refreshing"] = len(self._refreshing)
+        return stats
@@ -0,0 +1,83 @@
+# utils/route_format.py
+"""
+Formatos de resposta do /rota
+
+- "geojson" (padrão): GeoJSON do ORS sem alterações
+- "polyline6": cada LineString vira uma Encoded Polyline (precisão 1e-6),
+  opcionalmente simplificada (Douglas-Peucker) com tolerância derivada do
+  nível de zoom em que o cliente vai exibir a rota
+"""
+import math
+from typing import Dict, Optional
+
+import numpy as np
+
+from utils import geometry
+
+RESPONSE_FORMATS = ("geojson", "polyline6")
+
+# Metros por pixel no zoom 0 (Web Mercator, tiles de 256 px) no equador
+_METERS_PER_PIXEL_Z0 = 156543.03392
+# Desvio máximo aceito na simplificação, em pixels de tela
+SIMPLIFY_TOLERANCE_PX = 0.5
+
+
+def zoom_tolerance_m(zoom: float, lat: float) -> float:
+    """
+    Tolerância (metros) para simplificação no zoom informado
+    
+    Um desvio menor que SIMPLIFY_TOLERANCE_PX pixel é invisível no mapa.
+    """
+    meters_per_pixel = _METERS_PER_PIXEL_Z0 * math.cos(math.radians(lat)) / (2 ** zoom)
+    return SIMPLIFY_TOLERANCE_PX * meters_per_pixel
+
+
+def format_route_response(
+    geojson_data: Dict,
+    response_format: str = "geojson",
+    zoom: Optional[float] = None
+) -> Dict:
+    """
+    Converte o GeoJSON de rota para o formato pedido pelo cliente
+    
+    Args:
+        geojson_data: FeatureCollection retornada pelo ORS (coordenadas [lon, lat])
+        response_format: "geojson" ou "polyline6"
+        zoom: Nível de zoom de exibição; se None, a geometria não é simplificada
+        
+    Returns:
+        Dict pronto para jsonify. Em "polyline6", a geometria de cada
+        LineString vira {"type": "EncodedPolyline", "precision": 6, "polyline": "..."}
+        e o topo do documento recebe "format": "polyline6".
+    """
+    if response_format != "polyline6" or not isinstance(geojson_data, dict):
+        return geojson_data
+    
+    features = []
+    for feature in geojson_data.get("features", []):
+        geom = feature.get("geometry") or {}
+        if geom.get("type") != "LineString" or not geom.get("coordinates"):
+            features.append(feature)
+            continue
+        
+        # ORS usa [lon, lat(, elev)]; a polyline usa [lat, lon]
+        coords = np.ascontiguousarray(
+            np.asarray(geom["coordinates"], dtype=np.float64)[:, 1::-1]
+        )
+        original_points = len(coords)
+        if zoom is not None and len(coords) > 2:
+            tolerance = zoom_tolerance_m(zoom, float(coords[:, 0].mean()))
+            coords = geometry.simplify(coords, tolerance)
+        
+        features.append({
+            **feature,
+            "geometry": {
+                "type": "EncodedPolyline",
+                "precision": 6,
+                "polyline": geometry.encode_polyline(coords, precision=6),
+                "points": len(coords),
+                "original_points": original_points
+            }
+        })
+    
+    return {**geojson_data, "features": features, "format": "polyline6"}
@@ -4,10 +4,19 @@ Orquestrador principal: combina TomTom + OpenWeather + Groq LLM
 para calcular e otimizar rotas baseado em constraints do usuário
 """
 import logging
+from concurrent.futures import Future, InvalidStateError, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FuturesTimeoutError
 from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
 from services.tomtom import TomTomService
 from services.openweather import OpenWeatherService
 from services.groq_llm import GroqLLMService
+from services.llm_batcher import LLMBatcher
+from utils import geometry
+from utils.reasoning_broker import ReasoningBroker
+from utils.route_scoring import LocalRouteScorer
 
 logger = logging.getLogger(__name__)
 
@@ -19,17 +28,80 @@ class RouteOptimizer:
         self, 
         tomtom_key: str,
         openweather_key: str,
-        groq_key: str
+        groq_key: str,
+        enrichment_deadline_s: float = 4.0,
+        max_workers: int = 8,
+        redis_url: Optional[str] = None,
+        weather_cache_ttl_s: float = 600,
+        weather_geohash_precision: int = 6,
+        corridor_samples: int = 5,
+        llm_cache_ttl_s: float = 900,
+        llm_margin: float = 0.05,
+        reasoning_broker: Optional[ReasoningBroker] = None,
+        llm_decision_timeout_s: float = 10.0,
+        llm_explain_local: bool = False,
+        llm_batch_max_size: int = 1,
+        llm_batch_max_wait_ms: float = 15,
+        tomtom_hedge_budget: float = 0.0
     ):
-        self.tomtom = TomTomService(tomtom_key)
-        self.weather = OpenWeatherService(openweather_key)
-        self.llm = GroqLLMService(groq_key)
+        # Hedging do routing TomTom (etapa mais lenta antes do LLM): 0 = desativado
+        self.tomtom = TomTomService(tomtom_key, hedge_budget=tomtom_hedge_budget)
+        self.weather = OpenWeatherService(
+            openweather_key,
+            geohash_precision=weather_geohash_precision,
+            cache_ttl_s=weather_cache_ttl_s,
+            redis_url=redis_url
+        )
+        self.llm = GroqLLMService(groq_key, cache_ttl_s=llm_cache_ttl_s, redis_url=redis_url)
+        # Micro-batching entre requisições (opcional): só com lotes > 1
+        self.llm_batcher = (
+            LLMBatcher(
+                self.llm,
+                max_batch=llm_batch_max_size,
+                max_wait_ms=llm_batch_max_wait_ms,
+                # Mesmo teto da decisão em streaming: depois, pontuação local
+                timeout_s=llm_decision_timeout_s
+            )
+            if llm_batch_max_size > 1 else None
+        )
+        # Orçamento único (segundos) para TODO o enriquecimento de uma requisição:
+        # as consultas de clima rodam em paralelo e o que não responder até o
+        # deadline é tratado como "sem dados" (fator 1.0)
+        self.enrichment_deadline_s = enrichment_deadline_s
+        # Pontuação local: o LLM só é chamado se a escolha for ambígua
+        self.scorer = LocalRouteScorer(margin=llm_margin)
+        # Pontos de clima amostrados ao longo de cada rota (corredor)
+        self.corridor_samples = corridor_samples
+        # Pool compartilhado entre requisições (evita criar threads por chamada)
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix="route-enrich"
+        )
+        # Justificativas assíncronas: geradas num pool separado (chamadas
+        # longas ao LLM não podem ocupar as threads de enriquecimento)
+        self.reasoning_broker = reasoning_broker
+        self._reasoning_executor = ThreadPoolExecutor(
+            max_workers=max(2, max_workers // 2),
+            thread_name_prefix="route-reasoning"
+        )
+        # Decisões em streaming: uma requisição espera cada uma, então não
+        # podem entrar na fila atrás das justificativas em background
+        self._decision_executor = ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix="route-decision"
+        )
+        # Espera máxima pela decisão do LLM antes de ficar com a escolha local
+        self.llm_decision_timeout_s = llm_decision_timeout_s
+        # Escolhas decididas localmente ficam com o texto do template, a não
+        # ser que a justificativa do LLM seja pedida (uma chamada Groq por rota)
+        self.llm_explain_local = llm_explain_local
     
     def optimize_route(
         self,
         origin: Tuple[float, float],
         destination: Tuple[float, float],
-        constraints: Optional[Dict] = None
+        constraints: Optional[Dict] = None,
+        defer_reasoning: bool = False
     ) -> Optional[Dict]:
         """
         Pipeline completo de otimização de rota
@@ -38,10 +110,16 @@ class RouteOptimizer:
             origin: (lat, lon) origem
             destination: (lat, lon) destino
             constraints: Dict com {"avoid": [...], "prefer": [...]}
+            defer_reasoning: Se True (e houver reasoning_broker), devolve a rota
+                assim que a escolha é feita, com uma justificativa provisória e um
+                reasoning_id; a justificativa do LLM é publicada depois no broker.
+                Escolhas locais já saem com a justificativa final (template),
+                salvo com llm_explain_local
             
         Returns:
             Dict com rota otimizada + justificativa
         """
+        defer_reasoning = defer_reasoning and self.reasoning_broker is not None
         if constraints is None:
             constraints = {"avoid": [], "prefer": ["fastest"]}
         
@@ -59,12 +137,98 @@ class RouteOptimizer:
             return None
         
         # 2. Enriquecer cada rota com dados climáticos e calcular scores
+        # Amostra K pontos ao longo do corredor de cada rota e consulta o clima
+        # de todos eles numa única passada paralela (deduplicada por geohash)
+        route_coords, corridors, all_points = self._prepare_corridors(tomtom_routes, origin, destination)
+        all_weather = self._fetch_weather_concurrently(all_points)
+        candidates = self._build_candidates(tomtom_routes, corridors, all_weather)
+        
+        # 3. Pontuação local; o LLM só entra se a escolha for ambígua
+        #    (candidatas dentro da margem) ou as constraints forem livres
+        local_result = self.scorer.score(constraints, candidates)
+        reasoning_id = None
+        llm_result = None
+        
+        if local_result["needs_llm"]:
+            logger.info(f"Calling LLM: {local_result['reason']}")
+            if defer_reasoning:
+                # Uma única chamada em streaming: a decisão volta para esta
+                # thread assim que chega e a justificativa segue para o broker
+                reasoning_id = self.reasoning_broker.create()
+                llm_result = self._stream_llm_decision(
+                    reasoning_id, constraints, candidates, local_result["selected_candidate"]
+                )
+            elif self.llm_batcher is not None:
+                llm_result = self.llm_batcher.analyze(constraints, candidates)
+            else:
+                llm_result = self.llm.analyze_routes(constraints, candidates)
+        
+        decision_source, selected_id, reasoning = self._resolve_decision(
+            constraints, candidates, local_result, llm_result
+        )
+        
+        # 4. Recupera a rota selecionada
+        selected_route = next((c for c in candidates if c["id"] == selected_id), candidates[0])
+        
+        # Justificativa assíncrona: texto provisório agora, texto do LLM via broker
+        # (escolha local: o template já é o final, salvo com llm_explain_local)
+        if defer_reasoning:
+            reasoning = reasoning or self.llm.explain_route_choice(selected_route, candidates, constraints)
+        if defer_reasoning and reasoning_id is None and (decision_source != "local" or self.llm_explain_local):
+            reasoning_id = self.reasoning_broker.create()
+            self._reasoning_executor.submit(
+                self._publish_reasoning,
+                reasoning_id,
+                constraints,
+                [dict(c) for c in candidates],
+                selected_route["id"],
+                reasoning
+            )
+        
+        # 5. Monta resposta final
+        return self._build_result(
+            origin, destination, constraints, candidates, route_coords,
+            selected_route, reasoning, decision_source, reasoning_id
+        )
+    
+    def _prepare_corridors(
+        self,
+        tomtom_routes: Dict,
+        origin: Tuple[float, float],
+        destination: Tuple[float, float]
+    ) -> Tuple[List[np.ndarray], List[Tuple[np.ndarray, np.ndarray]], List[Tuple[float, float]]]:
+        """
+        Converte a geometria de cada rota para array (uma única vez) e amostra
+        o corredor de clima
+        
+        Returns:
+            (geometrias (N, 2) por rota, (pontos, pesos) por rota, todos os pontos em ordem)
+        """
+        route_coords = [
+            geometry.to_array(route.get("geometry", []))
+            for route in tomtom_routes["routes"]
+        ]
+        corridors = [
+            self._sample_corridor(coords, origin, destination)
+            for coords in route_coords
+        ]
+        all_points = [tuple(p) for points, _ in corridors for p in points.tolist()]
+        return route_coords, corridors, all_points
+    
+    def _build_candidates(
+        self,
+        tomtom_routes: Dict,
+        corridors: List[Tuple[np.ndarray, np.ndarray]],
+        all_weather: List[Optional[Dict]]
+    ) -> List[Dict]:
+        """Monta as candidatas (features + score preliminar) a partir de rotas e clima"""
         candidates = []
+        offset = 0
         for idx, route in enumerate(tomtom_routes["routes"]):
-            # Amostra ponto médio da rota para clima
-            mid_point = self._get_route_midpoint(origin, destination)
-            weather_data = self.weather.get_weather(mid_point[0], mid_point[1])
-            weather_factor = self.weather.calculate_weather_factor(weather_data)
+            points, weights = corridors[idx]
+            samples = all_weather[offset:offset + len(points)]
+            offset += len(points)
+            weather_factor, weather_data = self._aggregate_weather(samples, weights)
             
             # Calcula fator de tráfego (já vem do TomTom summary)
             base_time = route["travel_time_seconds"]
@@ -92,52 +256,292 @@ class RouteOptimizer:
             candidates.append(candidate)
         
         logger.info(f"Enriched {len(candidates)} route candidates")
+        return candidates
+    
+    def _resolve_decision(
+        self,
+        constraints: Dict,
+        candidates: List[Dict],
+        local_result: Dict,
+        llm_result: Optional[Dict]
+    ) -> Tuple[str, int, Optional[str]]:
+        """
+        Combina pontuação local e resposta do LLM (se consultado)
         
-        # 3. Chamar LLM para análise inteligente
-        llm_result = self.llm.analyze_routes(constraints, candidates)
+        Returns:
+            (decision_source, selected_id, reasoning); reasoning é None quando o
+            LLM decidiu sem justificativa (ela chega depois)
+        """
+        if not local_result["needs_llm"]:
+            logger.info(f"Local scoring decided ({local_result['reason']}); skipping LLM")
+            selected_id = local_result["selected_candidate"]
+            selected = next(c for c in candidates if c["id"] == selected_id)
+            return "local", selected_id, self.llm.explain_route_choice(selected, candidates, constraints)
         
         if not llm_result:
-            # Fallback: escolhe rota com menor score preliminar
-            logger.warning("LLM failed, using fallback selection")
-            selected = min(candidates, key=lambda c: c["score_preliminary"])
-            selected_id = selected["id"]
-            reasoning = self.llm.explain_route_choice(selected, candidates, constraints)
-        else:
-            selected_id = llm_result["selected_candidate"]
-            reasoning = llm_result["reasoning"]
-            weights = llm_result.get("weights", {})
-            
-            # Aplica pesos do LLM aos candidatos
-            for candidate in candidates:
-                penalties = 0
-                penalties += weights.get("toll", 0) * candidate["toll_count"]
-                penalties += weights.get("unpaved", 0) * (candidate["unpaved_meters"] / 1000)
-                
-                candidate["score_final"] = (
-                    candidate["score_preliminary"] + penalties
-                )
+            # Fallback: fica com a escolha da pontuação local
+            logger.warning("LLM failed, using local scoring selection")
+            selected_id = local_result["selected_candidate"]
+            selected = next(c for c in candidates if c["id"] == selected_id)
+            return "fallback", selected_id, self.llm.explain_route_choice(selected, candidates, constraints)
         
-        # 4. Recupera a rota selecionada
-        selected_route = next((c for c in candidates if c["id"] == selected_id), candidates[0])
-        original_tomtom_route = tomtom_routes["routes"][selected_id - 1]
+        weights = llm_result.get("weights", {})
         
-        # 5. Monta resposta final
+        # Aplica pesos do LLM aos candidatos
+        for candidate in candidates:
+            penalties = 0
+            penalties += weights.get("toll", 0) * candidate["toll_count"]
+            penalties += weights.get("unpaved", 0) * (candidate["unpaved_meters"] / 1000)
+            
+            candidate["score_final"] = (
+                candidate["score_preliminary"] + penalties
+            )
+        
+        return "llm", llm_result["selected_candidate"], llm_result.get("reasoning")
+    
+    def _build_result(
+        self,
+        origin: Tuple[float, float],
+        destination: Tuple[float, float],
+        constraints: Dict,
+        candidates: List[Dict],
+        route_coords: List[np.ndarray],
+        selected_route: Dict,
+        reasoning: Optional[str],
+        decision_source: str,
+        reasoning_id: Optional[str]
+    ) -> Dict:
+        """Monta o dicionário de resposta de optimize_route"""
+        selected_coords = route_coords[selected_route["id"] - 1]
         result = {
             "selected_route": {
                 **selected_route,
-                "geometry": original_tomtom_route.get("geometry", []),
+                # Geometria como array (N, 2) [lat, lon]; serialização fica com
+                # quem monta a resposta (ex: polyline codificada)
+                "geometry": selected_coords,
+                "length_m": geometry.length(selected_coords),
+                "bbox": geometry.bounding_box(selected_coords),
                 "duration_adjusted_min": selected_route.get("score_final", selected_route["score_preliminary"]) / 60
             },
             "alternatives": candidates,
             "reasoning": reasoning,
+            "decision_source": decision_source,  # "local", "llm" ou "fallback"
+            "reasoning_id": reasoning_id,  # None se a justificativa já é a final
             "constraints_applied": constraints,
             "origin": {"lat": origin[0], "lon": origin[1]},
             "destination": {"lat": destination[0], "lon": destination[1]}
         }
         
-        logger.info(f"Route optimization complete. Selected route {selected_id}.")
+        logger.info(f"Route optimization complete. Selected route {selected_route['id']}.")
         return result
     
+    def _stream_llm_decision(
+        self,
+        reasoning_id: str,
+        constraints: Dict,
+        candidates: List[Dict],
+        fallback_id: int
+    ) -> Optional[Dict]:
+        """
+        Roda analyze_routes em streaming no pool de decisões e espera
+        apenas a decisão (pesos + escolha); os tokens da justificativa são
+        publicados no broker como eventos "token" até o texto final.
+        
+        Returns:
+            {"weights", "selected_candidate"} ou None se o LLM falhar ou
+            não decidir em llm_decision_timeout_s
+        """
+        decision: Future = Future()
+        self._decision_executor.submit(
+            self._stream_llm_reasoning,
+            reasoning_id,
+            constraints,
+            [dict(c) for c in candidates],
+            fallback_id,
+            decision
+        )
+        try:
+            return decision.result(timeout=self.llm_decision_timeout_s)
+        except FuturesTimeoutError:
+            # cancel() falha se a decisão chegou entre o timeout e aqui
+            if not decision.cancel():
+                return decision.result()
+            logger.warning(
+                f"LLM decision timed out after {self.llm_decision_timeout_s}s for {reasoning_id}; "
+                f"using local scoring selection"
+            )
+            return None
+    
+    def _stream_llm_reasoning(
+        self,
+        reasoning_id: str,
+        constraints: Dict,
+        candidates: List[Dict],
+        fallback_id: int,
+        decision: Future
+    ) -> None:
+        """
+        Consome o stream do LLM: entrega a decisão e publica a justificativa
+
+        Se a requisição desistiu da decisão (timeout), a resposta saiu com a
+        escolha local (fallback_id): a justificativa do LLM só é publicada
+        se ele escolheu a mesma rota.
+        """
+        def settle(value: Optional[Dict]) -> None:
+            try:
+                decision.set_result(value)
+            except InvalidStateError:
+                pass  # Já decidido ou abandonado pela requisição
+        
+        def on_token(text: str) -> None:
+            self.reasoning_broker.publish(reasoning_id, "token", {"text": text})
+        
+        result = None
+        if not decision.cancelled():
+            try:
+                result = self.llm.analyze_routes(
+                    constraints, candidates, on_decision=settle, on_reasoning_token=on_token
+                )
+            except Exception as e:
+                logger.error(f"Streaming LLM analysis failed for {reasoning_id}: {e}")
+            finally:
+                settle(result)
+        
+        try:
+            chosen = None if decision.cancelled() else decision.result()
+            if result and result.get("reasoning") and (chosen or result.get("selected_candidate") == fallback_id):
+                self.reasoning_broker.publish(
+                    reasoning_id, "reasoning", {"text": result["reasoning"], "source": "llm"}
+                )
+            else:
+                selected_id = chosen["selected_candidate"] if chosen else fallback_id
+                selected = next((c for c in candidates if c["id"] == selected_id), candidates[0])
+                self.reasoning_broker.publish(reasoning_id, "reasoning", {
+                    "text": self.llm.explain_route_choice(selected, candidates, constraints),
+                    "source": "fallback"
+                })
+        finally:
+            self.reasoning_broker.close(reasoning_id)
+    
+    def _publish_reasoning(
+        self,
+        reasoning_id: str,
+        constraints: Dict,
+        candidates: List[Dict],
+        selected_id: int,
+        fallback_text: str
+    ) -> None:
+        """Gera a justificativa com o LLM (em background) e publica no broker"""
+        try:
+            text = self.llm.explain_routes(constraints, candidates, selected_id)
+            if text:
+                self.reasoning_broker.publish(reasoning_id, "reasoning", {"text": text, "source": "llm"})
+            else:
+                self.reasoning_broker.publish(reasoning_id, "reasoning", {"text": fallback_text, "source": "fallback"})
+        except Exception as e:
+            logger.error(f"Async reasoning failed for {reasoning_id}: {e}")
+            self.reasoning_broker.publish(reasoning_id, "reasoning", {"text": fallback_text, "source": "fallback"})
+        finally:
+            self.reasoning_broker.close(reasoning_id)
+    
+    def _fetch_weather_concurrently(
+        self,
+        points: List[Tuple[float, float]]
+    ) -> List[Optional[Dict]]:
+        """
+        Consulta o clima de vários pontos em paralelo (fan-out)
+        
+        Todas as consultas compartilham um único deadline
+        (self.enrichment_deadline_s), então a latência total fica limitada
+        pela chamada mais lenta, e não pela soma delas.
+        
+        Args:
+            points: Lista de (lat, lon)
+            
+        Returns:
+            Lista alinhada com points; None para pontos sem resposta no prazo
+        """
+        if not points:
+            return []
+        
+        # Memo da requisição: pontos equivalentes viram uma única consulta
+        keys = [self.weather.location_key(lat, lon) for lat, lon in points]
+        unique_points = {}
+        for key, point in zip(keys, points):
+            unique_points.setdefault(key, point)
+        
+        futures = {
+            key: self._executor.submit(self.weather.get_weather, lat, lon)
+            for key, (lat, lon) in unique_points.items()
+        }
+        done, not_done = wait(futures.values(), timeout=self.enrichment_deadline_s)
+        
+        if not_done:
+            logger.warning(
+                f"Weather enrichment deadline ({self.enrichment_deadline_s}s) exceeded: "
+                f"{len(not_done)}/{len(futures)} lookups without response"
+            )
+            for future in not_done:
+                future.cancel()  # Só tem efeito se ainda estiver na fila
+        
+        memo = {}
+        for key, future in futures.items():
+            if future in done and not future.cancelled() and future.exception() is None:
+                memo[key] = future.result()
+            else:
+                memo[key] = None  # Graceful degradation: fator 1.0
+        
+        logger.debug(f"Weather enrichment: {len(points)} points, {len(futures)} upstream lookups")
+        return [memo[key] for key in keys]
+    
+    def _sample_corridor(
+        self,
+        coords: np.ndarray,
+        origin: Tuple[float, float],
+        destination: Tuple[float, float]
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Amostra pontos igualmente espaçados (por distância) ao longo da rota
+        
+        Args:
+            coords: Geometria da rota, array (N, 2) [lat, lon]
+            origin: (lat, lon) usado no fallback sem geometria
+            destination: (lat, lon) usado no fallback sem geometria
+            
+        Returns:
+            (pontos (K, 2) [lat, lon], pesos (K,) em metros de rota por amostra)
+        """
+        if len(coords) < 2:
+            # Sem geometria: volta ao ponto médio em linha reta
+            mid = self._get_route_midpoint(origin, destination)
+            return np.array([mid], dtype=np.float64), np.ones(1, dtype=np.float64)
+        return geometry.sample_evenly(coords, self.corridor_samples)
+    
+    def _aggregate_weather(
+        self,
+        samples: List[Optional[Dict]],
+        weights: np.ndarray
+    ) -> Tuple[float, Optional[Dict]]:
+        """
+        Combina o clima das amostras do corredor num único fator
+        
+        O fator é a média ponderada pela distância de rota que cada amostra
+        representa (amostras sem dados contam como 1.0, igual ao ponto único).
+        
+        Returns:
+            (weather_factor, clima da amostra mais severa para a descrição)
+        """
+        factors = np.array(
+            [self.weather.calculate_weather_factor(w) for w in samples],
+            dtype=np.float64
+        )
+        weather_factor = float(np.average(factors, weights=weights)) if weights.sum() > 0 else 1.0
+        
+        # A descrição mostra o trecho mais severo (o que o usuário vai enfrentar)
+        available = [(f, w) for f, w in zip(factors, samples) if w is not None]
+        worst = max(available, key=lambda item: item[0])[1] if available else None
+        return weather_factor, worst
+    
     def _get_route_midpoint(
         self, 
         origin: Tuple[float, float], 
@@ -0,0 +1,118 @@
+# utils/route_scoring.py
+"""
+Motor de pontuação local (determinístico) para as rotas candidatas
+
+Reproduz a conta que o prompt do LLM pede:
+    score = base_time * traffic_factor * weather_factor + penalidades
+com pesos padrão derivados das constraints estruturadas do bottom sheet.
+O LLM só é necessário quando as melhores candidatas ficam próximas demais
+(dentro de uma margem) ou quando as constraints são livres/desconhecidas.
+"""
+import logging
+from typing import Dict, List
+
+logger = logging.getLogger(__name__)
+
+# Vocabulário estruturado enviado pelo frontend (templates/bottom_sheet.html)
+KNOWN_AVOID = {"toll", "unpaved", "highway", "ferry"}
+KNOWN_PREFER = {"fastest", "shortest"}
+
+# Penalidades padrão (segundos) quando o usuário pede para evitar algo
+DEFAULT_WEIGHTS = {
+    "toll": 600,      # 10 min por pedágio
+    "unpaved": 300,   # 5 min por km de estrada de terra
+}
+
+# "Mais curta": distância convertida em segundos equivalentes (~40 km/h)
+SHORTEST_SECONDS_PER_KM = 90
+
+
+class LocalRouteScorer:
+    """
+    Escolhe a rota localmente quando a resposta é inequívoca
+    
+    Métodos principais:
+    - weights_for(constraints): Pesos padrão para as constraints
+    - score(constraints, candidates): Pontua e indica se o LLM é necessário
+    """
+    
+    def __init__(self, margin: float = 0.05):
+        """
+        Args:
+            margin: Diferença relativa mínima entre a melhor e a segunda melhor
+                candidata para dispensar o LLM (0.05 = 5%)
+        """
+        self.margin = margin
+    
+    def is_structured(self, constraints: Dict) -> bool:
+        """True se as constraints usam apenas o vocabulário conhecido"""
+        if not isinstance(constraints, dict):
+            return False
+        if set(constraints) - {"avoid", "prefer"}:
+            return False
+        avoid = constraints.get("avoid") or []
+        prefer = constraints.get("prefer") or []
+        if not isinstance(avoid, list) or not isinstance(prefer, list):
+            return False
+        # Itens que não são texto (ex: {"type": "toll"}) são livres: vão para o LLM
+        if not all(isinstance(item, str) for item in avoid + prefer):
+            return False
+        return set(avoid) <= KNOWN_AVOID and set(prefer) <= KNOWN_PREFER
+    
+    def weights_for(self, constraints: Dict) -> Dict[str, float]:
+        """Pesos (penalidades em segundos) para cada restrição "avoid" com feature mensurável"""
+        avoid = constraints.get("avoid") or []
+        return {k: w for k, w in DEFAULT_WEIGHTS.items() if k in avoid}
+    
+    def score(self, constraints: Dict, candidates: List[Dict]) -> Dict:
+        """
+        Pontua as candidatas (menor score = melhor)
+        
+        Args:
+            constraints: {"avoid": [...], "prefer": [...]}
+            candidates: Candidatas enriquecidas pelo RouteOptimizer
+            
+        Returns:
+            Dict com {
+                "weights": {...},
+                "selected_candidate": id,
+                "scores": {id: score},
+                "needs_llm": bool,     # constraints livres ou empate técnico
+                "reason": str          # por que o LLM é (ou não) necessário
+            }
+        """
+        structured = self.is_structured(constraints)
+        weights = self.weights_for(constraints) if structured else dict(DEFAULT_WEIGHTS)
+        prefer = (constraints.get("prefer") or []) if structured else []
+        
+        scores = {}
+        for c in candidates:
+            penalties = (
+                weights.get("toll", 0) * c.get("toll_count", 0)
+                + weights.get("unpaved", 0) * (c.get("unpaved_meters", 0) / 1000)
+            )
+            # score_final mantém a unidade de tempo (usado em duration_adjusted_min)
+            c["score_final"] = c["score_preliminary"] + penalties
+            if "shortest" in prefer:
+                scores[c["id"]] = c["distance_km"] * SHORTEST_SECONDS_PER_KM + penalties
+            else:
+                scores[c["id"]] = c["score_final"]
+        
+        ranked = sorted(scores.items(), key=lambda item: item[1])
+        selected_id = ranked[0][0]
+        
+        if not structured:
+            needs_llm, reason = True, "constraints livres"
+        elif len(ranked) > 1 and ranked[0][1] > 0 and (ranked[1][1] - ranked[0][1]) / ranked[0][1] < self.margin:
+            needs_llm, reason = True, f"candidatas {ranked[0][0]} e {ranked[1][0]} dentro da margem de {self.margin:.0%}"
+        else:
+            needs_llm, reason = False, "escolha inequívoca"
+        
+        logger.debug(f"Local scoring: {scores} -> {selected_id} (needs_llm={needs_llm}: {reason})")
+        return {
+            "weights": weights,
+            "selected_candidate": selected_id,
+            "scores": scores,
+            "needs_llm": needs_llm,
+            "reason": reason
+        }
@@ -0,0 +1,471 @@
+# utils/trajectory.py
+"""
+Compressão de trilhas GPS antes da gravação
+
+O geolocation.js (watchPosition, maximumAge 1000 ms) manda ~1 fix por
+segundo; parado num semáforo ou andando em linha reta, quase todos são
+redundantes. O TrajectoryCompressor filtra cada lote por dispositivo:
+
+1. encaixe na rota (opcional): fixes perto da polyline da rota que o
+   dispositivo está seguindo são projetados nela, o que elimina o ruído
+   lateral do GPS e deixa o trecho reto de verdade
+2. pontos parados: fixes a menos de stationary_m do último ponto mantido
+   são descartados; ficam um "heartbeat" a cada heartbeat_s e o último
+   fix de cada parada (o instante da partida)
+3. compressão:
+   - "douglas_peucker": Douglas-Peucker em streaming: os candidatos desde
+     o último ponto mantido formam uma cauda por dispositivo, que atravessa
+     os lotes; um ponto só é gravado quando o DP o decide (o fim da cauda
+     espera o próximo fix, no máximo heartbeat_s), então a taxa de
+     compressão não depende do tamanho dos lotes
+   - "dead_reckoning": mantém um fix só quando ele se afasta mais de
+     tolerance_m da posição prevista pela velocidade (suavizada) entre os
+     pontos mantidos (decisão ponto a ponto, sem segurar fixes)
+
+Roda na thread escritora do GPSIngestor, então um lote recusado por
+backpressure (e reenviado pelo cliente) não chega a mexer no estado.
+
+O estado por dispositivo (último ponto mantido, cauda) fica em memória no
+processo; um lote que cai em outro worker só perde a âncora, ou seja,
+mantém um ponto a mais. Caudas de dispositivos que pararam de mandar
+fixes são fechadas por flush() (chamado pela thread escritora).
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from services.cache import TieredCache
+from services.metrics import metrics
+from utils.gps_ingest import GPS_RECORD
+from utils.geometry import decode_polyline, simplify_mask, snap_to_polyline, to_local_meters
+
+logger = logging.getLogger(__name__)
+
+COMPRESSION_METHODS = ("douglas_peucker", "dead_reckoning")
+# Paradas mais longas que isso mantêm o fix da partida
+STOP_MIN_MS = 5000
+# Constante de tempo da suavização da velocidade no dead reckoning
+VELOCITY_SMOOTHING_MS = 5000
+# Teto da cauda do Douglas-Peucker (fontes com muitos fixes por segundo)
+MAX_TAIL_POINTS = 4096
+
+
+class DeviceRouteRegistry:
+    """
+    Rota seguida por dispositivo (polyline6), compartilhada entre processos
+
+    A camada remota do cache (Redis/SQLite) é a fonte da verdade; a LRU
+    local guarda cada resposta só por local_ttl_s, inclusive "sem rota"
+    (cache negativo). Assim uma troca de rota feita em outro worker vale
+    aqui em segundos, e dispositivos sem rota não custam uma ida ao Redis
+    a cada lote gravado.
+
+    Métodos principais:
+    - set(device, polyline): Registra a rota ("" ou None encerra)
+    - get(device): polyline6 ou None
+    """
+
+    def __init__(self, cache: TieredCache, ttl_s: float, local_ttl_s: float = 5.0):
+        """
+        Args:
+            cache: Cache com camada remota (sem ela, a LRU local é a única cópia)
+            ttl_s: Validade da rota registrada
+            local_ttl_s: Quanto tempo cada worker reaproveita a última leitura
+        """
+        self.cache = cache
+        self.ttl_s = ttl_s
+        self.local_ttl_s = local_ttl_s
+
+    def set(self, device: int, polyline: Optional[str]) -> None:
+        key = str(device)
+        if self.cache.remote is None:
+            self.cache.local.set(key, polyline or "", self.ttl_s)
+            return
+        self.cache.remote.set(key, polyline or "", self.ttl_s)
+        self.cache.local.set(key, polyline or "", self.local_ttl_s)
+
+    def get(self, device: int) -> Optional[str]:
+        key = str(device)
+        value = self.cache.local.get(key)
+        if value is None and self.cache.remote is not None:
+            value = self.cache.remote.get(key) or ""
+            self.cache.local.set(key, value, self.local_ttl_s)
+        return value or None
+
+
+class _DeviceState:
+    """Último ponto mantido de um dispositivo, cauda pendente (DP) e velocidade (dead reckoning)"""
+
+    __slots__ = ("last", "seen", "tail", "touched", "pending", "velocity", "route_key", "route")
+
+    def __init__(self):
+        self.last: Optional[Tuple[float, float, int]] = None  # lat, lon, timestamp (ms)
+        self.seen: Optional[int] = None  # timestamp do fix mais recente recebido
+        # Douglas-Peucker: candidatos depois de last ainda não decididos
+        self.tail: Optional[np.ndarray] = None
+        self.touched = 0.0  # time.monotonic() da última atualização da cauda
+        # Último fix descartado do lote anterior: volta a ser avaliado no
+        # próximo lote (pode ser o fix da partida de uma parada)
+        self.pending: Optional[np.ndarray] = None
+        self.velocity: Tuple[float, float] = (0.0, 0.0)  # x, y (m/ms)
+        self.route_key: Optional[str] = None
+        self.route: Optional[np.ndarray] = None
+
+
+class TrajectoryCompressor:
+    """
+    Filtro de fixes GPS_RECORD por dispositivo (thread-safe)
+
+    Métodos principais:
+    - compress(records): Devolve só os fixes que precisam ser gravados
+    - flush(idle_s): Fecha as caudas de dispositivos parados há idle_s (None = todas)
+    - stats(): Fixes recebidos/mantidos/encaixados e taxa de compressão
+    """
+
+    def __init__(
+        self,
+        tolerance_m: float = 10.0,
+        stationary_m: float = 5.0,
+        heartbeat_s: float = 60.0,
+        method: str = "douglas_peucker",
+        snap_max_m: float = 25.0,
+        route_lookup: Optional[Callable[[int], Optional[str]]] = None,
+        max_devices: int = 100_000
+    ):
+        """
+        Args:
+            tolerance_m: Desvio máximo da trilha comprimida (metros)
+            stationary_m: Deslocamento abaixo do qual o fix conta como parado
+            heartbeat_s: Intervalo máximo sem gravar nenhum ponto do dispositivo
+            method: "douglas_peucker" ou "dead_reckoning"
+            snap_max_m: Distância máxima à rota para encaixar um fix
+            route_lookup: device -> polyline6 da rota seguida (ou None),
+                ex: DeviceRouteRegistry.get
+            max_devices: Dispositivos com estado em memória (LRU)
+        """
+        if method not in COMPRESSION_METHODS:
+            raise ValueError(f"Método de compressão inválido: {method}")
+        self.tolerance_m = tolerance_m
+        self.stationary_m = stationary_m
+        self.heartbeat_ms = int(heartbeat_s * 1000)
+        self.method = method
+        self.snap_max_m = snap_max_m
+        self.route_lookup = route_lookup
+        self.max_devices = max_devices
+
+        self._devices: "OrderedDict[int, _DeviceState]" = OrderedDict()
+        # Dispositivos com cauda aberta, do lote mais antigo ao mais recente
+        self._open_tails: "OrderedDict[int, None]" = OrderedDict()
+        # Fins de cauda de dispositivos despejados da LRU (saem no próximo flush)
+        self._orphans: List[np.ndarray] = []
+        self._lock = threading.Lock()
+        self._received = 0
+        self._kept = 0
+        self._snapped = 0
+
+    def compress(self, records: np.ndarray) -> np.ndarray:
+        """
+        Filtra um lote de GPS_RECORD (um ou mais dispositivos)
+
+        Fixes repetidos ou mais antigos que o último fix recebido do
+        dispositivo são descartados. O resultado sai agrupado por
+        dispositivo e em ordem de tempo dentro de cada um.
+        """
+        if len(records) == 0:
+            return records
+
+        order = np.lexsort((records["timestamp"], records["device"]))
+        records = records[order]
+        devices = records["device"]
+        bounds = np.flatnonzero(np.concatenate(([True], devices[1:] != devices[:-1]), axis=None))
+        bounds = np.append(bounds, len(records))
+
+        # Rotas consultadas fora do lock (o lookup pode ir ao Redis)
+        routes = {int(devices[start]): self._lookup_route(int(devices[start])) for start in bounds[:-1]}
+
+        kept: List[np.ndarray] = []
+        snapped = 0
+        with self._lock:
+            for start, end in zip(bounds[:-1], bounds[1:]):
+                device = int(devices[start])
+                group, group_snapped = self._compress_device(device, records[start:end], routes[device])
+                kept.append(group)
+                snapped += group_snapped
+            self._received += len(records)
+            self._kept += sum(len(group) for group in kept)
+            self._snapped += snapped
+
+        result = np.concatenate(kept)
+        metrics.incr("trajectory.received", len(records))
+        metrics.incr("trajectory.kept", len(result))
+        if snapped:
+            metrics.incr("trajectory.snapped", snapped)
+        return result
+
+    def flush(self, idle_s: Optional[float] = None) -> np.ndarray:
+        """
+        Grava o fim da cauda dos dispositivos sem lote há idle_s segundos
+
+        Sem isso, o último trecho de uma viagem só seria decidido quando o
+        dispositivo voltasse a mandar fixes. idle_s=None fecha todas as
+        caudas (encerramento do processo).
+        """
+        deadline = None if idle_s is None else time.monotonic() - idle_s
+        with self._lock:
+            closed = self._orphans
+            self._orphans = []
+            while self._open_tails:
+                device = next(iter(self._open_tails))
+                state = self._devices.get(device)
+                if state is not None and deadline is not None and state.touched > deadline:
+                    break
+                del self._open_tails[device]
+                if state is not None:
+                    closed.append(self._close_tail(state))
+            count = sum(len(part) for part in closed)
+            self._kept += count
+
+        if not closed:
+            return np.empty(0, dtype=GPS_RECORD)
+        metrics.incr("trajectory.kept", count)
+        return np.concatenate(closed)
+
+    @staticmethod
+    def _close_tail(state: _DeviceState) -> np.ndarray:
+        """Mantém o último candidato da cauda (o que já foi decidido saiu antes)"""
+        tail = state.tail
+        state.tail = None
+        if tail is None or len(tail) == 0:
+            return np.empty(0, dtype=GPS_RECORD)
+        last = tail[-1]
+        state.last = (float(last["lat"]), float(last["lon"]), int(last["timestamp"]))
+        return tail[-1:].copy()
+
+    def _state(self, device: int) -> _DeviceState:
+        state = self._devices.get(device)
+        if state is None:
+            state = self._devices[device] = _DeviceState()
+            if len(self._devices) > self.max_devices:
+                evicted, old = self._devices.popitem(last=False)
+                self._open_tails.pop(evicted, None)
+                if old.tail is not None and len(old.tail):
+                    self._orphans.append(self._close_tail(old))
+        else:
+            self._devices.move_to_end(device)
+        return state
+
+    def _lookup_route(self, device: int) -> Optional[str]:
+        if self.route_lookup is None:
+            return None
+        try:
+            return self.route_lookup(device)
+        except Exception as e:
+            logger.warning(f"Route lookup failed for device {device}: {e}")
+            return None
+
+    @staticmethod
+    def _route(state: _DeviceState, encoded: Optional[str]) -> Optional[np.ndarray]:
+        """Polyline da rota seguida (decodificada só quando muda)"""
+        if encoded != state.route_key:
+            try:
+                state.route = decode_polyline(encoded) if encoded else None
+            except ValueError:
+                state.route = None
+            state.route_key = encoded
+        return state.route
+
+    def _compress_device(self, device: int, records: np.ndarray, encoded_route: Optional[str]) -> Tuple[np.ndarray, int]:
+        state = self._state(device)
+        if state.seen is not None:
+            records = records[records["timestamp"] > state.seen]
+        if len(records) == 0:
+            return records, 0
+        state.seen = int(records["timestamp"][-1])
+
+        records = records.copy()
+        snapped = 0
+        route = self._route(state, encoded_route)
+        if route is not None and len(route) >= 2:
+            coords = np.column_stack((records["lat"], records["lon"]))
+            coords, dist = snap_to_polyline(coords, route, self.snap_max_m)
+            records["lat"], records["lon"] = coords[:, 0], coords[:, 1]
+            snapped = int(np.count_nonzero(dist <= self.snap_max_m))
+        if state.pending is not None:
+            records = np.concatenate((state.pending, records))
+
+        # Referência do filtro de parada: último candidato da cauda ou,
+        # sem cauda, o último ponto mantido (mesma projeção local do lote)
+        if state.tail is not None and len(state.tail):
+            ref = state.tail[-1]
+            ref_point = (float(ref["lat"]), float(ref["lon"]), int(ref["timestamp"]))
+        else:
+            ref_point = state.last
+        anchored = ref_point is not None
+        coords = np.column_stack((records["lat"], records["lon"]))
+        ts = records["timestamp"]
+        if anchored:
+            coords = np.vstack(([ref_point[:2]], coords))
+            ts = np.concatenate(([ref_point[2]], ts))
+        xy = to_local_meters(coords, float(coords[0, 0]))
+
+        moving, forced = self._moving(xy, ts, anchored)
+        if self.method == "dead_reckoning":
+            keep = self._dead_reckoning(xy, ts, forced, state)
+        else:
+            keep = moving | forced
+        keep[0] = not anchored
+        arrived = anchored and bool(forced[0])
+        if anchored:
+            keep, forced = keep[1:], forced[1:]
+        # Último fix parado do lote: reavaliado no próximo (partida de uma parada)
+        state.pending = None if keep[-1] else records[-1:].copy()
+
+        if self.method == "dead_reckoning":
+            kept = records[keep]
+        else:
+            kept = self._douglas_peucker(device, state, records[keep], forced[keep], arrived)
+        if len(kept):
+            last = kept[-1]
+            state.last = (float(last["lat"]), float(last["lon"]), int(last["timestamp"]))
+        return kept, snapped
+
+    def _moving(self, xy: np.ndarray, ts: np.ndarray, anchored: bool) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Separa os fixes parados
+
+        Returns:
+            (moving, forced): máscaras dos fixes que saíram do raio
+            stationary_m do ponto de referência anterior e dos fixes
+            que precisam ficar (chegada, heartbeat e partida de uma parada;
+            forced[0] marca a chegada no ponto de referência)
+        """
+        n = len(xy)
+        moving = np.zeros(n, dtype=bool)
+        forced = np.zeros(n, dtype=bool)
+        moving[0] = not anchored
+        x, y = xy[:, 0].tolist(), xy[:, 1].tolist()
+        t = ts.tolist()
+        ref = 0
+        stopped = False
+        limit2 = self.stationary_m ** 2
+        for i in range(1, n):
+            if (x[i] - x[ref]) ** 2 + (y[i] - y[ref]) ** 2 >= limit2:
+                if t[i - 1] - t[ref] >= STOP_MIN_MS:
+                    forced[i - 1] = True
+                moving[i] = True
+                ref = i
+                stopped = False
+                continue
+            if not stopped and t[i] - t[ref] >= STOP_MIN_MS:
+                # Sem a chegada, a interpolação no tempo espalharia a parada
+                forced[ref] = True
+                stopped = True
+            if t[i] - t[ref] >= self.heartbeat_ms:
+                forced[i] = True
+                ref = i
+        return moving, forced
+
+    def _douglas_peucker(
+        self,
+        device: int,
+        state: _DeviceState,
+        candidates: np.ndarray,
+        forced: np.ndarray,
+        tail_forced: bool = False
+    ) -> np.ndarray:
+        """
+        Douglas-Peucker em streaming sobre âncora + cauda + candidatos do lote
+
+        Saem os pontos que o DP mantém no trecho, os forçados e os que
+        fecham heartbeat_s sem ponto gravado; o último candidato fica
+        pendente nos outros casos (o próximo fix ainda pode prolongar o
+        trecho reto). O que vem depois do último ponto gravado vira a nova
+        cauda.
+        """
+        emitted = []
+        if state.last is None and len(candidates):
+            # Primeiro fix do dispositivo: vira a âncora
+            emitted.append(candidates[:1])
+            state.last = (float(candidates[0]["lat"]), float(candidates[0]["lon"]), int(candidates[0]["timestamp"]))
+            candidates, forced = candidates[1:], forced[1:]
+
+        tail = state.tail if state.tail is not None else candidates[:0]
+        window = np.concatenate((tail, candidates))
+        if len(window) == 0:
+            return np.concatenate(emitted) if emitted else window
+        window_forced = np.concatenate((np.zeros(len(tail), dtype=bool), forced))
+        if tail_forced and len(tail):
+            # Chegada de uma parada detectada só neste lote
+            window_forced[len(tail) - 1] = True
+
+        coords = np.vstack(([state.last[:2]], np.column_stack((window["lat"], window["lon"]))))
+        keep = simplify_mask(coords, self.tolerance_m)[1:] | window_forced
+        # O DP sempre mantém o fim do trecho; aqui ele só sai se for forçado
+        keep[-1] = window_forced[-1] or len(window) >= MAX_TAIL_POINTS
+        # Heartbeat: nenhum intervalo entre pontos gravados passa de heartbeat_s
+        previous = state.last[2]
+        for i, t in enumerate(window["timestamp"].tolist()):
+            if not keep[i] and t - previous >= self.heartbeat_ms:
+                keep[i] = True
+            if keep[i]:
+                previous = t
+
+        decided = np.flatnonzero(keep)
+        if len(decided):
+            emitted.append(window[keep])
+            window = window[decided[-1] + 1:]
+        state.tail = window.copy() if len(window) else None
+        if state.tail is not None:
+            state.touched = time.monotonic()
+            self._open_tails[device] = None
+            self._open_tails.move_to_end(device)
+        else:
+            self._open_tails.pop(device, None)
+        return np.concatenate(emitted) if emitted else candidates[:0]
+
+    def _dead_reckoning(
+        self,
+        xy: np.ndarray,
+        ts: np.ndarray,
+        forced: np.ndarray,
+        state: _DeviceState
+    ) -> np.ndarray:
+        """Mantém o fix quando ele diverge da posição prevista pela última velocidade"""
+        keep = np.zeros(len(xy), dtype=bool)
+        x, y = xy[:, 0].tolist(), xy[:, 1].tolist()
+        t = ts.tolist()
+        tolerance2 = self.tolerance_m ** 2
+        vx, vy = state.velocity
+        ref = 0
+        # Todos os fixes são testados: parado, o previsto (que segue andando)
+        # se afasta do real e a chegada na parada fica registrada
+        for i in range(1, len(xy)):
+            dt = t[i] - t[ref]
+            px, py = x[ref] + vx * dt, y[ref] + vy * dt
+            if forced[i] or (x[i] - px) ** 2 + (y[i] - py) ** 2 > tolerance2:
+                keep[i] = True
+                if dt > 0:
+                    # Média móvel ponderada pelo intervalo: velocidades de
+                    # pontos muito próximos no tempo são dominadas pelo ruído
+                    w = dt / (dt + VELOCITY_SMOOTHING_MS)
+                    vx = w * (x[i] - x[ref]) / dt + (1 - w) * vx
+                    vy = w * (y[i] - y[ref]) / dt + (1 - w) * vy
+                ref = i
+        state.velocity = (vx, vy)
+        return keep
+
+    def stats(self) -> Dict:
+        """Snapshot para /metrics"""
+        with self._lock:
+            return {
+                "method": self.method,
+                "devices": len(self._devices),
+                "received": self._received,
+                "kept": self._kept,
+                "snapped": self._snapped,
+                "ratio": round(self._received / self._kept, 2) if self._kept else None
+            }